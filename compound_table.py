@@ -0,0 +1,440 @@
+"""
+Integer-indexed compound tables
+"""
+
+import collections
+
+import numpy as np
+
+
+ATOM_LIST = 'CHONS'
+
+CompoundColumns = collections.namedtuple('CompoundColumns', [
+    'names', 'index', 'group_names', 'groups',
+    'atom_names', 'atoms', 'mass', 'extra'])
+ReactionColumns = collections.namedtuple('ReactionColumns', [
+    'names', 'group_names', 'c1_reqs', 'c2_reqs', 'needs_c2',
+    'group_trans', 'atom_trans', 'uses_c1', 'uses_c2', 'mass_trans'])
+
+def parse_compound_name(name):
+    """ Parse name and return compounds and reaction
+    """
+    assert name[0] == '(' and name[-1] == ')'
+
+    state = 'idle'
+    depth = 0
+
+    c1 = ''
+    r = ''
+    c2 = ''
+
+    for char in name:
+        if char in '({': depth += 1
+        if char in ')}': depth -= 1
+
+        if state == 'idle':
+            if depth > 0:
+                if len(c1) == 0: state = 'c1'
+                elif len(r) == 0: state = 'r'
+                elif len(c2) == 0: state = 'c2'
+        elif state == 'c1':
+            if depth > 0:
+                c1 += char
+            else:
+                state = 'idle'
+        elif state == 'r':
+            if depth > 0:
+                r += char
+            else:
+                state = 'idle'
+        elif state == 'c2':
+            if depth > 0:
+                c2 += char
+            else:
+                state = 'idle'
+
+    assert state == 'idle'
+    return c1, r, c2
+
+class ProvenanceTable(object):
+    """ Store compound provenance as DAG over integer ids.
+        Each product is a row `(id, c1_id, reaction_id, c2_id)` (-1 for None),
+        names are only rendered on output
+    """
+    def __init__(self):
+        self.basic_names = []
+        self.reactions = []
+
+        self._reaction_ids = {}
+        self._basic_ids = {}
+        self._product_ids = {}
+
+        self._c1, self._rea, self._c2, self._basic = [], [], [], []
+        self._cache = {}
+        self._names = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_names'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._names = {}
+
+    def __len__(self):
+        return len(self._c1)
+
+    def _append(self, c1, rea, c2, basic):
+        self._c1.append(c1)
+        self._rea.append(rea)
+        self._c2.append(c2)
+        self._basic.append(basic)
+        self._cache = {}
+
+        return len(self._c1) - 1
+
+    def add_compound(self, name):
+        """ Add level-0 compound and return its id
+        """
+        if name in self._basic_ids:
+            return self._basic_ids[name]
+
+        idx = self._append(-1, -1, -1, len(self.basic_names))
+        self.basic_names.append(name)
+
+        self._basic_ids[name] = idx
+        return idx
+
+    def add_product(self, c1, reaction, c2):
+        """ Add product of reaction between compound ids `c1` and `c2` (may be None)
+        """
+        if reaction not in self._reaction_ids:
+            self._reaction_ids[reaction] = len(self.reactions)
+            self.reactions.append(reaction)
+
+        key = (c1, self._reaction_ids[reaction], -1 if c2 is None else c2)
+        if key in self._product_ids:
+            return self._product_ids[key]
+
+        idx = self._append(*key, -1)
+        self._product_ids[key] = idx
+        return idx
+
+    @classmethod
+    def from_compounds(cls, data):
+        """ Build table from name-keyed compound data as produced by
+            `reaction_finder.guess_new_compounds`.
+            Returns table and map from names to ids
+        """
+        table, ids = cls(), {}
+        for name in data:
+            table._add_named(name, data, ids)
+        return table, ids
+
+    def _add_named(self, name, data, ids):
+        """ Add compound given by its name, parents are added first.
+            Compounds without recorded reaction are level-0 compounds
+        """
+        if name in ids:
+            return ids[name]
+
+        entry = data.get(name, {})
+        if 'reaction' in entry:
+            c1, c2 = entry['origin']
+            idx = self.add_product(
+                self._add_named(c1, data, ids), entry['reaction'],
+                None if c2 is None else self._add_named(c2, data, ids))
+        else:
+            idx = self.add_compound(name)
+
+        ids[name] = idx
+        return idx
+
+    def id_of(self, name):
+        """ Return id of level-0 compound `name`
+        """
+        return self._basic_ids[name]
+
+    def _array(self, key, values, dtype):
+        if key not in self._cache:
+            self._cache[key] = np.array(values, dtype=dtype)
+        return self._cache[key]
+
+    @property
+    def origins(self):
+        """ Origin table with columns `(id, c1_id, reaction_id, c2_id)`
+        """
+        if 'origins' not in self._cache:
+            self._cache['origins'] = np.column_stack([
+                np.arange(len(self), dtype=np.int64),
+                self._array('c1', self._c1, np.int64),
+                self._array('rea', self._rea, np.int64),
+                self._array('c2', self._c2, np.int64)])
+        return self._cache['origins']
+
+    @property
+    def basic_index(self):
+        """ Position of each compound in `basic_names` (-1 for products)
+        """
+        return self._array('basic', self._basic, np.int64)
+
+    @property
+    def levels(self):
+        """ Number of reaction steps needed to create each compound
+        """
+        if 'levels' not in self._cache:
+            lvl = np.zeros(len(self), dtype=np.int64)
+            for i, (c1, c2) in enumerate(zip(self._c1, self._c2)):
+                if c1 >= 0:
+                    lvl[i] = 1 + max(lvl[c1], lvl[c2] if c2 >= 0 else 0)
+            self._cache['levels'] = lvl
+        return self._cache['levels']
+
+    def origin_bits(self):
+        """ Bitsets of level-0 ancestors, shape `(compounds, words)` of uint64.
+            Ids are topologically sorted, so each level only depends on lower ones
+        """
+        if 'bits' in self._cache:
+            return self._cache['bits']
+
+        word_num = max(1, (len(self.basic_names) + 63) // 64)
+        bits = np.zeros((len(self), word_num), dtype=np.uint64)
+
+        basic = self.basic_index
+        ids = np.nonzero(basic >= 0)[0]
+        bits[ids, basic[ids] // 64] = np.left_shift(
+            np.uint64(1), (basic[ids] % 64).astype(np.uint64))
+
+        c1 = self._array('c1', self._c1, np.int64)
+        c2 = self._array('c2', self._c2, np.int64)
+        levels = self.levels
+        for lvl in range(1, levels.max() + 1 if len(self) > 0 else 1):
+            ids = np.nonzero(levels == lvl)[0]
+            cur = bits[c1[ids]]
+
+            has_c2 = c2[ids] >= 0
+            cur[has_c2] |= bits[c2[ids][has_c2]]
+            bits[ids] = cur
+
+        self._cache['bits'] = bits
+        return bits
+
+    def origin_set(self, idx):
+        """ Return names of level-0 compounds `idx` is made out of
+        """
+        row = self.origin_bits()[idx].astype('<u8')
+        pos = np.nonzero(np.unpackbits(
+            row.view(np.uint8), bitorder='little'))[0]
+        return {self.basic_names[p] for p in pos}
+
+    def unrelated(self, idx1, idx2):
+        """ Check whether two compounds share no level-0 origin
+        """
+        bits = self.origin_bits()
+        return not (bits[idx1] & bits[idx2]).any()
+
+    def unrelated_mask(self, ids1, ids2):
+        """ Vectorized `unrelated` for equally shaped id arrays
+        """
+        bits = self.origin_bits()
+        return ~(bits[ids1] & bits[ids2]).any(axis=-1)
+
+    def name(self, idx):
+        """ Render human-readable name of compound `idx`.
+            Rows never change, so rendered names are memoized
+        """
+        if idx in self._names:
+            return self._names[idx]
+
+        if self._basic[idx] >= 0:
+            name = self.basic_names[self._basic[idx]]
+        else:
+            c2 = self._c2[idx]
+            name = '({c1}) {{{r}}} ({c2})'.format(
+                c1=self.name(self._c1[idx]),
+                r=self.reactions[self._rea[idx]],
+                c2=self.name(c2) if c2 >= 0 else None)
+
+        self._names[idx] = name
+        return name
+
+    def to_names(self, data):
+        """ Key compound data by rendered names instead of ids
+        """
+        res = {}
+        for idx, entry in data.items():
+            if 'reaction' in entry:
+                c1, c2 = entry['origin']
+                entry = dict(entry, origin=(
+                    self.name(c1), self.name(c2) if c2 is not None else None))
+            res[self.name(idx)] = entry
+        return res
+
+def sample_unrelated(
+    table, num, size=3,
+    candidates=None, mass=None, mass_range=None,
+    rng=np.random, max_redraws=1000
+):
+    """ Draw `num` distinct tuples of compound ids with pairwise disjoint
+        level-0 origins. Positions are filled one after another, each redrawing
+        until it is unrelated to all previous ones.
+        Candidates can be restricted to ids and to `mass` (aligned with
+        `candidates`) strictly within `mass_range`
+    """
+    candidates = np.arange(len(table)) if candidates is None else np.asarray(candidates)
+    if mass_range is not None:
+        mass = np.asarray(mass)
+        candidates = candidates[(mass > mass_range[0]) & (mass < mass_range[1])]
+    if len(candidates) == 0:
+        raise RuntimeError('No candidate compounds to sample from')
+
+    result = collections.OrderedDict()
+    stale_rounds = 0
+    while len(result) < num:
+        batch = rng.choice(candidates, size=(num - len(result), size))
+
+        ok = np.ones(len(batch), dtype=bool)
+        for pos in range(1, size):
+            for _ in range(max_redraws):
+                bad = np.zeros(len(batch), dtype=bool)
+                for prev in range(pos):
+                    bad |= ~table.unrelated_mask(batch[:, pos], batch[:, prev])
+                bad &= ok
+                if not bad.any():
+                    break
+                batch[bad, pos] = rng.choice(candidates, size=bad.sum())
+            else:
+                ok &= ~bad # give up on tuples without unrelated partners
+
+        found = len(result)
+        for row in batch[ok]:
+            result[tuple(row.tolist())] = None
+
+        stale_rounds = stale_rounds + 1 if len(result) == found else 0
+        if stale_rounds > max_redraws:
+            raise RuntimeError('Could not find enough unrelated compounds')
+
+    return list(result)[:num]
+
+def compound_columns(cdata, group_names=None):
+    """ Convert compound dicts (see `read_compounds_file`) into columns:
+        `(N, G)` group matrix, `(N, 5)` CHONS atom matrix and mass vector.
+        Remaining per-compound entries (origin, intensities, ...) go to `extra`
+    """
+    names = list(cdata.keys())
+    if group_names is None:
+        group_names = list(cdata[names[0]]['groups'].keys()) if len(names) > 0 else []
+    present_atoms = set(a for d in cdata.values() for a in d.get('atoms', {}))
+    atom_names = [a for a in ATOM_LIST if a in present_atoms]
+
+    groups = np.zeros((len(names), len(group_names)), dtype=np.int64)
+    atoms = np.zeros((len(names), len(ATOM_LIST)), dtype=np.int64)
+    mass = np.zeros(len(names))
+    extra = []
+
+    for i, name in enumerate(names):
+        entry = cdata[name]
+
+        groups[i] = [entry['groups'].get(g, 0) for g in group_names]
+        cur_atoms = entry.get('atoms', {})
+        atoms[i] = [cur_atoms.get(a, 0) for a in ATOM_LIST]
+        mass[i] = entry.get('mass', np.nan)
+
+        extra.append({k: v for k, v in entry.items()
+            if k not in ('groups', 'atoms', 'mass')})
+
+    return CompoundColumns(
+        names=names, index={n: i for i, n in enumerate(names)},
+        group_names=list(group_names), groups=groups,
+        atom_names=atom_names, atoms=atoms, mass=mass, extra=extra)
+
+def compound_dicts(cols):
+    """ Convert compound columns back into dict format.
+        Not an exact inverse of `compound_columns`: every compound gets all
+        atoms in `atom_names` (0 if it had none) and a mass (NaN if it had none)
+    """
+    atom_idx = [ATOM_LIST.index(a) for a in cols.atom_names]
+
+    data = {}
+    for i, name in enumerate(cols.names):
+        data[name] = {
+            'groups': dict(zip(cols.group_names, cols.groups[i].tolist())),
+            'atoms': dict(zip(cols.atom_names, cols.atoms[i, atom_idx].tolist())),
+            'mass': float(cols.mass[i])
+        }
+        data[name].update(cols.extra[i])
+    return data
+
+def reaction_columns(rdata, group_names):
+    """ Convert reaction dicts (see `read_reactions_file`) into columns:
+        `(R, G)` requirement and transformation matrices, `(R, 5)` atom
+        transformations and masks for which compounds take part
+    """
+    names = list(rdata.keys())
+    shape = (len(names), len(group_names))
+
+    c1_reqs = np.zeros(shape, dtype=np.int64)
+    c2_reqs = np.zeros(shape, dtype=np.int64)
+    group_trans = np.zeros(shape, dtype=np.int64)
+    atom_trans = np.zeros((len(names), len(ATOM_LIST)), dtype=np.int64)
+    needs_c2 = np.zeros(len(names), dtype=bool)
+    uses_c1 = np.zeros(len(names), dtype=bool)
+    uses_c2 = np.zeros(len(names), dtype=bool)
+    mass_trans = np.zeros(len(names))
+
+    for i, name in enumerate(names):
+        spec = rdata[name]
+
+        c1_reqs[i] = [spec['c1'][g] for g in group_names]
+        if spec['c2'] is not None:
+            needs_c2[i] = True
+            c2_reqs[i] = [spec['c2'][g] for g in group_names]
+        group_trans[i] = [spec['group_trans'][g] for g in group_names]
+
+        atoms = spec.get('atom_trans', {})
+        atom_trans[i] = [atoms.get(a, 0) for a in ATOM_LIST]
+        uses_c1[i] = atoms.get('c1', False)
+        uses_c2[i] = atoms.get('c2', False)
+        mass_trans[i] = spec['mass_trans']
+
+    return ReactionColumns(
+        names=names, group_names=list(group_names),
+        c1_reqs=c1_reqs, c2_reqs=c2_reqs, needs_c2=needs_c2,
+        group_trans=group_trans, atom_trans=atom_trans,
+        uses_c1=uses_c1, uses_c2=uses_c2, mass_trans=mass_trans)
+
+def reaction_dicts(cols):
+    """ Convert reaction columns back into dict format
+    """
+    data = {}
+    for i, name in enumerate(cols.names):
+        atom_trans = {
+            a: int(v) for a, v in zip(ATOM_LIST, cols.atom_trans[i]) if v != 0}
+        atom_trans.update({
+            'c1': bool(cols.uses_c1[i]),
+            'c2': bool(cols.uses_c2[i])
+        })
+
+        data[name] = {
+            'mass_trans': float(cols.mass_trans[i]),
+            'atom_trans': atom_trans,
+            'c1': dict(zip(cols.group_names, cols.c1_reqs[i].tolist())),
+            'c2': dict(zip(cols.group_names, cols.c2_reqs[i].tolist()))
+                if cols.needs_c2[i] else None,
+            'group_trans': dict(zip(cols.group_names, cols.group_trans[i].tolist()))
+        }
+    return data
+
+def match_matrix(ccols, rcols, pos='c1'):
+    """ Boolean `(N, R)` matrix stating whether compound can be reaction partner at `pos`
+    """
+    if pos == 'c1':
+        reqs, valid = rcols.c1_reqs, np.ones(len(rcols.names), dtype=bool)
+    elif pos == 'c2':
+        reqs, valid = rcols.c2_reqs, rcols.needs_c2
+    else:
+        raise RuntimeError('Invalid reaction position "{}"'.format(pos))
+
+    res = (ccols.groups[:, None, :] >= reqs[None, :, :]).all(axis=2)
+    return res & valid[None, :]
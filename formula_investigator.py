@@ -3,19 +3,22 @@ Investigate chemical formulas
 """
 
 import pickle
-import itertools
 
+import numpy as np
 import pandas as pd
 
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-from tqdm import tqdm
-
+import utils
+import result_cache
 import reaction_finder
 
 
-def read_combinatorial_compounds(fname='cache/rf_raw_reaction_data.pkl'):
+COMBINATORIAL_FILE = 'cache/rf_raw_reaction_data.pkl'
+ACTUAL_FILE = 'data/Res_Polphen_List_Neg.csv'
+
+def read_combinatorial_compounds(fname=COMBINATORIAL_FILE):
     with open(fname, 'rb') as fd:
         comps = pickle.load(fd)
 
@@ -28,7 +31,7 @@ def read_combinatorial_compounds(fname='cache/rf_raw_reaction_data.pkl'):
 
     return pd.DataFrame(tmp)
 
-def read_actual_compounds(fname='data/Res_Polphen_List_Neg.csv'):
+def read_actual_compounds(fname=ACTUAL_FILE):
     #sed 's/\([[:digit:]]\),\([[:digit:]]\)/\1.\2/g' data/Res_Polphen_List_Neg.csv
     df = pd.read_csv(fname)
     df = df[['Name', 'Formula', 'M_selected']]
@@ -36,30 +39,39 @@ def read_actual_compounds(fname='data/Res_Polphen_List_Neg.csv'):
     return df
 
 def merge_sources(df_comb, df_roy, thres=.01):
-    tmp = {'aname': [], 'cname': [], 'aform': [], 'cform': [], 'amass': [], 'cmass': []}
-    for row in tqdm(df_comb.itertuples(), total=df_comb.shape[0]):
-        match = df_roy[abs(row.MZ-df_roy['MZ']) < thres]
-
-        if match.empty:
-            continue
-
-        if match.shape[0] == 1:
-            tmp['aname'].append(match.iloc[0].Name)
-            tmp['cname'].append(row.Name)
-            tmp['aform'].append(match.iloc[0].Formula)
-            tmp['cform'].append(row.Formula)
-            tmp['amass'].append(match.iloc[0].MZ)
-            tmp['cmass'].append(row.MZ)
-        else:
-            for r in match.itertuples():
-                tmp['aname'].append(r.Name)
-                tmp['cname'].append(row.Name)
-                tmp['aform'].append(r.Formula)
-                tmp['cform'].append(row.Formula)
-                tmp['amass'].append(r.MZ)
-                tmp['cmass'].append(row.MZ)
+    """ Pair each combinatorial compound with all actual ones whose MZ
+        differs by less than `thres` (interval join on sorted MZ values)
+    """
+    comb_mz = df_comb['MZ'].values.astype(float)
+    roy_mz = df_roy['MZ'].values.astype(float)
 
-    return pd.DataFrame(tmp)
+    order = np.argsort(roy_mz, kind='stable')
+    sorted_mz = roy_mz[order]
+
+    # candidate windows, exact check below
+    lo = np.searchsorted(sorted_mz, comb_mz - thres, side='left')
+    hi = np.searchsorted(sorted_mz, comb_mz + thres, side='right')
+    lens = np.maximum(hi - lo, 0)
+
+    ci = np.repeat(np.arange(comb_mz.size), lens)
+    pos = np.arange(lens.sum()) + np.repeat(lo - np.cumsum(lens) + lens, lens)
+    ri = order[pos]
+
+    mask = np.abs(comb_mz[ci] - roy_mz[ri]) < thres
+    ci, ri = ci[mask], ri[mask]
+
+    # keep order of original row-wise merge
+    idx = np.lexsort((ri, ci))
+    ci, ri = ci[idx], ri[idx]
+
+    return pd.DataFrame({
+        'aname': df_roy['Name'].values[ri],
+        'cname': df_comb['Name'].values[ci],
+        'aform': df_roy['Formula'].values[ri],
+        'cform': df_comb['Formula'].values[ci],
+        'amass': roy_mz[ri],
+        'cmass': comb_mz[ci]
+    }, columns=['aname', 'cname', 'aform', 'cform', 'amass', 'cmass'])
 
 def form2dict(form):
     """ Convert single formula to a dict describing its composition
@@ -95,17 +107,68 @@ def compute_formula_distance(form1, form2):
 
     return diff / total
 
-def get_rl_comparison_frame():
-    """ Return merged DataFrame of actual and combinatorial data
+def formulas_to_matrix(forms, atoms=None):
+    """ Parse formulas (each distinct one only once) into `(N, A)` atom count matrix.
+        Returns matrix and atom names of its columns
     """
-    com_data = read_combinatorial_compounds()
-    act_data = read_actual_compounds()
+    forms = list(forms)
+    uniq, inverse = np.unique(forms, return_inverse=True)
+    parsed = [form2dict(f) for f in uniq]
 
-    df = merge_sources(com_data, act_data)
-    df['dist'] = df.apply(
-        lambda row: compute_formula_distance(row.aform, row.cform),
-        axis=1)
-    return df
+    if atoms is None:
+        atoms = sorted(set(a for p in parsed for a in p))
+
+    mat = np.array(
+        [[p.get(a, 0) for a in atoms] for p in parsed],
+        dtype=np.int64).reshape(len(uniq), len(atoms))
+    return mat[inverse.ravel()], list(atoms)
+
+def formula_distances(mat1, mat2):
+    """ Vectorized `compute_formula_distance` between rows of atom count
+        matrices (broadcasting applies)
+    """
+    diff = np.abs(mat1 - mat2).sum(axis=-1)
+    total = mat1.sum(axis=-1) + mat2.sum(axis=-1)
+    return diff / total
+
+def pairwise_formula_distances(mat1, mat2=None, chunk_size=1000, bins=None):
+    """ Distances between all (ordered) pairs of rows of `mat1` and `mat2`.
+        If `bins` are given, they are accumulated chunk-wise into
+        a `utils.HistogramAccumulator` instead of returning the full matrix
+    """
+    if mat2 is None:
+        mat2 = mat1
+    if bins is None:
+        return formula_distances(mat1[:, None, :], mat2[None, :, :])
+
+    hist = utils.HistogramAccumulator(bins)
+    for i in range(0, mat1.shape[0], chunk_size):
+        hist.add(formula_distances(
+            mat1[i:i+chunk_size, None, :], mat2[None, :, :]))
+    return hist
+
+def get_rl_comparison_frame(
+    comb_fname=COMBINATORIAL_FILE, act_fname=ACTUAL_FILE,
+    thres=.01, cache=None
+):
+    """ Return merged DataFrame of actual and combinatorial data.
+        Result is cached by content of both input files
+    """
+    def compute():
+        com_data = read_combinatorial_compounds(comb_fname)
+        act_data = read_actual_compounds(act_fname)
+
+        df = merge_sources(com_data, act_data, thres)
+
+        forms, _ = formulas_to_matrix(pd.concat([df['aform'], df['cform']]))
+        df['dist'] = formula_distances(forms[:len(df)], forms[len(df):])
+        return df
+
+    if cache is None:
+        cache = result_cache.ResultCache()
+    key = result_cache.make_key(
+        'rl_comparison_frame', files=[comb_fname, act_fname], thres=thres)
+    return cache.fetch(key, compute)
 
 def mz_range_comparison():
     """ Visualize MZ-value ranges
@@ -128,21 +191,22 @@ def plot_formdist_nullmodel():
     """
     # read data
     df = read_actual_compounds()
-    forms = itertools.product(df['Formula'].tolist(), repeat=2)
+    forms, _ = formulas_to_matrix(df['Formula'])
 
     # compute result
-    dists_all = []
-    for f1, f2 in forms:
-        dist = compute_formula_distance(f1, f2)
-        dists_all.append(dist)
+    bins = np.linspace(0, 1, 51)
+    hist_all = pairwise_formula_distances(forms, bins=bins)
 
-    dists_matched = get_rl_comparison_frame()['dist'].tolist()
+    hist_matched = utils.HistogramAccumulator(bins)
+    hist_matched.add(get_rl_comparison_frame()['dist'])
 
     # plot result
     plt.figure()
 
-    sns.distplot(dists_all, label='all real data', kde=False)
-    sns.distplot(dists_matched, label='matched data', kde=False)
+    for hist, lbl in [(hist_all, 'all real data'), (hist_matched, 'matched data')]:
+        plt.hist(
+            hist.centers, bins=hist.edges, weights=hist.counts,
+            alpha=.5, label=lbl)
 
     plt.legend(loc='best')
     plt.savefig('images/formdist_nullmodel.pdf')
@@ -4,7 +4,6 @@ Investigate data in various ways
 
 import sys
 import copy
-import pickle
 from itertools import cycle
 
 import numpy as np
@@ -22,6 +21,7 @@ from setup import generate_basic_system
 from main import analyze_system
 from nm_data_generator import add_node_to_system
 from filters import filter_steady_state
+from result_store import load_results
 
 
 def plot_correlation_hist(data):
@@ -219,9 +219,7 @@ def correlation_patterns():
     """ Investigate various correlation patterns
     """
     def read(fname):
-        with open(fname, 'rb') as fd:
-            inp = pickle.load(fd)
-            return np.asarray(inp['data'])
+        return np.asarray(load_results(fname)['data'])
 
     def aggregate_corr_matrices(data):
         mats = []
@@ -286,4 +284,4 @@ def main(data):
     correlation_patterns()
 
 if __name__ == '__main__':
-    main(np.load(sys.argv[1])['data'] if len(sys.argv) == 2 else None)
+    main(load_results(sys.argv[1])['data'] if len(sys.argv) == 2 else None)
@@ -5,6 +5,7 @@ Infer metabolite correlation patterns from network motifs
 import os
 import sys
 import copy
+import functools
 import multiprocessing
 
 import numpy as np
@@ -15,56 +16,167 @@ from matplotlib import gridspec
 
 from setup import load_systems, system_from_string
 from solver import solve_system
-from utils import compute_correlation_matrix, cache_data
+from utils import (
+    replicate_correlation_matrices, summarize_correlation_matrices,
+    replicate_batches)
+from system_store import save_system_results
 from filters import filter_steady_state
 from plotter import save_figure, plot_system, plot_corr_mat, plot_system_evolution
 
 
+RESULT_DIR = 'results/data_cache'
+
+def retain_trajectory(sol, policy='full', step=100, bins=500):
+    """ Reduce trajectory `(dim, steps)` according to retention policy:
+        'full', 'none', 'downsample' (every `step`-th point) or
+        'envelope' (interleaved minima and maxima of `bins` time windows)
+    """
+    if policy == 'full':
+        return sol
+    elif policy == 'none':
+        return None
+    elif policy == 'downsample':
+        return sol[:, ::step].copy()
+    elif policy == 'envelope':
+        windows = np.array_split(sol, min(bins, sol.shape[1]), axis=1)
+        env = np.empty((sol.shape[0], 2*len(windows)))
+        env[:, ::2] = np.transpose([w.min(axis=1) for w in windows])
+        env[:, 1::2] = np.transpose([w.max(axis=1) for w in windows])
+        return env
+    else:
+        raise RuntimeError('Invalid trajectory policy ({})'.format(policy))
+
+def extract_steady_state(sol):
+    """ Steady-state part (last quarter) of solution `(dim, steps)` as `(steps, dim)`
+    """
+    return sol.T[int(sol.shape[1]*3/4):]
+
+def solve_ode(system, tmax=100, filter_trivial_ss=True, filter_mask=None):
+    """ Solve noise-free version of `system`.
+        Returns its solution and whether its steady state is filtered
+    """
+    ode_system = copy.copy(system)
+    ode_system.fluctuation_vector = np.zeros(system.fluctuation_vector.shape)
+
+    ode_sol = solve_system(ode_system, tmax=tmax)
+    filtered = filter_trivial_ss \
+        and filter_steady_state(extract_steady_state(ode_sol), filter_mask)
+    return ode_sol, filtered
+
 def analyze_system(
     system, repetition_num=100, tmax=100,
     filter_trivial_ss=True, filter_mask=None,
     plot_hist=False, save_stdev=None,
-    use_ode_sde_diff=True
+    use_ode_sde_diff=True, trajectory='full',
+    target_se=None, batch_size=10, return_reps=False
 ):
     """ Generate steady states for given system.
         `filter_mask` is a list of nodes to be excluded from filtering.
-        A filtered entry must have a None correlation matrix
+        A filtered entry must have a None correlation matrix.
+        `trajectory` is the retention policy of the returned solution (see `retain_trajectory`).
+        If `target_se` is given, replicates are added in batches of `batch_size` until
+        the standard error of all off-diagonal correlations falls below it
+        (at most `repetition_num` replicates).
+        `return_reps` appends the number of simulated replicates to the result
     """
-    if use_ode_sde_diff:
-        ode_system = copy.copy(system)
-        ode_system.fluctuation_vector = np.zeros(system.fluctuation_vector.shape)
-
-    ss_data = []
-    for _ in range(repetition_num):
-        sde_sol = solve_system(system, tmax=tmax)
-        if use_ode_sde_diff:
-            ode_sol = solve_system(ode_system, tmax=tmax)
+    def result(mat, sol, reps):
+        res = (system, mat, retain_trajectory(sol, trajectory))
+        return res + (reps,) if return_reps else res
 
-        if use_ode_sde_diff:
-            sol = ode_sol - sde_sol
-        else:
-            sol = sde_sol
-        sol_extract = sol.T[int(len(sol.T)*3/4):]
-
-        if use_ode_sde_diff:
-            ode_sol_extract = ode_sol.T[int(len(ode_sol.T)*3/4):]
-        else:
-            ode_sol_extract = sol_extract
-
-        if not filter_trivial_ss or not filter_steady_state(ode_sol_extract, filter_mask):
+    ode_sol = None
+    if use_ode_sde_diff:
+        # the ODE is deterministic, so it decides about filtering once
+        ode_sol, filtered = solve_ode(system, tmax, filter_trivial_ss, filter_mask)
+        if filtered:
+            sol = None if trajectory == 'none' \
+                else ode_sol - solve_system(system, tmax=tmax)
+            return result(None, sol, 0)
+
+    reps = 0
+    corr_mats = []
+    for batch in replicate_batches(
+        range(repetition_num), [corr_mats], target_se, batch_size
+    ):
+        ss_data = []
+        for _ in batch:
+            reps += 1
+
+            sde_sol = solve_system(system, tmax=tmax)
+            sol = sde_sol if ode_sol is None else ode_sol - sde_sol
+            sol_extract = extract_steady_state(sol)
+
+            if ode_sol is None and filter_trivial_ss \
+                    and filter_steady_state(sol_extract, filter_mask):
+                return result(None, sol, reps)
             ss_data.append(sol_extract)
-        else:
-            return system, None, sol
 
-    corr_mat = compute_correlation_matrix(np.array(ss_data), plot_hist, save_stdev)
-    return system, corr_mat, sol
+        corr_mats.extend(replicate_correlation_matrices(np.array(ss_data)))
 
-def cluster_data(data):
-    """ Order data according to correlation matrices
-    """
-    return sorted(data, key=lambda e: np.sum(e[1]))
+    corr_mat = summarize_correlation_matrices(np.array(corr_mats), plot_hist, save_stdev)
+    return result(corr_mat, sol, reps)
 
-def main(fname, skip_filtered=True):
+def analyze_system_pair(
+    system, repetition_num=100, tmax=100,
+    filter_trivial_ss=True, filter_mask=None,
+    save_stdev=None, trajectory='full',
+    seeds=None, noise_dim=None,
+    target_se=None, batch_size=10, return_reps=False
+):
+    """ Analyze system with and without ODE-SDE difference on the same SDE replicates.
+        The ODE is solved once and decides about filtering for both analyses
+        (both correlation matrices are None if its steady state is filtered,
+        no replicates are simulated then unless a trajectory is kept).
+        Replicate `i` is simulated with `seeds[i]` (see `solve_system`).
+        `target_se`, `batch_size` and `return_reps` work as in `analyze_system`,
+        the standard error criterion has to hold for both analyses.
+        Returns results `(sde_res, diff_res)` as given by `analyze_system`
+    """
+    if seeds is None:
+        seeds = [None] * repetition_num
+    assert len(seeds) == repetition_num, 'Need one seed per replicate'
+
+    ode_sol, ode_filtered = solve_ode(system, tmax, filter_trivial_ss, filter_mask)
+    ode_extract = extract_steady_state(ode_sol)
+
+    def result(sde_mat, diff_mat, sde_sol, reps):
+        diff_sol = None if sde_sol is None else ode_sol - sde_sol
+        res = (
+            (system, sde_mat, retain_trajectory(sde_sol, trajectory)),
+            (system, diff_mat, retain_trajectory(diff_sol, trajectory)))
+        if return_reps:
+            res = tuple(r + (reps,) for r in res)
+        return res
+
+    if ode_filtered:
+        sde_sol = None if trajectory == 'none' else solve_system(
+            system, tmax=tmax, seed=seeds[0], noise_dim=noise_dim)
+        return result(None, None, sde_sol, 0)
+
+    reps = 0
+    sde_mats = []
+    diff_mats = []
+    for batch in replicate_batches(
+        seeds, [sde_mats, diff_mats], target_se, batch_size
+    ):
+        sde_data = []
+        diff_data = []
+        for seed in batch:
+            sde_sol = solve_system(system, tmax=tmax, seed=seed, noise_dim=noise_dim)
+            sde_extract = extract_steady_state(sde_sol)
+
+            sde_data.append(sde_extract)
+            diff_data.append(ode_extract - sde_extract)
+        reps += len(batch)
+
+        sde_mats.extend(replicate_correlation_matrices(np.array(sde_data)))
+        diff_mats.extend(replicate_correlation_matrices(np.array(diff_data)))
+
+    sde_mat = summarize_correlation_matrices(np.array(sde_mats))
+    diff_mat = summarize_correlation_matrices(
+        np.array(diff_mats), save_stdev=save_stdev)
+    return result(sde_mat, diff_mat, sde_sol, reps)
+
+def main(fname, skip_filtered=True, trajectory='none'):
     """ Main interface
     """
     if os.path.isfile(fname):
@@ -76,18 +188,21 @@ def main(fname, skip_filtered=True):
         core_num = int(multiprocessing.cpu_count() * 4/5)
         print('Using %d cores' % core_num)
 
-        data = []
-        with tqdm(total=len(systems)) as pbar:
-            with multiprocessing.Pool(core_num) as p:
-                for res in p.imap(analyze_system, systems, chunksize=10):
-                    if not skip_filtered or not res[1] is None:
-                        data.append(res)
-                    pbar.update()
-        print('Found result for %d systems' % len(data))
-
-        if not skip_filtered:
-            data = cluster_data(data)
-        cache_data(data)
+        def results():
+            with tqdm(total=len(systems)) as pbar:
+                with multiprocessing.Pool(core_num) as p:
+                    for res in p.imap(
+                        functools.partial(analyze_system, trajectory=trajectory),
+                        systems, chunksize=10
+                    ):
+                        pbar.update()
+                        if not skip_filtered or not res[1] is None:
+                            yield res
+
+        num = save_system_results(
+            RESULT_DIR, results(),
+            trajectories=trajectory != 'none', sort=not skip_filtered)
+        print('Found result for %d systems' % num)
     else:
         syst = system_from_string(fname)
         syst, mat, sol = analyze_system(syst, use_ode_sde_diff=False)
@@ -34,10 +34,12 @@ def main():
 
     # extract motifs
     motifs = []
+    seen = set()
     edge_data = []
     for cs in detect_ffl(graph):
-        if None in cs or cs in motifs:
+        if None in cs or cs in seen:
             continue
+        seen.add(cs)
         if not reaction_ids_unique(cs, graph):
             continue
 
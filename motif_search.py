@@ -0,0 +1,470 @@
+"""
+Detect network motifs on sparse adjacency matrices
+"""
+
+import itertools
+import collections
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sps
+
+
+def graph_to_csr(graph, exclude=(None,)):
+    """ Convert (multi-)graph into binary CSR adjacency matrix.
+        Returns matrix and node list mapping indices to nodes
+    """
+    nodes = list(graph.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+
+    edges = [(index[u], index[v]) for u, v in graph.edges()
+        if u not in exclude and v not in exclude]
+    rows, cols = zip(*edges) if len(edges) > 0 else ((), ())
+
+    adj = sps.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(nodes), len(nodes)))
+    adj.data[:] = 1 # merge parallel edges
+    return adj, nodes
+
+class SparseGraph(object):
+    """ Directed graph over integer node ids, stored as CSR (successors)
+        and CSC (predecessors) arrays. `labels[i]` names node `i`
+    """
+    def __init__(self, adj, labels=None):
+        adj = sps.csr_matrix(adj, dtype=np.int32)
+        adj.sum_duplicates()
+        adj.data[:] = 1
+
+        self.csr = adj
+        self.csc = sps.csc_matrix(adj)
+        self.labels = list(range(adj.shape[0])) if labels is None else list(labels)
+        self._index = None
+
+    @classmethod
+    def from_edges(cls, edges, labels=None, exclude=(None,)):
+        """ Build graph from edges between (hashable) labels.
+            Labels not in `labels` are appended in order of appearance
+        """
+        labels = [] if labels is None else list(labels)
+        index = {l: i for i, l in enumerate(labels)}
+
+        def node_id(label):
+            if label not in index:
+                index[label] = len(labels)
+                labels.append(label)
+            return index[label]
+
+        rows, cols = [], []
+        for u, v in edges:
+            if u in exclude or v in exclude:
+                continue
+            rows.append(node_id(u))
+            cols.append(node_id(v))
+
+        adj = sps.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(labels), len(labels)))
+
+        graph = cls(adj, labels)
+        graph._index = index
+        return graph
+
+    def __len__(self):
+        return self.csr.shape[0]
+
+    @property
+    def adjacency(self):
+        return self.csr
+
+    def index(self, label):
+        """ Return id of node with given label
+        """
+        if self._index is None:
+            self._index = {l: i for i, l in enumerate(self.labels)}
+        return self._index[label]
+
+    def number_of_edges(self):
+        return self.csr.nnz
+
+    def successors(self, idx):
+        return self.csr.indices[self.csr.indptr[idx]:self.csr.indptr[idx+1]]
+
+    def predecessors(self, idx):
+        return self.csc.indices[self.csc.indptr[idx]:self.csc.indptr[idx+1]]
+
+    def out_degree(self):
+        return np.diff(self.csr.indptr)
+
+    def in_degree(self):
+        return np.diff(self.csc.indptr)
+
+    def edges(self):
+        """ Return `(E, 2)` array of edges as node ids
+        """
+        rows = np.repeat(np.arange(len(self)), self.out_degree())
+        return np.column_stack((rows, self.csr.indices))
+
+    def labeled_edges(self):
+        return [(self.labels[u], self.labels[v]) for u, v in self.edges()]
+
+    def subgraph(self, ids):
+        """ Induced subgraph on given node ids (duplicates are dropped)
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        sub = self.csr[ids][:, ids]
+        return SparseGraph(sub, [self.labels[i] for i in ids])
+
+    def degree_stats(self):
+        """ Summarize node and edge counts as well as degrees
+        """
+        deg = self.out_degree() + self.in_degree()
+        return {
+            'nodes': len(self),
+            'edges': self.number_of_edges(),
+            'mean_degree': deg.mean() if len(self) > 0 else 0.,
+            'max_in_degree': self.in_degree().max() if len(self) > 0 else 0,
+            'max_out_degree': self.out_degree().max() if len(self) > 0 else 0
+        }
+
+    def info(self):
+        stats = self.degree_stats()
+        return ('Number of nodes: {nodes}\nNumber of edges: {edges}\n'
+            'Average degree: {mean_degree:.4f}'.format(**stats))
+
+    def to_networkx(self):
+        """ Export graph, e.g. for plotting
+        """
+        import networkx as nx
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.labels)
+        graph.add_edges_from(self.labeled_edges())
+        return graph
+
+def unidirectional_edges(adj):
+    """ Only keep edges whose reverse edge does not exist (drops self-loops)
+    """
+    adj = sps.csr_matrix(adj, dtype=np.int32, copy=True)
+    adj.data[:] = 1
+    adj.setdiag(0)
+    adj.eliminate_zeros()
+
+    uni = adj - adj.multiply(adj.T)
+    uni.eliminate_zeros()
+    return sps.csr_matrix(uni)
+
+def _expand_ranges(starts, lens):
+    """ Concatenate `range(s, s+l)` for all given starts and lengths
+    """
+    offsets = np.repeat(starts - np.cumsum(lens) + lens, lens)
+    return offsets + np.arange(lens.sum())
+
+def _ffl_chunk(uni, rows):
+    """ Find all feedforward loops whose source node is in `rows`
+    """
+    sub = uni[rows]
+
+    # (c1, c3) edges which are closed by some path c1 -> c2 -> c3
+    closing = sps.coo_matrix(sub.multiply(sub @ uni))
+    if closing.nnz == 0:
+        return np.empty((0, 3), dtype=np.int64)
+    closing_keys = np.sort(closing.row.astype(np.int64) * uni.shape[0] + closing.col)
+
+    # enumerate wedges c1 -> c2 -> c3 and keep closed ones
+    c1, c2 = sub.nonzero()
+    starts = uni.indptr[c2]
+    lens = uni.indptr[c2+1] - starts
+
+    c1 = np.repeat(c1, lens).astype(np.int64)
+    c2 = np.repeat(c2, lens)
+    c3 = uni.indices[_expand_ranges(starts, lens)]
+
+    keys = c1 * uni.shape[0] + c3
+    pos = np.minimum(
+        np.searchsorted(closing_keys, keys), closing_keys.size-1)
+    mask = closing_keys[pos] == keys
+
+    return np.column_stack((np.asarray(rows)[c1[mask]], c2[mask], c3[mask]))
+
+_worker_matrix = None
+
+def _init_worker(uni):
+    global _worker_matrix
+    _worker_matrix = uni
+
+def _ffl_worker(rows):
+    return _ffl_chunk(_worker_matrix, rows)
+
+def find_ffl(adj, chunk_size=1000, processes=None):
+    """ Find feedforward loops in sparse adjacency matrix:
+            c1 ---> c2
+             |       |
+             |       v
+             -----> c3
+        Motifs must not contain back edges (c2 -> c1, c3 -> c1) or c3 -> c2.
+        Yields `(k, 3)` arrays of node indices per chunk of source nodes,
+        which are distributed over `processes` workers if given
+    """
+    uni = unidirectional_edges(adj)
+
+    sources = np.nonzero(np.diff(uni.indptr))[0]
+    chunks = [sources[i:i+chunk_size]
+        for i in range(0, len(sources), chunk_size)]
+
+    if processes is None:
+        for rows in chunks:
+            yield _ffl_chunk(uni, rows)
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(uni,)) as p:
+            for res in p.imap(_ffl_worker, chunks):
+                yield res
+
+def count_ffl(adj):
+    """ Count feedforward loops without enumerating them
+    """
+    uni = unidirectional_edges(adj)
+    return int(uni.multiply(uni @ uni).sum())
+
+class FFLIndex(object):
+    """ Feedforward loops of a growing graph. Adding edges only inspects
+        triangles which contain at least one of them
+    """
+    def __init__(self, exclude=(None,)):
+        self.exclude = exclude
+
+        self.succ = collections.defaultdict(set)
+        self.pred = collections.defaultdict(set)
+
+        self.motifs = {} # used as insertion-ordered set
+        self.removed = [] # motifs dropped by last `add_edges` call
+        self._node_motifs = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __contains__(self, motif):
+        return tuple(motif) in self.motifs
+
+    def __iter__(self):
+        return iter(self.motifs)
+
+    def _unidirectional(self, u, v):
+        return v in self.succ[u] and u not in self.succ[v]
+
+    def _classify(self, nodes):
+        """ Return `(c1, c2, c3)` if `nodes` form a feedforward loop, else None
+        """
+        order = sorted(
+            nodes, key=lambda n: -sum(m in self.succ[n] for m in nodes))
+        c1, c2, c3 = order
+
+        if (self._unidirectional(c1, c2) and self._unidirectional(c1, c3)
+                and self._unidirectional(c2, c3)):
+            return (c1, c2, c3)
+        return None
+
+    def _remove(self, motif):
+        del self.motifs[motif]
+        self.removed.append(motif)
+        for n in motif:
+            self._node_motifs[n].discard(motif)
+
+    def add_edges(self, edges):
+        """ Insert edges and return list of newly created motifs.
+            Motifs invalidated by reciprocal edges are dropped and listed in `removed`
+        """
+        self.removed = []
+
+        added = []
+        for u, v in edges:
+            if u in self.exclude or v in self.exclude or u == v:
+                continue
+            if v in self.succ[u]:
+                continue
+
+            self.succ[u].add(v)
+            self.pred[v].add(u)
+            added.append((u, v))
+
+        # reciprocated edges destroy motifs containing both nodes
+        for u, v in added:
+            if u in self.succ[v]:
+                for motif in list(self._node_motifs[u] & self._node_motifs[v]):
+                    self._remove(motif)
+
+        new_motifs = []
+        for u, v in added:
+            if not self._unidirectional(u, v):
+                continue
+
+            nbrs_u = self.succ[u] | self.pred[u]
+            nbrs_v = self.succ[v] | self.pred[v]
+            for w in nbrs_u & nbrs_v:
+                motif = self._classify((u, v, w))
+                if motif is None or motif in self.motifs:
+                    continue
+
+                self.motifs[motif] = None
+                for n in motif:
+                    self._node_motifs[n].add(motif)
+                new_motifs.append(motif)
+
+        return new_motifs
+
+Census = collections.namedtuple('Census', ['counts', 'members'])
+
+_canonical_tables = {}
+
+def _pair_list(size):
+    return [(i, j) for i in range(size) for j in range(size) if i != j]
+
+def canonical_table(size):
+    """ Map every adjacency code of `size` nodes to its canonical (minimal) code.
+        Bit `b` of a code is set if edge `_pair_list(size)[b]` exists
+    """
+    if size in _canonical_tables:
+        return _canonical_tables[size]
+
+    pairs = _pair_list(size)
+    weights = np.left_shift(1, np.arange(len(pairs), dtype=np.int64))
+
+    codes = np.arange(2**len(pairs), dtype=np.int64)
+    bits = (codes[:, None] >> np.arange(len(pairs))) & 1
+
+    table = codes.copy()
+    for perm in itertools.permutations(range(size)):
+        target = [pairs.index((perm[i], perm[j])) for i, j in pairs]
+        table = np.minimum(table, (bits * weights[target]).sum(axis=1))
+
+    _canonical_tables[size] = table
+    return table
+
+def subgraph_code(nodes, succ):
+    """ Adjacency code of subgraph induced by ordered `nodes` (self-loops are ignored)
+    """
+    code = 0
+    for b, (i, j) in enumerate(_pair_list(len(nodes))):
+        if nodes[j] in succ[nodes[i]]:
+            code |= 1 << b
+    return code
+
+def motif_code(graph):
+    """ Canonical code of small networkx graph
+    """
+    nodes = list(graph.nodes())
+    succ = {n: set(graph.successors(n)) for n in nodes}
+    return int(canonical_table(len(nodes))[subgraph_code(nodes, succ)])
+
+def code_to_adjacency(code, size):
+    """ Convert adjacency code into matrix
+    """
+    mat = np.zeros((size, size), dtype=int)
+    for b, (i, j) in enumerate(_pair_list(size)):
+        mat[i, j] = (code >> b) & 1
+    return mat
+
+def _esu_roots(roots, succ, nbrs, sizes, probs, collect, seed):
+    """ Enumerate connected induced subgraphs rooted at given nodes via
+        (RAND-)ESU and tally their canonical codes
+    """
+    rng = np.random.RandomState(seed)
+    max_size = max(sizes)
+    tables = {s: canonical_table(s) for s in sizes}
+
+    counts = {s: collections.Counter() for s in sizes}
+    members = {s: collections.defaultdict(list) for s in sizes} if collect else None
+
+    def emit(sub):
+        size = len(sub)
+        code = int(tables[size][subgraph_code(sub, succ)])
+        counts[size][code] += 1
+        if collect:
+            members[size][code].append(tuple(sub))
+
+    def extend(sub, sub_nbhd, ext, root):
+        if len(sub) in counts:
+            emit(sub)
+        if len(sub) == max_size:
+            return
+
+        ext = list(ext)
+        while len(ext) > 0:
+            w = ext.pop()
+            if probs is not None and rng.uniform() >= probs[len(sub)]:
+                continue
+
+            excl = [u for u in nbrs[w] if u > root and u not in sub_nbhd]
+            extend(
+                sub + [w], sub_nbhd | nbrs[w],
+                ext + excl, root)
+
+    for v in roots:
+        if probs is not None and rng.uniform() >= probs[0]:
+            continue
+        extend([v], nbrs[v] | {v}, [u for u in nbrs[v] if u > v], v)
+
+    return counts, members
+
+_worker_graph = None
+
+def _init_esu_worker(succ, nbrs):
+    global _worker_graph
+    _worker_graph = (succ, nbrs)
+
+def _esu_worker(args):
+    roots, sizes, probs, collect, seed = args
+    return _esu_roots(roots, *_worker_graph, sizes, probs, collect, seed)
+
+def motif_census(
+    adj, sizes=(3, 4), probs=None, collect=False,
+    processes=None, chunk_size=1000, seed=None
+):
+    """ Count all connected motif classes of given sizes in one ESU pass.
+        `probs` (one probability per tree depth) enables RAND-ESU sampling,
+        counts are then unbiased estimates.
+        Classes are keyed by canonical code (see `code_to_adjacency`),
+        `collect` additionally lists the nodes of every occurrence
+    """
+    adj = sps.csr_matrix(adj)
+    adj.setdiag(0)
+    adj.eliminate_zeros()
+
+    sym = sps.csr_matrix(adj + adj.T)
+    succ = [set(adj.indices[adj.indptr[i]:adj.indptr[i+1]]) for i in range(adj.shape[0])]
+    nbrs = [set(sym.indices[sym.indptr[i]:sym.indptr[i+1]]) for i in range(sym.shape[0])]
+
+    if probs is not None:
+        assert len(probs) >= max(sizes), 'Need one probability per motif node'
+
+    roots = np.arange(adj.shape[0])
+    chunks = [roots[i:i+chunk_size] for i in range(0, len(roots), chunk_size)]
+    rng = np.random.RandomState(seed)
+    jobs = [(c, sizes, probs, collect, rng.randint(2**31)) for c in chunks]
+
+    # workers receive the graph once, jobs only carry their roots
+    if processes is None:
+        results = [_esu_roots(c, succ, nbrs, *args) for c, *args in jobs]
+    else:
+        with Pool(
+            processes, initializer=_init_esu_worker, initargs=(succ, nbrs)
+        ) as p:
+            results = p.map(_esu_worker, jobs)
+
+    counts = {s: collections.Counter() for s in sizes}
+    members = {s: collections.defaultdict(list) for s in sizes} if collect else None
+    for cur_counts, cur_members in results:
+        for s in sizes:
+            counts[s].update(cur_counts[s])
+            if collect:
+                for code, occ in cur_members[s].items():
+                    members[s][code].extend(occ)
+
+    if probs is not None:
+        for s in sizes:
+            scale = np.prod(probs[:s])
+            counts[s] = {code: num / scale for code, num in counts[s].items()}
+
+    return Census(
+        {s: dict(counts[s]) for s in sizes},
+        {s: dict(members[s]) for s in sizes} if collect else None)
@@ -4,7 +4,6 @@ Investigate 3+1 node network with varied parameters
 
 import os
 import sys
-import pickle
 
 import numpy as np
 import pandas as pd
@@ -19,6 +18,9 @@ import matplotlib.gridspec as gridspec
 from tqdm import tqdm
 
 from utils import extract_sig_entries
+from topology import count_cycles
+from result_store import (
+    load_results, load_motif_results, is_motif_store, modification_time)
 from plotter import save_figure, plot_system, plot_corr_mat, plot_system_evolution
 from main import analyze_system
 from setup import generate_basic_system
@@ -26,6 +28,11 @@ from setup import generate_basic_system
 
 THRESHOLD = 0.2
 
+# extractor functions (see below) which make up the plot features
+VALUE_FUNCTIONS = ['get_sign_changes', 'get_rank_changes']
+SORT_FUNCTIONS = [
+    'sort_by_network_density', 'sort_by_indeg', 'sort_by_outdeg', 'sort_by_cycle_num']
+
 def sort_columns(data, sort_data, sort_functions):
     """ Sort columns of `data` by multiple sort functions applied to `sort_data` in order
     """
@@ -40,7 +47,7 @@ def sort_columns(data, sort_data, sort_functions):
         sort_tmp = list(sorted(sort_tmp, key=lambda pair: sfunc(pair[0])))
     return np.transpose(tmp), inds
 
-def handle_enh_entry(raw_res, enh_res, val_func):
+def handle_enh_entry(raw_res, enh_res, val_func, threshold=None):
     """ Compare given networks with given function
     """
     raw_sde, raw_odesde = raw_res
@@ -56,26 +63,132 @@ def handle_enh_entry(raw_res, enh_res, val_func):
     raw_vals = extract_sig_entries(raw_mat)
     enh_vals = extract_sig_entries(enh_mat)
 
-    return val_func(raw_vals, enh_vals)
+    if threshold is None:
+        return val_func(raw_vals, enh_vals)
+    return val_func(raw_vals, enh_vals, threshold=threshold)
+
+def sig_entry_tensor(data):
+    """ Extract lower-triangular correlation entries of all raw networks
+        `(configs, pairs)` and their embeddings `(configs, embeddings, pairs)`
+        (fourth node is disregarded). Also returns `(configs, embeddings)`
+        mask of entries where both correlation matrices exist
+    """
+    def mat_of(res):
+        _, odesde = res
+        return odesde[1]
+
+    mats = [mat_of(raw) for raw, _ in data if mat_of(raw) is not None]
+    dim = mats[0].shape[0] if len(mats) > 0 else 0
+    coords = np.tril_indices(dim, k=-1)
+
+    conf_num = len(data)
+    emb_num = max([len(enh_res) for _, enh_res in data] + [0])
+
+    raw_vals = np.zeros((conf_num, coords[0].size))
+    enh_vals = np.zeros((conf_num, emb_num, coords[0].size))
+    valid = np.zeros((conf_num, emb_num), dtype=bool)
+
+    for c, (raw, enh_res) in enumerate(data):
+        raw_mat = mat_of(raw)
+        if raw_mat is None:
+            continue
+        raw_vals[c] = raw_mat[coords]
+
+        for e, enh in enumerate(enh_res):
+            enh_mat = mat_of(enh)
+            if enh_mat is None:
+                continue
+            enh_vals[c, e] = enh_mat[:-1,:-1][coords]
+            valid[c, e] = True
+
+    return raw_vals, enh_vals, valid
+
+def sign_change_counts(raw_vals, enh_vals, thresholds):
+    """ Vectorized `get_sign_changes` for all thresholds at once.
+        Entries below a threshold are annihilated, so a sign change counts for
+        all thresholds up to the smaller absolute value of both entries.
+        Returns array of shape `(thresholds, configs, embeddings)`
+    """
+    raw_vals = raw_vals[:, None, :]
+
+    flip = (np.sign(raw_vals) * np.sign(enh_vals)) < 0
+    limit = np.where(flip, np.minimum(abs(raw_vals), abs(enh_vals)), -np.inf)
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    return (thresholds[:, None, None, None] <= limit[None]).sum(axis=-1)
+
+def compute_plot_features(data):
+    """ Compute value matrices `(configs, embeddings)` of all value functions,
+        sort keys of all embeddings and row labels at once
+    """
+    features = {'threshold': np.array(THRESHOLD)}
+    for vname in VALUE_FUNCTIONS:
+        features['value__' + vname] = np.array([
+            [handle_enh_entry(raw, enh, globals()[vname]) for enh in enh_res]
+                for raw, enh_res in data])
+
+    char_netws = [n[0] for n in data[0][1]]
+    for sname in SORT_FUNCTIONS:
+        features['sort__' + sname] = np.array(
+            [globals()[sname](n[0]) for n in char_netws])
+
+    features['yticks'] = np.array(
+        [round(np.mean(abs(r[0][0].jacobian)), 2) for r, e in data])
+    return features
 
-def preprocess_data(data, val_func, sort_functionality):
+def load_plot_features(fname, inp):
+    """ Load plot features of input file, they are cached next to it
+        and recomputed if the input or `THRESHOLD` changed
+    """
+    cache_fname = '{}.features.npz'.format(fname)
+    if os.path.exists(cache_fname) \
+            and os.path.getmtime(cache_fname) >= modification_time(fname):
+        with np.load(cache_fname) as fd:
+            features = dict(fd)
+        if features.get('threshold') == THRESHOLD:
+            return features
+
+    features = compute_plot_features(inp['data'])
+    np.savez(cache_fname, **features)
+    return features
+
+def preprocess_data(data, val_func, sort_functionality, features=None):
     """ Extract data information.
-        Sort columns primarily by first sort_function and then the others in order
+        Sort columns primarily by first sort_function and then the others in order.
+        Precomputed `features` (see `compute_plot_features`) are used if given
     """
+    vkey = 'value__' + val_func.__name__
+    if features is None or vkey not in features:
+        features = {}
+
     # compute matrix entries
-    plot_data = []
-    for raw, enh_res in data: # for each row
-        plot_data.append([handle_enh_entry(raw, enh, val_func) for enh in enh_res])
-    plot_data = np.array(plot_data)
+    if vkey in features:
+        plot_data = np.array(features[vkey])
+    else:
+        plot_data = []
+        for raw, enh_res in data: # for each row
+            plot_data.append([handle_enh_entry(raw, enh, val_func) for enh in enh_res])
+        plot_data = np.array(plot_data)
 
     # sort rows/columns in miraculous ways
     xtick_func = None
     repos = None
     char_netws = [n[0] for n in data[0][1]]
 
+    def sort_keys(sfunc):
+        skey = 'sort__' + sfunc.__name__
+        if skey in features:
+            return features[skey]
+        return np.array([sfunc(n[0]) for n in char_netws])
+
     if isinstance(sort_functionality, list):
-        plot_data, repos = sort_columns(
-            plot_data, char_netws, sort_functionality)
+        if len(features) > 0:
+            # stable sort by last function first, i.e. lexsort
+            repos = np.lexsort([sort_keys(f) for f in sort_functionality[::-1]])
+            plot_data = plot_data[:, repos]
+        else:
+            plot_data, repos = sort_columns(
+                plot_data, char_netws, sort_functionality)
 
         xtick_func = sort_functionality[0]
     elif isinstance(sort_functionality, tuple):
@@ -86,8 +199,11 @@ def preprocess_data(data, val_func, sort_functionality):
             'Invalid sort-method ({})'.format(sort_functionality))
 
     # generate axes labels
-    xtick_labels = np.array([xtick_func(n[0]) for n in char_netws])[repos]
-    ytick_labels = [round(np.mean(abs(r[0][0].jacobian)), 2) for r, e in data]
+    xtick_labels = sort_keys(xtick_func)[repos]
+    if 'yticks' in features:
+        ytick_labels = features['yticks'].tolist()
+    else:
+        ytick_labels = [round(np.mean(abs(r[0][0].jacobian)), 2) for r, e in data]
 
     return plot_data, xtick_labels, ytick_labels
 
@@ -110,7 +226,7 @@ def get_matrix_cmap():
     cmap.set_under('white')
     return cmap
 
-def plot_result(inp, vfunc, sfuncs, title, fname):
+def plot_result(inp, vfunc, sfuncs, title, fname, features=None):
     """ Plot generated matrix
 
         `sfuncs` can either be a list of functions or a string of the form:
@@ -121,7 +237,7 @@ def plot_result(inp, vfunc, sfuncs, title, fname):
     print('Plotting "{}"'.format(fname), end='... ', flush=True)
 
     # preprocess data
-    data, xticks, yticks = preprocess_data(inp['data'], vfunc, sfuncs)
+    data, xticks, yticks = preprocess_data(inp['data'], vfunc, sfuncs, features)
 
     # stop, it's plotting time!
     if isinstance(sfuncs, tuple): # there will be clustering
@@ -343,11 +459,11 @@ def bin_correlations(vals, low_thres=None, high_thres=None):
     tmp[vals > high_thres] = 1
     return tmp
 
-def get_sign_changes(raw_vals, enh_vals):
+def get_sign_changes(raw_vals, enh_vals, threshold=None):
     """ Compute number of sign changes
     """
-    raw_vals = annihilate_low_correlations(raw_vals)
-    enh_vals = annihilate_low_correlations(enh_vals)
+    raw_vals = annihilate_low_correlations(raw_vals, threshold)
+    enh_vals = annihilate_low_correlations(enh_vals, threshold)
 
     nv_inds = np.intersect1d(np.nonzero(raw_vals), np.nonzero(enh_vals))
     nz_rw = raw_vals[nv_inds]
@@ -355,11 +471,12 @@ def get_sign_changes(raw_vals, enh_vals):
 
     return np.sum(np.invert(np.sign(nz_rw) == np.sign(nz_eh)))
 
-def get_rank_changes(raw_vals, enh_vals):
+def get_rank_changes(raw_vals, enh_vals, threshold=None):
     """ Detect changes in the order of correlations
     """
-    raw_vals = bin_correlations(raw_vals)
-    enh_vals = bin_correlations(enh_vals)
+    low, high = (None, None) if threshold is None else (-threshold, threshold)
+    raw_vals = bin_correlations(raw_vals, low, high)
+    enh_vals = bin_correlations(enh_vals, low, high)
     return np.sum(np.invert(np.argsort(raw_vals) == np.argsort(enh_vals)))
 
 # sorting functions
@@ -381,12 +498,15 @@ def sort_by_outdeg(netw):
 
 def sort_by_cycle_num(netw):
     """number of cycles"""
-    graph = nx.from_numpy_matrix(netw.jacobian, create_using=nx.DiGraph())
-    return len(list(nx.simple_cycles(graph)))
+    return count_cycles(netw.jacobian)
 
-def handle_plots(inp):
-    """ Generate plots for varying data extraction functions
+def handle_plots(inp, features=None):
+    """ Generate plots for varying data extraction functions.
+        All of them are permutations/clusterings of the same `features`
     """
+    if features is None:
+        features = compute_plot_features(inp['data'])
+
     for vfunc, title in zip([get_sign_changes, get_rank_changes], ['sign', 'rank']):
         ptitle = '{} changes'.format(title)
 
@@ -394,32 +514,40 @@ def handle_plots(inp):
         for clus_typ in ['hamming', 'minkowski']:
             plot_result(inp,
                 vfunc, (sort_by_outdeg, 'cluster:{}'.format(clus_typ)),
-                ptitle, 'images/matrix_{}_outdeg_{}.pdf'.format(title, clus_typ))
+                ptitle, 'images/matrix_{}_outdeg_{}.pdf'.format(title, clus_typ),
+                features)
             plot_result(inp,
                 vfunc, (sort_by_indeg, 'cluster:{}'.format(clus_typ)),
-                ptitle, 'images/matrix_{}_indeg_{}.pdf'.format(title, clus_typ))
+                ptitle, 'images/matrix_{}_indeg_{}.pdf'.format(title, clus_typ),
+                features)
             plot_result(inp,
                 vfunc, (sort_by_network_density, 'cluster:{}'.format(clus_typ)),
-                ptitle, 'images/matrix_{}_netdens_{}.pdf'.format(title, clus_typ))
+                ptitle, 'images/matrix_{}_netdens_{}.pdf'.format(title, clus_typ),
+                features)
             plot_result(inp,
                 vfunc, (sort_by_cycle_num, 'cluster:{}'.format(clus_typ)),
-                ptitle, 'images/matrix_{}_cycles_{}.pdf'.format(title, clus_typ))
+                ptitle, 'images/matrix_{}_cycles_{}.pdf'.format(title, clus_typ),
+                features)
 
         # vanilla matrices
         plot_result(inp,
             vfunc, [sort_by_network_density],
-            ptitle, 'images/matrix_{}_netdens.pdf'.format(title))
+            ptitle, 'images/matrix_{}_netdens.pdf'.format(title),
+            features)
         plot_result(inp,
             vfunc, [sort_by_indeg, sort_by_outdeg],
-            ptitle, 'images/matrix_{}_indeg.pdf'.format(title))
+            ptitle, 'images/matrix_{}_indeg.pdf'.format(title),
+            features)
         plot_result(inp,
             vfunc, [sort_by_outdeg, sort_by_indeg],
-            ptitle, 'images/matrix_{}_outdeg.pdf'.format(title))
+            ptitle, 'images/matrix_{}_outdeg.pdf'.format(title),
+            features)
         plot_result(inp,
             vfunc, [sort_by_cycle_num],
-            ptitle, 'images/matrix_{}_cycles.pdf'.format(title))
+            ptitle, 'images/matrix_{}_cycles.pdf'.format(title),
+            features)
 
-def handle_input_spec(inp, spec):
+def handle_input_spec(inp, spec, features=None):
     """ Only plot specified entries
         `spec` can be of the form:
         <value_func>|<sort_func>|<slice>,<slice>
@@ -435,7 +563,7 @@ def handle_input_spec(inp, spec):
     slc_row = slice(*ex(s1))
     slc_col = slice(*ex(s2))
 
-    data, xticks, yticks = preprocess_data(inp['data'], vfunc, [sfunc])
+    data, xticks, yticks = preprocess_data(inp['data'], vfunc, [sfunc], features)
     print(data[slc_row, slc_col])
 
 def aggregate_motif_data(data, value_func=get_sign_changes, resolution=500):
@@ -459,39 +587,29 @@ def aggregate_motif_data(data, value_func=get_sign_changes, resolution=500):
         return np.std(cur, axis=0)[idx] / 2
 
 
-    global THRESHOLD
     threshold_list = np.logspace(-5, 0, resolution-1)
     imp_thres = find_threshold(data)
 
     threshold_list = np.array(sorted(np.r_[imp_thres, threshold_list]))
 
     # produce data
-    #first_data, last_data, std_data = None, None, None
-    pairs = []
-    for thres in tqdm(threshold_list):
-        THRESHOLD = thres
-
-        cur = []
-        for raw, enh_res in data: # for each parameter configuration
-            cur.append([handle_enh_entry(raw, enh, value_func) for enh in enh_res])
-        cur = np.array(cur)
-
-        #if thres == threshold_list[0]:
-        #    first_data = cur
-        #if thres == threshold_list[-1]:
-        #    last_data = cur
-        #if thres >= imp_thres and std_data is None:
-        #    std_data = cur
-
-        mat_res = np.sum(cur[cur>0])
-        pairs.append((thres, mat_res))
-
-    if cur.size == 0:
+    raw_vals, enh_vals, valid = sig_entry_tensor(data)
+    if valid.size == 0:
         return None, None, None
 
-    print('Data shape:', cur.shape)
-    total_num = cur[cur>=0].size * 3
-    pairs = [(t,m/total_num) for t,m in pairs]
+    if value_func is get_sign_changes:
+        counts = sign_change_counts(raw_vals, enh_vals, threshold_list)
+    else:
+        counts = np.array([[[
+            value_func(raw_vals[c].copy(), enh_vals[c, e].copy(), threshold=thres)
+                for e in range(valid.shape[1])]
+                for c in range(valid.shape[0])]
+                for thres in tqdm(threshold_list)])
+    counts = np.where(valid[None], counts, 0)
+
+    print('Data shape:', valid.shape)
+    total_num = valid.sum() * raw_vals.shape[1]
+    pairs = list(zip(threshold_list, counts.sum(axis=(1, 2)) / total_num))
 
     # compute AUC of values right of threshold
     t_vals = [t for t,m in pairs if t >= imp_thres]
@@ -568,21 +686,12 @@ def threshold_influence(inp, ax=None, value_func=get_sign_changes, resolution=50
 
 def plot_motif_overview(prefix, resolution=500):
     # get data
-    data = {}
-    pref_dir = os.path.dirname(prefix)
-    for fn in os.listdir(pref_dir):
-        if fn.startswith(os.path.basename(prefix)):
-            fname = os.path.join(pref_dir, fn)
-
-            with open(fname, 'rb') as fd:
-                inp = pickle.load(fd)
-
-            data[fn] = {
-                'idx': int(fn.split('_')[-1]),
-                'areas': [],
-                'motif': inp['motif'],
-                'inp': inp
-            }
+    data = {
+        idx: {
+            'areas': [],
+            'motif': inp['motif'],
+            'inp': inp
+        } for idx, inp in load_motif_results(prefix).items()}
 
     # plot data
     plt.figure(figsize=(25,5))
@@ -590,9 +699,9 @@ def plot_motif_overview(prefix, resolution=500):
 
     # add motif and threshold plots
     a_auc = None
-    for i, k in enumerate(sorted(data, key=lambda x: float(x.split('_')[-1]))):
+    for i, k in enumerate(sorted(data)):
         print('>', k)
-        idx = int(k.split('_')[-1])
+        idx = k
 
         # motif
         with plt.style.context(('default')):
@@ -646,22 +755,20 @@ def main():
     if len(sys.argv) == 2:
         fname = sys.argv[1]
 
-        if os.path.exists(fname):
-            with open(fname, 'rb') as fd:
-                inp = pickle.load(fd)
+        if os.path.exists(fname) and not is_motif_store(fname):
+            inp = load_results(fname)
 
             threshold_influence(inp)
             #threshold_influence(inp, value_func=get_rank_changes)
 
-            #handle_plots(inp)
+            #handle_plots(inp, load_plot_features(fname, inp))
         else:
             # assume fname is motif prefix
             plot_motif_overview(fname)
     elif len(sys.argv) == 3:
         fname = sys.argv[1]
-        with open(fname, 'rb') as fd:
-            inp = pickle.load(fd)
-        handle_input_spec(inp, sys.argv[2])
+        inp = load_results(fname)
+        handle_input_spec(inp, sys.argv[2], load_plot_features(fname, inp))
     else:
         print('Usage: %s [data file] [plot spec]' % sys.argv[0])
         sys.exit(-1)
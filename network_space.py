@@ -3,7 +3,6 @@ Visualize networks via results on axes
 """
 
 import sys
-import pickle
 
 import numpy as np
 import pandas as pd
@@ -13,6 +12,7 @@ import matplotlib as mpl
 import matplotlib.pylab as plt
 
 from utils import extract_sig_entries
+from result_store import load_results
 from plotter import *
 
 
@@ -160,9 +160,7 @@ def main(data):
 if __name__ == '__main__':
     if len(sys.argv) == 2:
         fname = sys.argv[1]
-        with open(fname, 'rb') as fd:
-            inp = pickle.load(fd)
-        main(inp['data'])
+        main(load_results(fname)['data'])
     else:
         print('Usage: {} <data file>'.format(sys.argv[0]))
         exit(1)
@@ -7,6 +7,7 @@ import sys
 import copy
 import pickle
 import itertools
+import functools
 
 from multiprocessing import Pool, cpu_count
 from multiprocessing.pool import ThreadPool
@@ -16,7 +17,8 @@ import numpy.random as npr
 from tqdm import tqdm, trange
 
 from setup import generate_basic_system, generate_two_node_system, generate_motifs
-from main import analyze_system
+from main import analyze_system_pair
+from result_store import ResultStore, write_matrix_row
 
 
 def add_node_to_system(syst):
@@ -50,56 +52,74 @@ def add_node_to_system(syst):
 
     return systems
 
-def handle_systems(raw, enhanced):
-    """ Simulate given systems
+def handle_systems(
+    raw, enhanced, trajectory='none', common_noise=False, reps=100,
+    target_se=None
+):
+    """ Simulate given systems, trajectories are kept according to `trajectory`.
+        Both analyses of each system share their SDE replicates.
+        With `common_noise`, replicate `i` of all systems uses the same noise
+        paths for the nodes they have in common (common random numbers).
+        `target_se` enables adaptive replicate counts (see `analyze_system`)
     """
+    seeds, noise_dim = None, None
+    if common_noise:
+        seeds = npr.RandomState().randint(2**32, size=reps, dtype=np.int64)
+        noise_dim = max(s.jacobian.shape[0] for s in [raw] + list(enhanced))
+
     # generate control data
-    raw_res_diff = analyze_system(raw, filter_mask=[3], use_ode_sde_diff=True, save_stdev='results/corr_stdev')
-    raw_res = analyze_system(raw, filter_mask=[3], use_ode_sde_diff=False)
-    if raw_res[1] is None or raw_res_diff[1] is None:
+    raw_res, raw_res_diff = analyze_system_pair(
+        raw, repetition_num=reps, filter_mask=[3],
+        save_stdev='results/corr_stdev', trajectory=trajectory,
+        seeds=seeds, noise_dim=noise_dim, target_se=target_se)
+    if raw_res[1] is None:
         return None
 
     # generate data from altered motifs
     row = []
     for enh in enhanced:
-        enh_res_diff = analyze_system(
-            enh, filter_mask=[3],
-            use_ode_sde_diff=True)
-        enh_res = analyze_system(
-            enh, filter_mask=[3],
-            use_ode_sde_diff=False)
-        row.append((enh_res, enh_res_diff))
+        row.append(analyze_system_pair(
+            enh, repetition_num=reps, filter_mask=[3], trajectory=trajectory,
+            seeds=seeds, noise_dim=noise_dim, target_se=target_se))
 
     return [(raw_res, raw_res_diff), row]
 
-def generate_system_data(motifs_three):
+def generate_system_data(motif_idx, motifs_three, store):
     """ Generate data for a given system
     """
-    res = []
-    for motif in motifs_three:
+    for i, motif in enumerate(motifs_three):
         getter = lambda k_m, k_23: motif
-        cur = generate_data(None, gen_func=getter)
-        res.append(cur)
-    return (getter(1,1), res)
+        generate_data(None, gen_func=getter, store=store, motif=motif_idx, driver=i)
+    return motif_idx, getter(1,1)
 
-def generate_motif_data(prefix):
-    """ Generate data for all motifs
+def generate_motif_data(fname):
+    """ Generate data for all motifs and store them in a single result store
     """
     motifs = generate_motifs()
+
+    # meta is complete before simulating, so aborted runs stay readable
+    store = ResultStore(fname, mode='w')
+    store.set_meta(
+        layout='matrices', drivers=len(motifs[0]),
+        motifs={idx: drivers[-1]() for idx, drivers in enumerate(motifs)})
+
     with tqdm(total=len(motifs)) as pbar:
         resolution = int(cpu_count() * 3/4)
         with ThreadPool(resolution) as p:
-            for motif, rows_three in p.map(generate_system_data, motifs):
-                fname = '{}_{}'.format(prefix, pbar.n)
-                with open(fname, 'wb') as fd:
-                    pickle.dump({
-                        'data': rows_three,
-                        'motif': motif
-                    }, fd)
+            for _ in p.imap_unordered(
+                lambda args: generate_system_data(*args),
+                zip(range(len(motifs)), motifs, itertools.repeat(store))
+            ):
                 pbar.update()
 
+def _handle_configuration(conf, **kwargs):
+    return handle_systems(*conf, **kwargs)
 
-def generate_data(fname, gen_func=generate_basic_system, paramter_shift=10):
+def generate_data(
+    fname, gen_func=generate_basic_system, paramter_shift=10,
+    store=None, motif=0, driver=0,
+    common_noise=False, reps=100, target_se=None
+):
     """ Generate and cache data of the form
         {
             'data': [
@@ -107,11 +127,12 @@ def generate_data(fname, gen_func=generate_basic_system, paramter_shift=10):
                 ...
             ] # rows in output plot
         }
+        Rows are appended to result store `fname` (or `store`) as they finish.
+        `common_noise`, `reps` and `target_se` are passed to `handle_systems`
     """
     param_range = np.linspace(0.1, 5, paramter_shift)
 
     # iterate over parameter configurations and simulate system accordingly
-    rows = []
     configurations = []
     for k_m in param_range:
         for k_23 in param_range:
@@ -123,22 +144,27 @@ def generate_data(fname, gen_func=generate_basic_system, paramter_shift=10):
         if gen_func == generate_two_node_system:
             break
 
+    if store is None and not fname is None:
+        store = ResultStore(fname, mode='w')
+        store.set_meta(layout='matrices')
+
     rows = []
     with tqdm(total=len(configurations)) as pbar:
         resolution = int(cpu_count() * 3/4)
         with Pool(resolution) as p:
-            for res in p.starmap(handle_systems, configurations):
+            sim_func = functools.partial(
+                _handle_configuration,
+                common_noise=common_noise, reps=reps, target_se=target_se)
+            for res in p.imap(sim_func, configurations):
                 if not res is None:
-                    rows.append(res)
+                    if store is None:
+                        rows.append(res)
+                    else:
+                        write_matrix_row(
+                            store, res, pbar.n, motif=motif, driver=driver)
                 pbar.update()
 
-    # store matrix
-    if not fname is None:
-        with open(fname, 'wb') as fd:
-            pickle.dump({
-                'data': rows
-            }, fd)
-    else:
+    if store is None:
         return rows
 
 def generate_random_data(fname, paramter_shift=10):
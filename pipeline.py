@@ -5,12 +5,14 @@ Clean pipeline of robustness detection
 import os
 import sys
 import copy
-import pickle
+import itertools
+import functools
 from typing import Any, Tuple, List, Callable
 from multiprocessing import Pool, cpu_count
 from multiprocessing.pool import ThreadPool
 
 import numpy as np
+import numpy.random as npr
 import pandas as pd
 import networkx as nx
 import scipy.stats as scis
@@ -19,12 +21,17 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
-from tqdm import tqdm, trange
+from tqdm import tqdm
 
 from solver import solve_system
 from filters import filter_steady_state
+from utils import replicate_batches
+from main import solve_ode, extract_steady_state
 from nm_data_generator import add_node_to_system
 from setup import generate_basic_system, generate_two_node_system, generate_v_out, generate_motifs
+from result_store import (
+    ResultStore, write_distributions, load_results, load_motif_results,
+    is_motif_store)
 
 
 def threshold_div(distr: np.ndarray, thres: float) -> Tuple[np.ndarray, np.ndarray]:
@@ -101,59 +108,93 @@ def initial_tests(n: int = 1000) -> None:
     plt.tight_layout()
     plt.savefig('images/robustness_development.pdf')
 
-def simulate_systems(raw, enhanced, reps=100):
-    """ Simulate given systems and return raw vs enhanced versions
+def simulate_systems(
+    raw, enhanced, reps=100, common_noise=False,
+    target_se=None, batch_size=10
+):
+    """ Simulate given systems and return raw vs enhanced versions.
+        With `common_noise`, replicate `i` of all systems uses the same noise
+        paths for the nodes they have in common (common random numbers).
+        If `target_se` is given, replicates of each system are added in batches
+        of `batch_size` until the standard error of all off-diagonal mean
+        correlations falls below it (at most `reps` replicates).
+        The number of simulated replicates is reported per system
     """
-    def sim(sde_system):
-        ode_system = copy.deepcopy(sde_system)
-        ode_system.fluctuation_vector = np.zeros(sde_system.fluctuation_vector.shape)
+    seeds, noise_dim = [None] * reps, None
+    if common_noise:
+        seeds = npr.RandomState().randint(2**32, size=reps, dtype=np.int64)
+        noise_dim = max(s.jacobian.shape[0] for s in [raw] + list(enhanced))
 
+    def sim(sde_system):
         corr_mats = []
-        for _ in trange(reps):
-            sde_sol = solve_system(sde_system)
-            ode_sol = solve_system(ode_system)
-
-            sol = ode_sol - sde_sol
-            sol_extract = sol.T[int(len(sol.T)*3/4):] # extract steady-state
-
-            # filter based on ODE solution
-            if filter_steady_state(ode_sol.T[int(len(ode_sol.T)*3/4):]):
-                continue
-
-            # compute correlations
-            stop = False
-            dim = sol_extract.shape[1]
-            mat = np.empty((dim,dim))
-            for i in range(dim):
-                for j in range(dim):
-                    xs, ys = sol_extract[:,i], sol_extract[:,j]
-                    try:
-                        cc, pval = scis.pearsonr(xs, ys)
-                        mat[i,j] = cc
-                    except FloatingPointError:
-                        stop = True
-                        break
-                if stop:
-                    break
-
-            if not stop:
-                corr_mats.append(mat)
-        return np.asarray(corr_mats)
+        num = 0
+
+        # the ODE is deterministic, so it decides about filtering once
+        ode_sol, filtered = solve_ode(sde_system)
+        if filtered:
+            return np.asarray(corr_mats), num
+        ode_extract = extract_steady_state(ode_sol)
+
+        with tqdm(total=len(seeds)) as pbar:
+            for batch in replicate_batches(seeds, [corr_mats], target_se, batch_size):
+                for seed in batch:
+                    mat = sim_replicate(sde_system, ode_extract, seed)
+                    if mat is not None:
+                        corr_mats.append(mat)
+                    num += 1
+                    pbar.update()
+
+            # adaptive sampling may stop before all seeds are used
+            pbar.total = num
+            pbar.refresh()
+        return np.asarray(corr_mats), num
+
+    def sim_replicate(sde_system, ode_extract, seed):
+        """ Correlation matrix of single replicate, None if it is undefined
+        """
+        sde_sol = solve_system(sde_system, seed=seed, noise_dim=noise_dim)
+        sol_extract = ode_extract - extract_steady_state(sde_sol)
+
+        # compute correlations
+        dim = sol_extract.shape[1]
+        mat = np.empty((dim,dim))
+        for i in range(dim):
+            for j in range(dim):
+                xs, ys = sol_extract[:,i], sol_extract[:,j]
+                try:
+                    cc, pval = scis.pearsonr(xs, ys)
+                    mat[i,j] = cc
+                except FloatingPointError:
+                    return None
+        return mat
 
     curs = []
+    enh_reps = []
     for enh in tqdm(enhanced, desc='For each enhanced motif'):
-        curs.append(sim(enh))
+        mats, num = sim(enh)
+        curs.append(mats)
+        enh_reps.append(num)
 
+    raw_mats, raw_reps = sim(raw)
     return {
-        'raw_corr_mats': sim(raw),
-        'enh_corr_mat_list': curs #[sim(enh) for enh in enhanced]
+        'raw_corr_mats': raw_mats,
+        'enh_corr_mat_list': curs, #[sim(enh) for enh in enhanced]
+        'raw_reps': raw_reps,
+        'enh_reps': enh_reps
     }
 
+def _simulate_configuration(conf, **kwargs):
+    return simulate_systems(*conf, **kwargs)
+
 def generate_data(
     fname: str, gen_func: Callable = generate_basic_system,
-    paramter_shift: int = 10
+    paramter_shift: int = 10,
+    store: ResultStore = None, motif: int = 0, driver: int = 0,
+    common_noise: bool = False, reps: int = 100, target_se: float = None
 ) -> None:
-    """ Generate individual correlation realizations for varying parameters and embeddings
+    """ Generate individual correlation realizations for varying parameters and embeddings.
+        Results are appended to result store `fname` (or `store`) as configurations finish.
+        `common_noise`, `reps` and `target_se` are passed to `simulate_systems`
     """
     param_range = np.linspace(1, 8, paramter_shift)
 
@@ -165,57 +206,66 @@ def generate_data(
             more = add_node_to_system(syst)
             configurations.append((syst, more))
 
+    if store is None and not fname is None:
+        store = ResultStore(fname, mode='w')
+        store.set_meta(layout='distributions', motif=gen_func())
+
     # simulate data
     data = []
     with tqdm(total=len(configurations), desc='For each configuration') as pbar:
         resolution = max(1, int(cpu_count() * 1/8))
         with Pool(resolution) as p:
-            for res in p.starmap(simulate_systems, configurations):
+            sim_func = functools.partial(
+                _simulate_configuration,
+                common_noise=common_noise, reps=reps, target_se=target_se)
+            for res in p.imap(sim_func, configurations):
                 if not res is None:
-                    data.append(res)
+                    if store is None:
+                        data.append(res)
+                    else:
+                        write_distributions(
+                            store, res, pbar.n, motif=motif, driver=driver)
                 pbar.update()
 
-    # store data
-    if not fname is None:
-        with open(fname, 'wb') as fd:
-            pickle.dump({
-                'data': data,
-                'motif': gen_func()
-            }, fd)
-    else:
+    if store is None:
         return data
 
-def generate_system_data(motif_idx, motifs_three):
+def generate_system_data(motif_idx, motifs_three, store):
     """ Generate data for a given system
     """
-    res = []
     # iterate over three ways of driving given motif
     for i, motif_func in enumerate(motifs_three):
         try:
-            cur = generate_data(None, gen_func=motif_func)
+            generate_data(
+                None, gen_func=motif_func,
+                store=store, motif=motif_idx, driver=i)
         except FloatingPointError:
-            cur = None
-        res.append(cur)
-    return ({
+            # configurations written so far are incomplete
+            store.mark_failed(motif=motif_idx, driver=i)
+    return {
         'motif': motif_func(),
         'idx': motif_idx
-    }, res)
+    }
 
-def generate_motif_data(prefix):
-    """ Generate data for all motifs
+def generate_motif_data(fname):
+    """ Generate data for all motifs and store them in a single result store
     """
     motifs = generate_motifs()
+
+    # meta is complete before simulating, so aborted runs stay readable
+    store = ResultStore(fname, mode='w')
+    store.set_meta(
+        layout='distributions', drivers=len(motifs[0]),
+        motifs={idx: drivers[-1]() for idx, drivers in enumerate(motifs)})
+
     with tqdm(total=len(motifs), desc='For each motif') as pbar:
         resolution = max(1, int(cpu_count() * 1/8))
         with ThreadPool(resolution) as p:
             # iterate over motif topologies
-            for info, result in p.starmap(generate_system_data, zip(range(len(motifs)), motifs)):
-                fname = '{}_{}'.format(prefix, info['idx'])
-                with open(fname, 'wb') as fd:
-                    pickle.dump({
-                        'data': result,
-                        'motif': info['motif']
-                    }, fd)
+            for _ in p.imap_unordered(
+                lambda args: generate_system_data(*args),
+                zip(range(len(motifs)), motifs, itertools.repeat(store))
+            ):
                 pbar.update()
 
 def handle_enh_entry(entry, thres: float) -> List:
@@ -241,6 +291,86 @@ def handle_enh_entry(entry, thres: float) -> List:
 
     return cur
 
+def tail_fractions(
+    distrs: List[np.ndarray], thresholds: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Fractions of each distribution below `-t` and above `t` for all thresholds.
+        `thresholds` (within [0, 2)) has shape `(T,)` or `(T, len(distrs))`,
+        results have shape `(T, len(distrs))` (NaN for empty distributions).
+        NaN samples count as 0, i.e. lie in neither tail
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    assert ((thresholds >= 0) & (thresholds < 2)).all(), 'Invalid thresholds'
+
+    sizes = np.array([d.size for d in distrs])
+    width = max(sizes.max() if sizes.size > 0 else 0, 1)
+
+    # pad rows with value above all thresholds and shift them into disjoint
+    # ranges, so a single searchsorted handles all distributions at once
+    padded = np.full((len(distrs), width), 2.)
+    for i, d in enumerate(distrs):
+        padded[i, :d.size] = np.nan_to_num(np.clip(d, -1, 1))
+    padded.sort(axis=1)
+
+    offset = 4 * np.arange(len(distrs))
+    flat = (padded + offset[:, None]).ravel()
+
+    thr = np.broadcast_to(
+        thresholds[:, None] if thresholds.ndim == 1 else thresholds,
+        (thresholds.shape[0], len(distrs)))
+    start = width * np.arange(len(distrs))
+
+    num_below = np.searchsorted(flat, offset - thr, side='left') - start
+    num_above = sizes - (np.searchsorted(flat, offset + thr, side='right') - start)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return num_below / sizes, num_above / sizes
+
+def robustness_tensor(data: List, thresholds: np.ndarray) -> np.ndarray:
+    """ Evaluate `compare_distributions` for all thresholds, parameter
+        configurations, embeddings and node pairs at once.
+        `thresholds` has shape `(T,)` or `(T, configs)`, result has shape
+        `(T, configs, embeddings, pairs)` (NaN where data is missing)
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    if thresholds.ndim == 1:
+        thresholds = np.repeat(thresholds[:, None], len(data), axis=1)
+
+    dims = [e['raw_corr_mats'].shape[-1] for e in data if e['raw_corr_mats'].size > 0]
+    dim = dims[0] if len(dims) > 0 else 0
+    coords = np.tril_indices(dim, k=-1)
+
+    conf_num = len(data)
+    emb_num = max([len(e['enh_corr_mat_list']) for e in data] + [0])
+    pair_num = coords[0].size
+
+    empty = np.empty(0)
+    raw_distrs, enh_distrs = [], []
+    for entry in data:
+        raw = entry['raw_corr_mats']
+        for i, j in zip(*coords):
+            raw_distrs.append(raw[:, i, j] if raw.size > 0 else empty)
+
+        enh_list = list(entry['enh_corr_mat_list'])
+        enh_list += [empty] * (emb_num - len(enh_list))
+        for enh in enh_list:
+            for i, j in zip(*coords):
+                # embeddings without raw data are skipped as well
+                enh_distrs.append(
+                    enh[:, i, j] if enh.size > 0 and raw.size > 0 else empty)
+
+    n_1m, n_1p = tail_fractions(
+        raw_distrs, np.repeat(thresholds, pair_num, axis=1))
+    n_2m, n_2p = tail_fractions(
+        enh_distrs, np.repeat(thresholds, emb_num * pair_num, axis=1))
+
+    shape = (thresholds.shape[0], conf_num, emb_num, pair_num)
+    n_1m = n_1m.reshape(shape[0], conf_num, 1, pair_num)
+    n_1p = n_1p.reshape(shape[0], conf_num, 1, pair_num)
+    n_2m, n_2p = n_2m.reshape(shape), n_2p.reshape(shape)
+
+    return n_1p * n_2m * (n_2m - n_1m) + n_1m * n_2p * (n_2p - n_1p)
+
 def threshold_influence(
     data: List,
     ax=None, resolution: int = 100,
@@ -254,18 +384,20 @@ def threshold_influence(
     fname_cache = f'cache/ti_data{fname_app}.csv'
 
     if not os.path.exists(fname_cache):
-        tmp = {'threshold': [], 'correlation_transfer': [], 'param_config': []}
-        for thres in tqdm(threshold_list, desc='For each threshold'):
-            for i, entry in enumerate(data): # iterate over parameter configurations
-                res = handle_enh_entry(entry, thres)
-                if len(res) == 0:
-                    continue
-
-                for j, ct in enumerate(res):
-                    tmp['threshold'].append(thres)
-                    tmp['correlation_transfer'].append(ct)
-                    tmp['param_config'].append(f'{i},{j}')
-
+        rob = robustness_tensor(data, threshold_list)
+
+        # number entries per configuration as `handle_enh_entry` does
+        valid = ~np.isnan(rob)
+        valid_emb = valid.any(axis=(0, 3))
+        emb_idx = np.cumsum(valid_emb, axis=1) - 1
+
+        t, c, e, p = np.nonzero(valid)
+        tmp = {
+            'threshold': threshold_list[t],
+            'correlation_transfer': rob[t, c, e, p],
+            'param_config': [
+                f'{i},{j}' for i, j in zip(c, emb_idx[c, e] * rob.shape[3] + p)]
+        }
         df = pd.DataFrame(tmp)
         df.to_csv(fname_cache)
     else:
@@ -332,8 +464,8 @@ def threshold_influence(
 def fixed_threshold(data: List) -> Tuple[Any, Any]:
     """ Compute robustness with `thres = \sigma / 2` and return values
     """
-    robs, thresholds = [], []
-    for entry in data:
+    thresholds = np.full(len(data), np.nan)
+    for c, entry in enumerate(data):
         raw_corr_mats = entry['raw_corr_mats']
         if len(raw_corr_mats) == 0:
             continue
@@ -347,32 +479,31 @@ def fixed_threshold(data: List) -> Tuple[Any, Any]:
 
         min_idx = np.unravel_index(corr_scaled.argmin(), corr_scaled.shape)
         series = raw_corr_mats[:,min_idx[0],min_idx[1]] # better indexing?
-        sigmah = np.std(series) / 2
-        thresholds.append(sigmah)
+        thresholds[c] = np.std(series) / 2
 
-        # handle entry
-        res = handle_enh_entry(entry, sigmah)
-        robs.append(np.mean(res))
-    return np.asarray(robs), np.asarray(thresholds)
+    # handle all entries at once
+    used = ~np.isnan(thresholds)
+    if not used.any():
+        return np.empty(0), np.empty(0)
+
+    rob = robustness_tensor(
+        [e for e, u in zip(data, used) if u], thresholds[None, used])[0]
+    with np.errstate(invalid='ignore'):
+        robs = np.array([
+            np.mean(r[~np.isnan(r)]) if (~np.isnan(r)).any() else np.nan
+            for r in rob])
+    return robs, thresholds[used]
 
 def motif_overview(prefix):
     """ Conduct analysis over range of motifs
     """
     # get data
-    data = {}
-    pref_dir = os.path.dirname(prefix)
-    for fn in tqdm(os.listdir(pref_dir), desc='For each motif'):
-        if fn.startswith(os.path.basename(prefix)):
-            fname = os.path.join(pref_dir, fn)
-
-            with open(fname, 'rb') as fd:
-                inp = pickle.load(fd)
-
-            data[fn] = {
-                'idx': int(fn.split('_')[-1]),
-                'motif': inp['motif'],
-                'inp': inp
-            }
+    data = {
+        idx: {
+            'idx': idx,
+            'motif': inp['motif'],
+            'inp': inp
+        } for idx, inp in load_motif_results(prefix).items()}
 
     # plot data
     plt.figure(figsize=(6*len(data),13))
@@ -538,8 +669,7 @@ def plot_motif_statistics(df):
 
 
 def main(fname) -> None:
-    with open(fname, 'rb') as fd:
-        inp = pickle.load(fd)
+    inp = load_results(fname)
 
     fapp = f'__{os.path.basename(fname.replace(".", "_"))}'
     threshold_influence(np.asarray(inp['data']), fname_app=fapp)
@@ -562,7 +692,7 @@ if __name__ == '__main__':
     elif len(sys.argv) >= 2:
         for fname in sys.argv[1:]:
             print(f'>> {fname} <<')
-            if os.path.exists(fname):
+            if os.path.exists(fname) and not is_motif_store(fname):
                 main(fname)
             else:
                 # assume it's a motif prefix
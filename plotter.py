@@ -24,6 +24,12 @@ def save_figure(fname, **kwargs):
 def plot_system_evolution(sol, ax, show_legend=True, labels=None, xlabel='time'):
     """ Plot solution of integration
     """
+    if sol is None:
+        ax.text(
+            .5, .5, 'trajectory not stored',
+            ha='center', va='center', transform=ax.transAxes)
+        return
+
     for i, series in enumerate(sol):
         if labels is None:
             ax.plot(series, label=r'$S_{%d}$' % i)
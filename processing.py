@@ -8,13 +8,14 @@ import itertools
 import collections
 
 import numpy as np
-import networkx as nx
 
 import matplotlib.pylab as plt
 from matplotlib import gridspec
 
 from plotter import save_figure, plot_system, plot_corr_mat, plot_system_evolution
 from utils import get_correlation, extract_sig_entries
+from topology import load_table
+from system_store import load_system_results
 
 
 def plot_system_overview(data, sample_size=20):
@@ -131,11 +132,12 @@ def errorbar_plot(data, x_spec, y_spec, fname):
 def network_investigations(data):
     """ Conduct various investigations
     """
+    topo = load_table([syst for syst, _, _ in data])
+
     # define data functions
     def get_network_density(syst, mat):
-        max_edge_num = syst.jacobian.shape[0] * (syst.jacobian.shape[0]+1)
-        dens = np.count_nonzero(syst.jacobian) / max_edge_num
-        return dens
+        feats = topo[syst]
+        return feats['edges'] / (feats['nodes'] * (feats['nodes']+1))
 
     def get_correlation_mean(syst, mat):
         vals = extract_sig_entries(mat)
@@ -153,21 +155,10 @@ def network_investigations(data):
         return avg
 
     def get_clustering_coefficient(syst, mat):
-        graph = nx.from_numpy_matrix(syst.jacobian)
-        clus = nx.average_clustering(graph)
-        return clus
+        return topo[syst]['clustering']
 
     def get_average_shortest_path_len(syst, mat):
-        graph = nx.from_numpy_matrix(syst.jacobian)
-        try:
-            spl = nx.average_shortest_path_length(graph)
-        except nx.exception.NetworkXError:
-            try:
-                spl = np.mean([nx.average_shortest_path_length(g) \
-                    for g in nx.connected_component_subgraphs(graph)])
-            except ZeroDivisionError:
-                return None
-        return spl
+        return topo[syst]['shortest_path']
 
     # create plots
     errorbar_plot(data,
@@ -195,18 +186,21 @@ def node_degree(data, bin_num_x=100, bin_num_y=100):
     """ Compare node degree and correlation
     """
     # get data
+    topo = load_table([syst for syst, _, _ in data])
+
     ndegs = []
     avg_corrs = []
-    node_num = -1
     for syst, mat, _ in data:
-        graph = nx.DiGraph(syst.jacobian)
-        for i in graph.nodes():
-            ndegs.append(graph.degree(i))
-            ncorrs = [abs(mat[i, j]) for j in graph.neighbors(i) if i != j]
-            avg_corrs.append(
-                np.mean(ncorrs) if len(ncorrs) > 0 else 0)
-        node_num = graph.number_of_nodes()
-    assert node_num >= 0, 'Invalid data found'
+        # average absolute correlation to successors (excluding self)
+        succ = syst.jacobian != 0
+        np.fill_diagonal(succ, False)
+        succ_num = succ.sum(axis=1)
+        corr_sum = np.where(succ, abs(mat), 0).sum(axis=1)
+
+        ndegs.extend(topo[syst]['degree'])
+        avg_corrs.extend(np.divide(
+            corr_sum, succ_num, out=np.zeros(len(succ_num)), where=succ_num > 0))
+    assert len(ndegs) > 0, 'Invalid data found'
 
     # plot data
     heatmap, xedges, yedges = np.histogram2d(
@@ -233,7 +227,7 @@ def node_degree(data, bin_num_x=100, bin_num_y=100):
 def main(fname, data_step=1):
     """ Main interface
     """
-    data = np.load(fname)[::data_step]
+    data = load_system_results(fname)[::data_step]
 
     plot_system_overview(data)
     #network_density(data)
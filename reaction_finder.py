@@ -6,7 +6,6 @@ import os
 import csv
 import copy
 import pickle
-import random
 import itertools
 import collections
 
@@ -24,10 +23,16 @@ from tqdm import tqdm, trange
 
 import plotter
 import utils
+import motif_search
+import result_cache
+import compound_table
 import formula_investigator
 
 
-ATOM_LIST = 'CHONS'
+ATOM_LIST = compound_table.ATOM_LIST
+REACTION_FILE = 'data/Reaction_List.csv'
+PEAK_FILE = 'data/peaklist_filtered_assigned.csv'
+MZ_TOLERANCE = 1e-2
 
 def read_compounds_file(file_spec):
     """ Transform data from compounds file into usable format:
@@ -247,29 +252,50 @@ def check_pair(c1, c2, cdata, rdata):
 def combine_data(cdata, rdata):
     """ Combine compound and reaction data and extrapolate
     """
-    # compute cross-product of all compounds
-    prod = list(itertools.product(cdata.keys(), repeat=2))
-    data = collections.defaultdict(list)
+    ccols = compound_table.compound_columns(cdata)
+    rcols = compound_table.reaction_columns(rdata, ccols.group_names)
 
-    # find single reactions
-    for c1 in tqdm(cdata.keys()):
-        res = check_pair(c1, None, cdata, rdata)
-        for react in res:
-            data[react].append((c1, None))
+    c1_match = compound_table.match_matrix(ccols, rcols, 'c1')
+    c2_match = compound_table.match_matrix(ccols, rcols, 'c2')
+    names = np.array(ccols.names, dtype=object)
 
-    # find reaction partners
-    for c1, c2 in tqdm(prod):
-        res = check_pair(c1, c2, cdata, rdata)
-        for react in res:
-            data[react].append((c1, c2))
+    data = {}
+    for r, react in enumerate(tqdm(rcols.names)):
+        c1_idx = np.nonzero(c1_match[:, r])[0]
+
+        if not rcols.needs_c2[r]:
+            # single reactions
+            pairs = list(zip(names[c1_idx], itertools.repeat(None)))
+        else:
+            # reaction partners (ordered like cross-product of all compounds)
+            c2_idx = np.nonzero(c2_match[:, r])[0]
+            i, j = np.meshgrid(c1_idx, c2_idx, indexing='ij')
+            pairs = list(zip(names[i.ravel()], names[j.ravel()]))
+
+        if len(pairs) > 0:
+            data[react] = pairs
 
-    return dict(data)
+    return data
 
-def guess_new_compounds(combs, cdata, rdata):
+def guess_new_compounds(combs, cdata, rdata, table=None):
     """ Infer new compounds from reactions of existing ones.
+        Compounds are referred to by their ids in `table` (a
+        `compound_table.ProvenanceTable`), products are registered there.
+        Without `table`, compounds are keyed by name and product names
+        are only rendered on output
 
         All kinds of new information computations take place here
     """
+    if table is None:
+        table, ids = compound_table.ProvenanceTable.from_compounds(cdata)
+        id_combs = {
+            rname: [(ids[c1], ids[c2] if c2 is not None else None)
+                for c1, c2 in pairs]
+            for rname, pairs in combs.items()}
+
+        return table.to_names(guess_new_compounds(
+            id_combs, {ids[c]: d for c, d in cdata.items()}, rdata, table))
+
     def add_specs(*args):
         spec = {}
         for k in args[0]:
@@ -306,65 +332,24 @@ def guess_new_compounds(combs, cdata, rdata):
             new_atoms = add_specs(c1_atoms, c2_atoms, r_trans)
 
             # store results
-            new_name = '({c1}) {{{r}}} ({c2})'.format(r=rname, c1=c1, c2=c2)
-
-            data[new_name] = {
+            data[table.add_product(c1, rname, c2)] = {
                 'groups': new_groups,
                 'mass': new_mass,
                 'atoms': new_atoms,
-                'origin': (c1, c2)
+                'origin': (c1, c2),
+                'reaction': rname
             }
 
     return data
 
-def iterate_once(compound_data, reaction_data):
-    """ Find new products in given data
+def iterate_once(compound_data, reaction_data, table=None):
+    """ Find new products in given data (keyed by ids in `table` if given)
     """
     res = guess_new_compounds(
         combine_data(compound_data, reaction_data),
-        compound_data, reaction_data)
+        compound_data, reaction_data, table)
     return res
 
-def parse_compound_name(name):
-    """ Parse name and return compounds and reaction
-    """
-    assert name[0] == '(' and name[-1] == ')'
-
-    state = 'idle'
-    depth = 0
-
-    c1 = ''
-    r = ''
-    c2 = ''
-
-    for char in name:
-        if char in '({': depth += 1
-        if char in ')}': depth -= 1
-
-        if state == 'idle':
-            if depth > 0:
-                if len(c1) == 0: state = 'c1'
-                elif len(r) == 0: state = 'r'
-                elif len(c2) == 0: state = 'c2'
-        elif state == 'c1':
-            if depth > 0:
-                c1 += char
-            else:
-                state = 'idle'
-        elif state == 'r':
-            if depth > 0:
-                r += char
-            else:
-                state = 'idle'
-        elif state == 'c2':
-            if depth > 0:
-                c2 += char
-            else:
-                state = 'idle'
-
-    assert state == 'idle'
-    return c1, r, c2
-
 def read_peak_data(fname):
     """ Parse peak data file
     """
@@ -380,10 +365,34 @@ def read_peak_data(fname):
             data[float(mass)] = ints
     return data
 
-def match_masses(masses, fname='data/peaklist_filtered_assigned.csv'):
+class PeakIndex(object):
+    """ Reverse map from intensity vectors to peak ids and MZ values
+    """
+    def __init__(self, pdata):
+        self.mz = np.fromiter(pdata.keys(), dtype=float, count=len(pdata))
+
+        self._ids = {}
+        for i, ints in enumerate(pdata.values()):
+            self._ids.setdefault(tuple(ints), i) # first peak wins
+
+    def __len__(self):
+        return self.mz.size
+
+    def peak_id(self, ints):
+        """ Return id of peak with given intensities (-1 if unknown)
+        """
+        return self._ids.get(tuple(ints), -1)
+
+    def lookup_mz(self, ints):
+        """ Return MZ value of peak with given intensities (None if unknown)
+        """
+        idx = self.peak_id(ints)
+        return None if idx < 0 else self.mz[idx]
+
+def match_masses(masses, fname=PEAK_FILE):
     """ Match masses with entries from peak file
     """
-    def match(mass, thres=1e-2):
+    def match(mass, thres=MZ_TOLERANCE):
         ms = []
         for km, ints in peak_data.items():
             if abs(km - mass) < thres:
@@ -533,8 +542,9 @@ def plot_result(motifs, data, fname_app='', sub_num=10):
     plt.tight_layout()
     plotter.save_figure('images/rl_corr_hist{}.pdf'.format(fname_app), bbox_inches='tight')
 
-def plot_network(motifs, data):
-    """ Plot motif-network and show #intensity distribution
+def plot_network(motifs, data, table=None):
+    """ Plot motif-network and show #intensity distribution.
+        Compound ids are rendered via `table` if given
     """
     # generate graph
     motif_mem_counter = collections.defaultdict(int)
@@ -551,7 +561,8 @@ def plot_network(motifs, data):
     overview = sorted(motif_mem_counter.keys(), key=lambda x: motif_mem_counter[x], reverse=True)
     legend_labels = ['Compound in motif occurence counter']
     for c in overview[:10]:
-        cur = ' > {} {}'.format(c, motif_mem_counter[c])
+        cur = ' > {} {}'.format(
+            c if table is None else table.name(c), motif_mem_counter[c])
         legend_labels.append(cur)
 
     # assignment counts
@@ -574,7 +585,48 @@ def plot_network(motifs, data):
 
     plt.savefig('images/motif_network.pdf')
 
-def find_optimal_assignments(motifs, data, reps=1000, null_model=True, fname='motifs'):
+def correlation_pool_null_model(
+    int_vecs, n=3, m=5, num=100,
+    rng=np.random, chunk_size=10**5
+):
+    """ Draw `num` times two disjoint index sets of size `n` and `m` from the
+        pool of intensity vectors and return the correlation with largest
+        absolute value between both sets.
+        Correlations are computed once for all distinct vectors
+        (undefined ones count as 0)
+    """
+    pool = np.asarray(int_vecs, dtype=float)
+    if pool.shape[0] < n + m:
+        raise RuntimeError('Intensity vector pool too small')
+
+    uniq, inverse = np.unique(pool, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.nan_to_num(np.atleast_2d(np.corrcoef(uniq)))
+
+    res = np.empty(num)
+    for start in range(0, num, chunk_size):
+        size = min(chunk_size, num - start)
+        idx_1 = rng.randint(pool.shape[0], size=(size, n))
+        idx_2 = rng.randint(pool.shape[0], size=(size, m))
+
+        # redraw second sets which overlap with first ones
+        overlap = (idx_1[:, :, None] == idx_2[:, None, :]).any(axis=(1, 2))
+        while overlap.any():
+            idx_2[overlap] = rng.randint(pool.shape[0], size=(overlap.sum(), m))
+            overlap = (idx_1[:, :, None] == idx_2[:, None, :]).any(axis=(1, 2))
+
+        vals = corr[
+            inverse[idx_1][:, :, None], inverse[idx_2][:, None, :]
+        ].reshape(size, -1)
+        res[start:start+size] = vals[np.arange(size), np.abs(vals).argmax(axis=1)]
+
+    return res
+
+def find_optimal_assignments(
+    motifs, data, reps=1000,
+    null_model=True, null_samples=10**6, fname='motifs'
+):
     """ Find optimal compound assignments by (weighted) randomly selecting
         motifs of low initial assignment number and choose assignments
         which maximize intensity correlation coefficients.
@@ -830,37 +882,13 @@ def find_optimal_assignments(motifs, data, reps=1000, null_model=True, fname='mo
         iax.plot(np.exp(prob_fac*np.arange(50)))
         iax.tick_params(axis='both', which='major', labelsize=5)
 
-    def get_prediction_null_model(motifs, n=3, m=5, num=100):
+    def get_prediction_null_model(motifs, num):
         """ Draw random intensity vectors and select largest absolute correlation
         """
-        # get all intensity vectors
-        int_vecs = []
-        for cs in motifs:
-            for c in cs:
-                if c is None: continue
-                int_vecs.extend(data[c]['intensities'])
-
-        # compute correlations
-        corrs = []
-        for _ in trange(num):
-            idx_1 = np.random.randint(len(int_vecs), size=n)
-            idx_2 = np.random.randint(len(int_vecs), size=m)
-            while len(set(idx_1).intersection(idx_2)) > 0:
-                idx_2 = np.random.randint(len(int_vecs), size=m)
-
-            int_list_1 = [int_vecs[i] for i in idx_1]
-            int_list_2 = [int_vecs[i] for i in idx_2]
-
-            tmp = []
-            for int1 in int_list_1:
-                for int2 in int_list_2:
-                    cc, _ = scis.pearsonr(int1, int2)
-                    tmp.append(cc)
-
-            c = max(tmp, key=abs)
-            corrs.append(c)
-
-        return corrs
+        int_vecs = [ints
+            for cs in motifs for c in cs if c is not None
+                for ints in data[c]['intensities']]
+        return correlation_pool_null_model(int_vecs, num=num)
 
     # plots
     prob_fac = .1
@@ -884,8 +912,8 @@ def find_optimal_assignments(motifs, data, reps=1000, null_model=True, fname='mo
         label='original correlations')
     if null_model:
         sns.distplot(
-            get_prediction_null_model(motifs, num=len(ass_corrs)), ax=axes[0],
-            label='null model')
+            get_prediction_null_model(motifs, null_samples), ax=axes[0],
+            kde=False, norm_hist=True, label='null model')
 
     axes[0].legend(loc='best')
     axes[0].set_xlim((-1,1))
@@ -903,11 +931,11 @@ def find_optimal_assignments(motifs, data, reps=1000, null_model=True, fname='mo
     # return assignment results
     return all_assignments, all_extra
 
-def process(compound_data, filter_mz=False):
+def process(compound_data, filter_mz=False, table=None):
     """ Simple reaction-combinatorics advancer
     """
-    reaction_data = read_reactions_file('data/Reaction_List.csv')
-    tmp = iterate_once(compound_data, reaction_data)
+    reaction_data = read_reactions_file(REACTION_FILE)
+    tmp = iterate_once(compound_data, reaction_data, table)
     ints = match_masses(tmp)
     out = {k: tmp[k] for k in ints.keys()}
     for k in out: out[k]['intensities'] = ints[k]
@@ -926,50 +954,51 @@ def process(compound_data, filter_mz=False):
 
     return out
 
-def detect_motifs(graph, motif):
-    """ Detect 3-grams in graph isomorphic to motif
+def detect_motifs(graph, motif, processes=None):
+    """ Detect induced subgraphs in graph isomorphic to motif
     """
-    nodes = graph.nodes()
-    trips = itertools.product(nodes, nodes, nodes)
-
-    res = []
-    for t in tqdm(trips, total=len(nodes)**3):
-        if len(set(t)) != 3:
-            continue
+    adj, nodes = motif_search.graph_to_csr(graph, exclude=())
+    size = len(motif)
 
-        sub = graph.subgraph(t)
-        if nx.is_isomorphic(sub, motif):
-            res.append(sub.edges())
+    census = motif_search.motif_census(
+        adj, sizes=(size,), collect=True, processes=processes)
+    occurrences = census.members[size].get(motif_search.motif_code(motif), [])
 
-    return res
+    return [list(graph.subgraph([nodes[i] for i in occ]).edges())
+        for occ in occurrences]
 
-def detect_ffl(graph):
+def detect_ffl(graph, chunk_size=1000, processes=None):
     """ Detect feedforward loops in graph
         c1 ---> c2
          |       |
          |       v
          -----> c3
+        `graph` is either a networkx graph or a `motif_search.SparseGraph`
     """
-    edges = set(graph.edges())
-    for c1 in tqdm(graph.nodes()):
-        for c2, c3 in itertools.product(
-            graph.successors(c1), graph.successors(c1)
-        ):
-            if len(set([c1,c2,c3])) != 3:
-                continue
-            if None in (c1, c2, c3):
-                continue
-
-            if (c2,c1) in edges or (c3,c1) in edges:
-                continue
-            if graph.has_edge(c3, c2):
-                continue
+    if isinstance(graph, motif_search.SparseGraph):
+        adj, nodes = graph.adjacency, graph.labels
+    else:
+        adj, nodes = motif_search.graph_to_csr(graph)
+    for chunk in motif_search.find_ffl(adj, chunk_size, processes):
+        for c1, c2, c3 in chunk:
+            yield (nodes[c1], nodes[c2], nodes[c3])
 
-            if graph.has_edge(c2, c3):
-                yield (c1, c2, c3)
+def expansion_key(name, compounds, **params):
+    """ Cache key of reaction expansion depending on all of its inputs
+    """
+    return result_cache.make_key(
+        name, files=[REACTION_FILE, PEAK_FILE],
+        compounds=compounds, tolerance=MZ_TOLERANCE, **params)
 
-def find_more_motifs(motifs, all_compounds, reaction_data, fname='results/post_motif_reactions.pkl'):
-    """ Grow fragmented motif network by applying reaction rules to existing ones
+def find_more_motifs(
+    motifs, all_compounds, reaction_data,
+    cache=None, index=None
+):
+    """ Grow fragmented motif network by applying reaction rules to existing ones.
+        Returns merged motif list and `index` (a `motif_search.FFLIndex` of the
+        motif network). It is updated in place, passing it to the next round
+        only searches triangles which contain new links and only builds
+        data of new motifs
 
         Struture of a motif m:
             (c1, c2, c3, ints, data)
@@ -987,14 +1016,11 @@ def find_more_motifs(motifs, all_compounds, reaction_data, fname='results/post_m
     all_cints.update(all_comp_ints)
 
     # iterate reactions once
-    if not os.path.isfile(fname):
-        comps = process(all_cdata)
-        with open(fname, 'wb') as fd:
-            pickle.dump(comps, fd)
-    else:
-        print('Using cached data ({})'.format(fname))
-        with open(fname, 'rb') as fd:
-            comps = pickle.load(fd)
+    if cache is None:
+        cache = result_cache.ResultCache()
+    comps = cache.fetch(
+        expansion_key('post_motif_reactions', all_cdata),
+        process, all_cdata)
 
     # transform result into more usable form
     tmp = collections.defaultdict(list)
@@ -1004,24 +1030,37 @@ def find_more_motifs(motifs, all_compounds, reaction_data, fname='results/post_m
         tmp[c2].append(p)
 
     # grow motif network
+    new_motifs, removed = [], set()
+    if index is None:
+        index = motif_search.FFLIndex()
+        known = {tuple(m[:3]) for m in motifs}
+        new_motifs.extend(
+            cs for cs in index.add_edges(
+                edge for m in motifs
+                    for edge in [(m[0], m[1]), (m[0], m[2]), (m[1], m[2])])
+            if cs not in known)
+
+        # known motifs may already be destroyed by reciprocal links among them
+        removed.update(cs for cs in known if cs not in index)
+
     new_links = []
-    old_links = []
     for m in tqdm(motifs):
         for c in m[:3]:
             if c in tmp:
                 for t in tmp[c]:
                     new_links.append((c, t))
-        old_links.extend([
-            (m[0], m[1]), (m[0], m[2]), (m[1], m[2])
-        ])
 
-    # find motifs in graph
-    graph = nx.DiGraph()
-    graph.add_edges_from(old_links)
-    graph.add_edges_from(new_links)
+    # only triangles containing new links need to be checked
+    new_motifs.extend(index.add_edges(new_links))
+
+    # keep existing motifs unless a reciprocal link destroyed them
+    removed.update(index.removed)
+    more_motifs = [m for m in motifs if tuple(m[:3]) not in removed]
+
+    for c1,c2,c3 in new_motifs:
+        if (c1,c2,c3) in removed:
+            continue
 
-    more_motifs = []
-    for c1,c2,c3 in detect_ffl(graph):
         res = {'data': {}, 'ints': {}}
         for c in (c1,c2,c3):
             assert c in all_cdata or c in comps
@@ -1050,9 +1089,9 @@ def find_more_motifs(motifs, all_compounds, reaction_data, fname='results/post_m
         except AssertionError:
             import ipdb; ipdb.set_trace()
 
-    return more_motifs
+    return more_motifs, index
 
-def plot_mz_distribution(motifs, data, fname='data/peaklist_filtered_assigned.csv'):
+def plot_mz_distribution(motifs, data, fname=PEAK_FILE):
     """ Plot MZ values of data and highlight real-life entries
     """
     # create set of motifs
@@ -1099,69 +1138,30 @@ def plot_intensity_number_distribution(comps):
     plt.xlabel('number of intensity assignments per compound')
     plt.savefig('images/intpcomp_distr.pdf')
 
-def get_origin_set(comp, data):
-    """ Find basic origins which comp is made out of
-    """
-    if comp is None:
-        return set()
-
-    if data[comp]['origin'] == (None, None):
-        return {comp}
-
-    return get_origin_set(data[comp]['origin'][0], data) | get_origin_set(data[comp]['origin'][1], data)
-
 def compare_assignment_result(ass_data, data):
     """ Check robustness of comparison by counting how many assignments vary over multiple runs
     """
     fig, axes = plt.subplots(1, len(ass_data), figsize=(20,5))
 
     for (all_ass, lbl), ax in zip(ass_data, axes):
-        # aggregate assignments over various runs
-        tmp = {'run': [], 'intensity_vec': [], 'compound': []}
-        for i, assignments in enumerate(all_ass):
-            # make intensity vectors hashable
-            ass = {k: tuple(v) for k,v in assignments.items()}
-
-            for comp, ints in ass.items():
-                tmp['run'].append(i)
-                tmp['intensity_vec'].append(ints)
-                tmp['compound'].append(comp)
-        df = pd.DataFrame(tmp)
+        ens = AssignmentEnsemble.from_dicts(all_ass)
+        trivial = ens.candidate_counts(data) == 1
 
         # pre-filter (only consider compounds which got always mapped)
-        tmp = []
-        for name, group in list(df.groupby('run')):
-            cs = group['compound'].tolist()
-            tmp += cs
-        counts = pd.Series(tmp).value_counts()
-        needed_comps = counts[counts==(df['run'].max()+1)].index
-        df = df[df['compound'].isin(needed_comps)]
+        needed = ens.always_assigned()
 
         # check robustness
-        int_res = []
-        for name, group in df.groupby('intensity_vec'):
-            comp_vec = group['compound'].unique()
-
-            # filter entries which have only one assignment anyways
-            assert len(comp_vec) >= 1
-            if len(comp_vec) == 1:
-                if len(data[list(comp_vec)[0]]['intensities']) == 1:
-                    assert tuple(data[list(comp_vec)[0]]['intensities'][0]) == name
-                    continue
-            int_res.append(len(comp_vec)==1)
-        int_val = sum(int_res) / len(int_res) if len(int_res) > 0 else 0
+        vec_comps = ens.compounds_per_vector(needed)
+        used_vecs = np.nonzero(vec_comps > 0)[0]
 
-        comp_res = []
-        for name, group in df.groupby('compound'):
-            int_vec = group['intensity_vec'].unique()
+        # filter entries which have only one assignment anyways
+        sole_comp = ens.sole_compound(needed)
+        int_mask = ~((vec_comps == 1) & (sole_comp >= 0) & trivial[np.maximum(sole_comp, 0)])
+        int_res = vec_comps[used_vecs][int_mask[used_vecs]] == 1
+        int_val = int_res.mean() if int_res.size > 0 else 0
 
-            # filter entries which have only one assignment anyways
-            assert len(int_vec) >= 1
-            if len(data[name]['intensities']) == 1:
-                assert tuple(data[name]['intensities'][0]) == int_vec[0]
-                continue
-            comp_res.append(len(int_vec)==1)
-        comp_val = sum(comp_res) / len(comp_res) if len(comp_res) > 0 else 0
+        comp_res = ens.vectors_per_compound()[needed & ~trivial] == 1
+        comp_val = comp_res.mean() if comp_res.size > 0 else 0
 
         # plot
         ax.bar(
@@ -1176,67 +1176,59 @@ def compare_assignment_result(ass_data, data):
         ax.set_ylim((0, 1))
 
         title = f'''{lbl}
-{round(int_val, 2)} ({sum(int_res)}/{len(int_res)}/{len(df.intensity_vec.unique())})
-{round(comp_val, 2)} ({sum(comp_res)}/{len(comp_res)}/{len(df["compound"].unique())})'''
+{round(int_val, 2)} ({int_res.sum()}/{int_res.size}/{used_vecs.size})
+{round(comp_val, 2)} ({comp_res.sum()}/{comp_res.size}/{needed.sum()})'''
         ax.set_title(title)
         print(title)
 
     plt.tight_layout()
     plt.savefig('images/assignment_comparison.pdf')
 
-def compare_to_realdata(ass_data, input_data):
-    """ Check assignments via comparison to real-life data
+def compare_to_realdata(ass_data, input_data, table=None):
+    """ Check assignments via comparison to real-life data.
+        Compound ids are rendered via `table` if given
     """
-    def find_true_mz(ints, pdata):
-        for p,i in pdata.items():
-            if i == ints:
-                return p
-        return None
-
-    def convert_assignments(ass, pdata):
-        tmp = {'name': [], 'formula': [], 'mz': []}
-        for c,data in ass.items():
-            assert len(data['intensities']) == 1
-            tmz = find_true_mz(data['intensities'][0], pdata)
-
-            tmp['name'].append(c)
-            tmp['formula'].append(gen_atom_string(data['atoms']))
-            tmp['mz'].append(tmz)
+    comp_df = formula_investigator.get_rl_comparison_frame()
+    peaks = PeakIndex(read_peak_data(PEAK_FILE))
 
-        return pd.DataFrame(tmp)
+    # cases which initially only have one assignment possibility are trivial
+    trivial = {c for c, d in input_data.items() if len(d['intensities']) == 1}
+    names, formulas = {}, {}
 
-    def remove_trivial_assignments(ass, pdata):
-        """ Remove cases which initially only have one assignment possibility
+    def convert_assignments(all_ass):
+        """ Combine all runs of a strategy into a single frame
         """
-        tmp = dict(ass)
-        current_compounds = list(ass.keys())
-        for comp in current_compounds:
-            cur = input_data[comp]
+        tmp = {'run': [], 'name': [], 'formula': [], 'mz': []}
+        for run, ass in enumerate(all_ass):
+            for c, data in ass.items():
+                if c in trivial:
+                    continue
 
-            assert len(cur['intensities']) > 0
-            if len(cur['intensities']) == 1:
-                tmp.pop(comp)
+                assert len(data['intensities']) == 1
+                if c not in formulas:
+                    names[c] = c if table is None else table.name(c)
+                    formulas[c] = gen_atom_string(data['atoms'])
 
-        #print(f'Trivial assignment removal: {len(ass)}->{len(tmp)}')
-        return tmp
+                tmp['run'].append(run)
+                tmp['name'].append(names[c])
+                tmp['formula'].append(formulas[c])
+                tmp['mz'].append(peaks.lookup_mz(data['intensities'][0]))
 
-    comp_df = formula_investigator.get_rl_comparison_frame()
-    pdata = read_peak_data('data/peaklist_filtered_assigned.csv')
+        return pd.DataFrame(tmp)
 
     plt.figure(figsize=(6, 4*len(ass_data)))
     ax = None
     for i, (all_ass, all_info, lbl) in enumerate(tqdm(ass_data)):
-        cur_dists = []
-        for assignments, info in tqdm(zip(all_ass, all_info), total=len(all_ass)):
-            ass_tmp = remove_trivial_assignments(assignments, pdata)
-            new_ass = convert_assignments(ass_tmp, pdata)
-            match = new_ass.merge(comp_df, left_on='name', right_on='cname')
-            cur_dists.extend(match['dist'].tolist())
-        cur_dists = np.asarray(cur_dists)
+        new_ass = convert_assignments(all_ass)
+        match = new_ass.merge(comp_df, left_on='name', right_on='cname')
+        cur_dists = match['dist'].values
 
         # compute quality
-        qual_vals = [(x, (cur_dists<=x).sum()/cur_dists.size)
-                     for x in [0, .1, .3, 5]]
+        sorted_dists = np.sort(cur_dists)
+        thresholds = np.array([0, .1, .3, 5])
+        qual_vals = list(zip(
+            thresholds,
+            np.searchsorted(sorted_dists, thresholds, side='right') / cur_dists.size))
 
         # plot distance distribution
         ax = plt.subplot(len(ass_data), 1, i+1, sharex=ax, sharey=ax)
@@ -1256,54 +1248,33 @@ def investigate_prediction_chaos(ass_data, data):
         * Count how often each node pair is assigned to particular intensity-vector pair
     """
     print('Chaos plots')
-    fig, axes = plt.subplots(len(ass_data), 3)
+    fig, axes = plt.subplots(len(ass_data), 4)
 
     for (all_ass, all_info, lbl), ax_row in zip(ass_data, axes):
         # aggregate assignments over various runs
-        df = pd.DataFrame()
         assert len(all_ass) == len(all_info)
-        tmp = {lbl: [] for lbl in ['run', 'intensity_vec', 'compound', 'compound_assignment_idx']}
-
-        for i, (assignments, info) in enumerate(zip(all_ass, all_info)):
-            for comp, ints in assignments.items():
-                assert comp in info['assignment_order']
-                tmp['run'].append(i)
-                tmp['intensity_vec'].append(tuple(ints))
-                tmp['compound'].append(comp)
-                tmp['compound_assignment_idx'].append(info['assignment_order'].index(comp))
-        df = pd.DataFrame(tmp)
-
-        # precompute some statistic
-        comp_frac = {}
-        for name, group in df.groupby('compound'):
-            int_vec = group['intensity_vec'].unique()
-
-            # filter entries which have only one assignment anyways
-            assert len(int_vec) >= 1
-            if len(data[name]['intensities']) == 1:
-                assert tuple(data[name]['intensities'][0]) == int_vec[0]
-                comp_frac[name] = -1
-                continue
-
-            assert not name in comp_frac
-            comp_frac[name] = len(int_vec)
+        ens = AssignmentEnsemble.from_dicts(all_ass, all_info)
+
+        # precompute some statistic (for compounds which got assigned at all)
+        sel = (ens.assigned >= 0).any(axis=0)
+        intvec_len = ens.vectors_per_compound()[sel]
+        comp_frac = np.where(ens.candidate_counts(data)[sel] == 1, -1, intvec_len)
+        mean_idx, std_idx = (v[sel] for v in ens.position_stats())
+        consensus = ens.consensus_rate()[sel]
 
         # make scatter plots
-        for compound, group in tqdm(df.groupby('compound')):
-            int_val = comp_frac[compound]
-            mean_idx = group['compound_assignment_idx'].mean()
-            std_idx = group['compound_assignment_idx'].std()
-            avg_intvec_len = len(group['intensity_vec'].unique())
-
-            ax_row[0].scatter(
-                int_val, mean_idx,
-                alpha=.3, rasterized=True)
-            ax_row[1].scatter(
-                mean_idx, std_idx,
-                alpha=.3, rasterized=True)
-            ax_row[2].scatter(
-                mean_idx, avg_intvec_len,
-                alpha=.3, rasterized=True)
+        ax_row[0].scatter(
+            comp_frac, mean_idx,
+            alpha=.3, rasterized=True)
+        ax_row[1].scatter(
+            mean_idx, std_idx,
+            alpha=.3, rasterized=True)
+        ax_row[2].scatter(
+            mean_idx, intvec_len,
+            alpha=.3, rasterized=True)
+        ax_row[3].scatter(
+            mean_idx, consensus,
+            alpha=.3, rasterized=True)
 
         ax_row[0].set_title(lbl)
         ax_row[0].set_xlabel('int_val')
@@ -1317,181 +1288,351 @@ def investigate_prediction_chaos(ass_data, data):
         ax_row[2].set_xlabel('mean_idx')
         ax_row[2].set_ylabel('avg_intvec_len')
 
+        ax_row[3].set_title(lbl)
+        ax_row[3].set_xlabel('mean_idx')
+        ax_row[3].set_ylabel('consensus_rate')
+
     plt.tight_layout()
     zoom = 1.5
     w, h = fig.get_size_inches()
     fig.set_size_inches(w * zoom, h * zoom)
     plt.savefig('images/assignment_chaos.pdf')
 
-def null_model_assignments(data, num, reps=100):
-    """ Choose random assignment per compound
+class AssignmentEnsemble(object):
+    """ Assignments of multiple runs stored as `(runs, compounds)` matrix of
+        intensity vector ids (-1 if unassigned) and matrix of positions in
+        the respective assignment order (-1 if not ordered)
     """
-    def nm_assign(num, compounds):
-        np.random.shuffle(compounds)
-        assignments = {}
-        for node_sel in compounds:
-            # select random assignment
-            cur_ints = data[node_sel]['intensities'][:]
-            for i in assignments.values():
-                if i in cur_ints:
-                    cur_ints.remove(i)
-
-            if len(cur_ints) == 0:
-                continue
-            int_sel = random.choice(cur_ints)
-
-            # finalize
-            assignments[node_sel] = {
-                'intensities': [int_sel],
-                'atoms': data[node_sel]['atoms']
-            }
-        return assignments, {'assignment_order': compounds[:]}
+    def __init__(self, compounds, vectors, assigned, positions):
+        self.compounds = list(compounds)
+        self.vectors = list(vectors)
+        self.assigned = np.asarray(assigned, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.int64)
+
+    @classmethod
+    def from_dicts(cls, all_ass, all_info=None):
+        """ Convert assignment dicts (and their info) as returned by
+            `find_optimal_assignments`
+        """
+        compounds, comp_ids = [], {}
+        vectors, vec_ids = [], {}
+
+        def get_id(key, items, ids, value):
+            if key not in ids:
+                ids[key] = len(items)
+                items.append(value)
+            return ids[key]
+
+        entries = []
+        for run, ass in enumerate(all_ass):
+            for c, d in ass.items():
+                assert len(d['intensities']) == 1
+                ints = d['intensities'][0]
+                entries.append((
+                    run, get_id(c, compounds, comp_ids, c),
+                    get_id(tuple(ints), vectors, vec_ids, ints)))
+
+        if all_info is not None:
+            for info in all_info:
+                for c in info['assignment_order']:
+                    get_id(c, compounds, comp_ids, c)
+
+        shape = (len(all_ass), len(compounds))
+        assigned = np.full(shape, -1, dtype=np.int64)
+        if len(entries) > 0:
+            runs, comps, vecs = np.array(entries).T
+            assigned[runs, comps] = vecs
+
+        positions = np.full(shape, -1, dtype=np.int64)
+        if all_info is not None:
+            for run, info in enumerate(all_info):
+                order = [comp_ids[c] for c in info['assignment_order']]
+                positions[run, order] = np.arange(len(order))
+
+        return cls(compounds, vectors, assigned, positions)
+
+    @classmethod
+    def from_matrix(cls, compounds, vectors, assigned, order):
+        """ Create from `(runs, compounds)` matrix of compound orders
+            as returned by `generate_null_assignments`
+        """
+        return cls(compounds, vectors, assigned, np.argsort(order, axis=1))
+
+    def to_dicts(self, data):
+        """ Convert back into assignment dicts and info
+        """
+        all_ass, all_info = [], []
+        for cur_ass, cur_pos in zip(self.assigned, self.positions):
+            ordered = np.nonzero(cur_pos >= 0)[0]
+            ordered = ordered[np.argsort(cur_pos[ordered])]
+
+            all_ass.append({
+                self.compounds[c]: {
+                    'intensities': [self.vectors[cur_ass[c]]],
+                    'atoms': data[self.compounds[c]]['atoms']
+                } for c in ordered if cur_ass[c] >= 0})
+            all_info.append({
+                'assignment_order': [self.compounds[c] for c in ordered]})
+        return all_ass, all_info
+
+    @property
+    def runs(self):
+        return self.assigned.shape[0]
+
+    def candidate_counts(self, data):
+        """ Number of possible intensity vectors per compound
+        """
+        return np.array(
+            [len(data[c]['intensities']) for c in self.compounds], dtype=np.int64)
+
+    def always_assigned(self):
+        """ Mask of compounds which got assigned in every run
+        """
+        return (self.assigned >= 0).all(axis=0)
+
+    def vectors_per_compound(self):
+        """ Number of distinct intensity vectors assigned to each compound
+        """
+        srt = np.sort(self.assigned, axis=0)
+        new = np.ones_like(srt, dtype=bool)
+        new[1:] = srt[1:] != srt[:-1]
+        return ((srt >= 0) & new).sum(axis=0)
+
+    def _vector_compound_pairs(self, comp_mask=None):
+        runs, comps = np.nonzero(self.assigned >= 0)
+        if comp_mask is not None:
+            sel = comp_mask[comps]
+            runs, comps = runs[sel], comps[sel]
+
+        keys = np.unique(
+            self.assigned[runs, comps] * len(self.compounds) + comps)
+        return keys // len(self.compounds), keys % len(self.compounds)
+
+    def compounds_per_vector(self, comp_mask=None):
+        """ Number of distinct compounds each intensity vector got assigned to
+        """
+        vecs, _ = self._vector_compound_pairs(comp_mask)
+        return np.bincount(vecs, minlength=len(self.vectors))
+
+    def sole_compound(self, comp_mask=None):
+        """ Compound of vectors which are assigned to exactly one compound (else -1)
+        """
+        vecs, comps = self._vector_compound_pairs(comp_mask)
+        res = np.full(len(self.vectors), -1, dtype=np.int64)
+        single = np.bincount(vecs, minlength=len(self.vectors))[vecs] == 1
+        res[vecs[single]] = comps[single]
+        return res
+
+    def consensus_rate(self):
+        """ Fraction of runs agreeing with the most common assignment of each compound
+        """
+        runs, comps = np.nonzero(self.assigned >= 0)
+        keys, counts = np.unique(
+            comps * len(self.vectors) + self.assigned[runs, comps],
+            return_counts=True)
+
+        rate = np.zeros(len(self.compounds))
+        np.maximum.at(rate, keys // len(self.vectors), counts / self.runs)
+        return rate
+
+    def position_stats(self):
+        """ Mean and (sample) standard deviation of assignment positions per compound
+        """
+        valid = (self.positions >= 0) & (self.assigned >= 0)
+        pos = np.where(valid, self.positions, 0).astype(float)
+
+        num = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = pos.sum(axis=0) / num
+            sq = np.where(valid, (pos - mean)**2, 0).sum(axis=0)
+            std = np.sqrt(sq / (num - 1))
+        std[num < 2] = np.nan
+        return mean, std
+
+def candidate_matrix(data, compounds):
+    """ Encode intensity candidates of compounds as `(N, K)` matrix of
+        intensity vector ids (padded with -1). Returns matrix and vectors
+    """
+    vectors, ids = [], {}
+    rows = []
+    for c in compounds:
+        cur = []
+        for ints in data[c]['intensities']:
+            key = tuple(ints)
+            if key not in ids:
+                ids[key] = len(vectors)
+                vectors.append(ints)
+            cur.append(ids[key])
+        rows.append(cur)
+
+    cand = np.full((len(rows), max([len(r) for r in rows] + [1])), -1, dtype=np.int64)
+    for i, r in enumerate(rows):
+        cand[i, :len(r)] = r
+    return cand, vectors
+
+def generate_null_assignments(cand, num_vectors, reps, rng=np.random):
+    """ Assign random intensity vectors to compounds in random order,
+        each vector may only be used once per run.
+        Returns `(reps, N)` matrix of vector ids per compound (-1 if no
+        candidate was left) and `(reps, N)` matrix of compound orders
+    """
+    num = cand.shape[0]
+    order = np.argsort(rng.uniform(size=(reps, num)), axis=1)
+
+    assigned = np.full((reps, num), -1, dtype=np.int64)
+    taken = np.zeros((reps, num_vectors + 1), dtype=bool) # last column is padding
+    rows = np.arange(reps)
+
+    for pos in range(num):
+        comp = order[:, pos]
+        cur = cand[comp] # (reps, K)
 
+        # choose uniformly among free candidates via random keys
+        valid = (cur >= 0) & ~taken[rows[:, None], cur]
+        keys = np.where(valid, rng.uniform(size=cur.shape), np.inf)
+        choice = np.argmin(keys, axis=1)
+
+        sel = cur[rows, choice]
+        sel[~valid.any(axis=1)] = -1
+
+        assigned[rows, comp] = sel
+        taken[rows, sel] = True
+        taken[:, -1] = False
+
+    return assigned, order
+
+def null_model_assignments(data, num, reps=100, rng=np.random):
+    """ Choose random assignment per compound
+    """
     # choose random compounds
-    compounds = []
     all_compounds = list(data.keys())
-    for _ in range(num):
-        node_sel = random.choice(all_compounds)
-        while node_sel in compounds:
-            node_sel = random.choice(all_compounds)
-        compounds.append(node_sel)
-    assert len(set(compounds)) == len(compounds) # unique compounds
+    compounds = [all_compounds[i]
+        for i in rng.choice(len(all_compounds), size=num, replace=False)]
+
+    cand, vectors = candidate_matrix(data, compounds)
+    assigned, order = generate_null_assignments(cand, len(vectors), reps, rng)
+
+    return AssignmentEnsemble.from_matrix(
+        compounds, vectors, assigned, order).to_dicts(data)
 
-    return zip(*[nm_assign(num, compounds) for _ in trange(reps)])
+def expand_compounds(compounds_level0, iterations=2):
+    """ Let compounds react `iterations` times.
+        Returns compound data keyed by id and the `compound_table.ProvenanceTable`
+        which defines these ids
+    """
+    table = compound_table.ProvenanceTable()
+    comps = {
+        table.add_compound(name): data
+            for name, data in compounds_level0.items()}
+
+    for i in range(iterations):
+        tmp = process(comps, table=table)
+        tqdm.write('Found {} new compounds [#{}]'.format(
+            len(tmp), i))
+        comps.update(tmp)
+
+    return comps, table
+
+def read_file_key(fname):
+    """ Return cache key `fname` was written for (None if unknown)
+    """
+    if not os.path.isfile(fname) or not os.path.isfile(fname + '.key'):
+        return None
+    with open(fname + '.key') as fd:
+        return fd.read()
 
 def find_small_motifs(
     compounds_level0,
-    fname='cache/rf_raw_reaction_data.pkl'
+    fname='cache/rf_raw_reaction_data.pkl',
+    cache=None
 ):
-    """ Look for feedfoward-loops in (iterated) compound data
+    """ Look for feedfoward-loops in (iterated) compound data.
+        Compounds are handled by their ids in the expansion's provenance table.
+        Results are cached by content of their inputs, `fname` receives
+        a name-keyed copy of the expanded compounds for `formula_investigator`
     """
-    # let compounds react
-    if not os.path.isfile(fname):
-        comps = {}
-        comps.update(compounds_level0)
+    if cache is None:
+        cache = result_cache.ResultCache()
 
-        for i in range(2):
-            tmp = process(comps)
-            tqdm.write('Found {} new compounds [#{}]'.format(
-                len(tmp), i))
-            comps.update(tmp)
+    # let compounds react
+    comps_key = expansion_key(
+        'rf_raw_reaction_data', compounds_level0, iterations=2, keys='ids')
+    comps, table = cache.fetch(comps_key, expand_compounds, compounds_level0)
 
+    # rendering names is expensive, only redo it if `fname` is outdated
+    if fname is not None and read_file_key(fname) != comps_key:
         with open(fname, 'wb') as fd:
-            pickle.dump(comps, fd)
-    else:
-        print('Using cached data ({})'.format(fname))
-        with open(fname, 'rb') as fd:
-            comps = pickle.load(fd)
+            pickle.dump(table.to_names(comps), fd)
+        with open(fname + '.key', 'w') as fd:
+            fd.write(comps_key)
 
     print('Proceeding with {} compounds'.format(len(comps)))
 
     # grow network
-    graph = nx.DiGraph()
-    for p, data in tqdm(comps.items()):
-        c1, c2 = data['origin'][0], data['origin'][1]
-        if None in (c1,c2,p): continue
-        graph.add_edge(c1, p)
-        graph.add_edge(c2, p)
+    def reaction_edges():
+        for p, data in comps.items():
+            c1, c2 = data['origin'][0], data['origin'][1]
+            if None in (c1,c2,p): continue
+            yield c1, p
+            yield c2, p
+    graph = motif_search.SparseGraph.from_edges(reaction_edges())
 
     # find motifs
     # Note: maybe weight them according to occurences of same compound configuration with different reactions
-    motifs = []
-    for cs in detect_ffl(graph):
-        if None in cs: continue
-        if cs in motifs: continue
-        motifs.append(cs)
+    motifs = list(dict.fromkeys(
+        cs for cs in detect_ffl(graph) if None not in cs))
 
     print('Found {} motifs'.format(len(motifs)))
 
     # conduct predictions
     print('Predicting')
     other_size = len(motifs)*3
-    sub_graph = nx.subgraph(graph, [c for cs in motifs for c in cs])
+    sub_graph = graph.subgraph([graph.index(c) for cs in motifs for c in cs])
 
-    print('Original graph', nx.info(graph))
-    print('Motif sub-graph', nx.info(sub_graph))
+    print('Original graph', graph.info())
+    print('Motif sub-graph', sub_graph.info())
+
+    def predict(strategy, func):
+        """ Cache assignment predictions of given strategy
+        """
+        key = result_cache.make_key(
+            'prediction_{}'.format(strategy), compounds=comps_key)
+        tmp = cache.fetch(key, lambda: dict(zip(('ass', 'info'), func())))
+        return tmp['ass'], tmp['info']
 
     # predictions with motifs
-    motif_fname = 'cache/prediction_motif.dat'
-    if not os.path.exists(motif_fname):
-        motif_ass, motif_info = find_optimal_assignments(motifs, comps)
-
-        with open(motif_fname, 'wb') as fd:
-            pickle.dump({
-                'ass': motif_ass,
-                'info': motif_info
-            }, fd)
-    else:
-        print('Using cached data ({})'.format(motif_fname))
-        with open(motif_fname, 'rb') as fd:
-            tmp = pickle.load(fd)
-            motif_ass = tmp['ass']
-            motif_info = tmp['info']
+    motif_ass, motif_info = predict(
+        'motif', lambda: find_optimal_assignments(motifs, comps))
 
     # predict using links from motif network
-    motiflinks_fname = 'cache/prediction_motiflinks.dat'
-    if not os.path.exists(motiflinks_fname):
+    def predict_motiflinks():
         motiflinks = [edge
             for c1,c2,c3 in motifs
                 for edge in [(c1,c2,None),(c2,c3,None),(c1,c3,None)]]
-        motiflink_ass, motiflink_info = find_optimal_assignments(
+        return find_optimal_assignments(
             motiflinks, comps, fname='motiflinks')
-
-        with open(motiflinks_fname, 'wb') as fd:
-            pickle.dump({
-                'ass': motiflink_ass,
-                'info': motiflink_info
-            }, fd)
-    else:
-        print('Using cached data ({})'.format(motiflinks_fname))
-        with open(motiflinks_fname, 'rb') as fd:
-            tmp = pickle.load(fd)
-            motiflink_ass = tmp['ass']
-            motiflink_info = tmp['info']
+    motiflink_ass, motiflink_info = predict('motiflinks', predict_motiflinks)
 
     # predict using only links
-    links_fname = 'cache/prediction_links.dat'
-    if not os.path.exists(links_fname):
+    def predict_links():
+        edges = sub_graph.labeled_edges()
         edge_idx = np.random.choice(
-            np.arange(len(sub_graph.edges())), size=other_size)
-        links = [(*sub_graph.edges()[edx],None) for edx in edge_idx]
-        link_ass, link_info = find_optimal_assignments(links, comps, fname='links')
-
-        with open(links_fname, 'wb') as fd:
-            pickle.dump({
-                'ass': link_ass,
-                'info': link_info
-            }, fd)
-    else:
-        print('Using cached data ({})'.format(links_fname))
-        with open(links_fname, 'rb') as fd:
-            tmp = pickle.load(fd)
-            link_ass = tmp['ass']
-            link_info = tmp['info']
+            np.arange(len(edges)), size=other_size)
+        links = [(*edges[edx],None) for edx in edge_idx]
+        return find_optimal_assignments(links, comps, fname='links')
+    link_ass, link_info = predict('links', predict_links)
 
     # predict using random nodes
-    random_fname = 'cache/prediction_random.dat'
-    if not os.path.exists(random_fname):
+    def predict_random():
         node_sel = [n
-            for n in sub_graph.nodes()
+            for n in sub_graph.labels
                 if len(comps[n]['intensities']) >= 5]
         rand_nodes = list(set(
             [(*np.random.choice(node_sel, size=2),None)
                 for _ in range(other_size)]
         ))
-        random_ass, random_info = find_optimal_assignments(rand_nodes, comps, fname='random')
-
-        with open(random_fname, 'wb') as fd:
-            pickle.dump({
-                'ass': random_ass,
-                'info': random_info
-            }, fd)
-    else:
-        print('Using cached data ({})'.format(random_fname))
-        with open(random_fname, 'rb') as fd:
-            tmp = pickle.load(fd)
-            random_ass = tmp['ass']
-            random_info = tmp['info']
+        return find_optimal_assignments(rand_nodes, comps, fname='random')
+    random_ass, random_info = predict('random', predict_random)
 
     # use another null-model
     null_ass, null_info = null_model_assignments(comps, other_size*2)
@@ -1503,7 +1644,7 @@ def find_small_motifs(
         (link_ass, link_info, 'links'),
         (random_ass, random_info, 'random'),
         (null_ass, null_info, 'nullmodel')
-    ], comps)
+    ], comps, table)
     investigate_prediction_chaos([
         (motif_ass, motif_info, 'motifs'),
         (motiflink_ass, motiflink_info, 'motiflinks'),
@@ -1521,41 +1662,19 @@ def find_small_motifs(
 
     ## plot stuff
     print('Plotting')
-    plot_network(motifs, comps)
+    plot_network(motifs, comps, table)
     plot_intensity_number_distribution(comps)
     plot_mz_distribution(motifs, comps)
 
-    # random compounds for comparison
-    unrelated_nodes = []
+    # random compounds for comparison, only use MZ values from motifs
+    mzs = [comps[c]['mass'] for trip in motifs for c in trip]
 
-    # only use MZ values from motifs
-    mzs = []
-    for trip in motifs:
-        for c in trip:
-            mzs.append(comps[c]['mass'])
-    max_mz = max(mzs)
-    min_mz = min(mzs)
-
-    nodes = []
-    for n in graph.nodes():
-        if n is None: continue
-        if comps[n]['mass'] > min_mz and comps[n]['mass'] < max_mz:
-            nodes.append(n)
-
-    es = lambda f, s: len(f.intersection(s)) == 0 # check for empty set intersection
-    while len(unrelated_nodes) < len(motifs):
-        # *blargh*
-        first = np.random.choice(nodes)
-        second = np.random.choice(nodes)
-        while not es(get_origin_set(second, comps), get_origin_set(first, comps)):
-            second = np.random.choice(nodes)
-        third = np.random.choice(nodes)
-        while not es(get_origin_set(third, comps), get_origin_set(first, comps)) or not es(get_origin_set(third, comps), get_origin_set(second, comps)):
-            third = np.random.choice(nodes)
-
-        th = (first, second, third)
-        if not th in unrelated_nodes:
-            unrelated_nodes.append(th)
+    nodes = graph.labels
+    unrelated_nodes = compound_table.sample_unrelated(
+        table, len(motifs),
+        candidates=nodes,
+        mass=[comps[n]['mass'] for n in nodes],
+        mass_range=(min(mzs), max(mzs)))
 
     plot_correlation_histogram((
             (motifs, 'FFL'),
@@ -1578,25 +1697,24 @@ def investigate_reactions(
     intensities_all.update(intensities_level0)
     intensities_all.update(intensities_level1)
 
-    # compute all correlations for all compounds
-    rea_corrs = []
+    # accumulate correlations of reactants per reaction
+    bins = np.linspace(-1, 1, 200)
+    hists = collections.OrderedDict()
     for compound in tqdm(intensities_level1.keys()):
-        c1, rea, c2 = parse_compound_name(compound)
-        if c2 == 'None': continue
+        (c1, c2), rea = comp_tmp[compound]['origin'], comp_tmp[compound]['reaction']
+        if c2 is None: continue
 
-        for int1 in intensities_all[c1]:
-            for int2 in intensities_all[c2]:
-                cc, _ = scis.pearsonr(int1, int2)
-                rea_corrs.append({'reaction': rea, 'correlation': cc})
-    df = pd.DataFrame.from_dict(rea_corrs)
+        if rea not in hists:
+            hists[rea] = utils.HistogramAccumulator(bins)
+        hists[rea].add(utils.cross_correlation(
+            intensities_all[c1], intensities_all[c2]))
 
     # plot result
     fig = plt.figure()
-    for rea in df.reaction.unique():
-        corrs = df[df.reaction==rea].correlation
-        sns.distplot(
-            corrs, label=rea,
-            kde=False, bins=np.linspace(-1, 1, 200))
+    for rea, hist in hists.items():
+        plt.hist(
+            hist.centers, bins=hist.edges, weights=hist.counts,
+            alpha=.4, label=rea)
 
     plt.legend(loc='best')
 
@@ -0,0 +1,169 @@
+"""
+Content-addressed cache for expensive intermediate results.
+Entries are keyed by hashes of their input files and parameters
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+
+
+CACHE_DIR = 'cache/store'
+MAX_SIZE = 4 * 1024**3 # bytes
+
+def hash_file(fname, block_size=2**20):
+    """ Compute hash of file content
+    """
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as fd:
+        for block in iter(lambda: fd.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def make_key(name, files=(), **params):
+    """ Create cache key from name, content of given files and parameters
+    """
+    sha = hashlib.sha1()
+    for fname in files:
+        sha.update(hash_file(fname).encode())
+    sha.update(pickle.dumps(sorted(params.items()), protocol=4))
+    return '{}_{}'.format(name, sha.hexdigest()[:20])
+
+class ResultCache(object):
+    """ Store pickled results in `directory` and evict least recently
+        used entries once total size exceeds `max_size`
+    """
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+        self.index_fname = os.path.join(directory, 'index.json')
+        if os.path.isfile(self.index_fname):
+            with open(self.index_fname) as fd:
+                self.index = json.load(fd)
+        else:
+            self.index = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.pkl'.format(key))
+
+    def _save_index(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        tmp_fname = self.index_fname + '.tmp'
+        with open(tmp_fname, 'w') as fd:
+            json.dump(self.index, fd, indent=1)
+        os.replace(tmp_fname, self.index_fname)
+
+    def __contains__(self, key):
+        return key in self.index and os.path.isfile(self._path(key))
+
+    def get(self, key):
+        """ Load entry and mark it as recently used
+        """
+        with open(self._path(key), 'rb') as fd:
+            obj = pickle.load(fd)
+
+        self.index[key]['atime'] = time.time()
+        self._save_index()
+
+        return obj
+
+    def put(self, key, obj):
+        """ Store entry and evict old ones if needed
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fname = self._path(key)
+        with open(fname, 'wb') as fd:
+            pickle.dump(obj, fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+        now = time.time()
+        self.index[key] = {
+            'size': os.path.getsize(fname),
+            'ctime': now,
+            'atime': now
+        }
+        self.evict(keep=key)
+
+    def fetch(self, key, func, *args, **kwargs):
+        """ Return cached entry or compute it via `func(*args, **kwargs)`
+        """
+        if key in self:
+            print('Using cached data ({})'.format(key))
+            return self.get(key)
+
+        res = func(*args, **kwargs)
+        self.put(key, res)
+        return res
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries until cache fits into `max_size`
+        """
+        total = sum(e['size'] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['atime']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+
+            total -= self.index[key]['size']
+            self.remove(key, save=False)
+
+        self._save_index()
+
+    def remove(self, key, save=True):
+        """ Delete single entry
+        """
+        if os.path.isfile(self._path(key)):
+            os.remove(self._path(key))
+        self.index.pop(key, None)
+
+        if save:
+            self._save_index()
+
+    def clear(self, prefix=''):
+        """ Delete all entries whose key starts with `prefix`
+        """
+        for key in [k for k in self.index if k.startswith(prefix)]:
+            self.remove(key, save=False)
+        self._save_index()
+
+    def entries(self):
+        """ List entries, most recently used first
+        """
+        return sorted(
+            self.index.items(), key=lambda e: e[1]['atime'], reverse=True)
+
+
+def main():
+    """ List or clear cache entries
+    """
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('list', 'clear'):
+        print('Usage: %s <list | clear> [key prefix]' % sys.argv[0])
+        sys.exit(1)
+
+    cache = ResultCache()
+    prefix = sys.argv[2] if len(sys.argv) == 3 else ''
+
+    if sys.argv[1] == 'list':
+        total = 0
+        for key, info in cache.entries():
+            if not key.startswith(prefix):
+                continue
+
+            total += info['size']
+            print('{:<50} {:>10.1f} MB  {}'.format(
+                key, info['size'] / 1024**2,
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(info['atime']))))
+        print('Total: {:.1f} MB'.format(total / 1024**2))
+    else:
+        cache.clear(prefix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Chunked on-disk store for robustness simulation results.
+Correlation tensors are kept as packed lower triangles (float32) in one
+append-only value file, indexed by motif, driver, parameter config and embedding
+"""
+
+import os
+import json
+import pickle
+import threading
+
+import numpy as np
+
+
+VALUE_FILE = 'values.f32'
+INDEX_FILE = 'index.jsonl'
+EXTRA_FILE = 'extra.pkl'
+META_FILE = 'meta.pkl'
+
+RAW = -1 # embedding index of unembedded system
+
+def pack_tril(mats):
+    """ Pack lower triangles (with diagonal) of symmetric matrices `(reps, n, n)`
+    """
+    mats = np.asarray(mats)
+    rows, cols = np.tril_indices(mats.shape[-1])
+    return mats[:, rows, cols].astype(np.float32)
+
+def unpack_tril(packed, dim):
+    """ Restore symmetric matrices `(reps, dim, dim)` from packed lower triangles
+    """
+    rows, cols = np.tril_indices(dim)
+    mats = np.empty((packed.shape[0], dim, dim), dtype=packed.dtype)
+    mats[:, rows, cols] = packed
+    mats[:, cols, rows] = packed
+    return mats
+
+def is_store(fname):
+    return os.path.isfile(os.path.join(fname, INDEX_FILE))
+
+def modification_time(fname):
+    """ Time of last change of result file or store
+    """
+    if is_store(fname):
+        return max(
+            os.path.getmtime(os.path.join(fname, f))
+                for f in os.listdir(fname))
+    return os.path.getmtime(fname)
+
+class ResultStore(object):
+    """ Append-only result store in `directory`.
+        Each record holds correlation matrices of one system (`reps` of them)
+        plus optional pickled extra information (e.g. system and trajectory)
+    """
+    def __init__(self, directory, mode='r'):
+        assert mode in ('r', 'a', 'w'), 'Invalid mode ({})'.format(mode)
+        self.directory = directory
+        self.mode = mode
+        self.lock = threading.Lock()
+
+        if mode == 'w' or (mode == 'a' and not is_store(directory)):
+            if os.path.isfile(directory):
+                raise RuntimeError(
+                    'Cannot create result store, "{}" is a legacy result '
+                    'file (see `load_results`). Move it aside first'.format(directory))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for fn in (VALUE_FILE, INDEX_FILE, EXTRA_FILE):
+                open(self._path(fn), 'wb').close()
+            self.meta = {}
+            self._save_meta()
+        else:
+            with open(self._path(META_FILE), 'rb') as fd:
+                self.meta = pickle.load(fd)
+
+        self.entries = []
+        self.lookup = {}
+        with open(self._path(INDEX_FILE)) as fd:
+            for line in fd:
+                self._register(json.loads(line))
+
+        self._values = None
+
+    def _path(self, fname):
+        return os.path.join(self.directory, fname)
+
+    def _register(self, entry):
+        self.entries.append(entry)
+        self.lookup[self._key(**entry)] = entry
+
+    @staticmethod
+    def _key(motif, driver, config, embedding, kind, **kwargs):
+        return (motif, driver, config, embedding, kind)
+
+    def _save_meta(self):
+        tmp_fname = self._path(META_FILE + '.tmp')
+        with open(tmp_fname, 'wb') as fd:
+            pickle.dump(self.meta, fd)
+        os.replace(tmp_fname, self._path(META_FILE))
+
+    def set_meta(self, **kwargs):
+        assert self.mode != 'r', 'Store is read-only'
+        with self.lock:
+            self.meta.update(kwargs)
+            self._save_meta()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def mark_failed(self, motif=0, driver=0):
+        """ Record that results of `driver` are incomplete, readers skip them
+        """
+        assert self.mode != 'r', 'Store is read-only'
+        with self.lock:
+            self.meta['failed'] = set(self.meta.get('failed', ())) | {(motif, driver)}
+            self._save_meta()
+
+    def failed(self, motif=0, driver=0):
+        return (motif, driver) in self.meta.get('failed', ())
+
+    def append(
+        self, mats, motif=0, driver=0, config=0, embedding=RAW,
+        kind='sde', extra=None
+    ):
+        """ Append correlation matrices `(reps, n, n)` of one system
+        """
+        assert self.mode != 'r', 'Store is read-only'
+
+        mats = np.asarray(mats)
+        reps, dim = (mats.shape[0], mats.shape[-1]) if mats.size > 0 else (0, 0)
+        packed = pack_tril(mats) if reps > 0 else np.empty(0, dtype=np.float32)
+
+        with self.lock:
+            with open(self._path(VALUE_FILE), 'ab') as fd:
+                offset = fd.tell() // 4
+                fd.write(packed.tobytes())
+
+            extra_pos = None
+            if extra is not None:
+                with open(self._path(EXTRA_FILE), 'ab') as fd:
+                    start = fd.tell()
+                    pickle.dump(extra, fd, protocol=pickle.HIGHEST_PROTOCOL)
+                    extra_pos = [start, fd.tell() - start]
+
+            entry = {
+                'motif': motif, 'driver': driver,
+                'config': config, 'embedding': embedding, 'kind': kind,
+                'dim': dim, 'reps': reps, 'offset': offset,
+                'extra': extra_pos
+            }
+            with open(self._path(INDEX_FILE), 'a') as fd:
+                fd.write(json.dumps(entry) + '\n')
+            self._register(entry)
+
+        return entry
+
+    def select(self, **query):
+        """ Return all entries matching given fields
+        """
+        return [e for e in self.entries
+            if all(e[k] == v for k, v in query.items())]
+
+    def get(self, motif=0, driver=0, config=0, embedding=RAW, kind='sde'):
+        """ Random access to single entry
+        """
+        return self.lookup[(motif, driver, config, embedding, kind)]
+
+    def packed(self, entry):
+        """ Memory-mapped packed matrices `(reps, n*(n+1)/2)` of entry
+        """
+        size = entry['dim'] * (entry['dim'] + 1) // 2
+        end = entry['offset'] + entry['reps'] * size
+
+        if self._values is None or self._values.shape[0] < end:
+            self._values = np.memmap(
+                self._path(VALUE_FILE), dtype=np.float32, mode='r')
+
+        return self._values[entry['offset']:end].reshape(entry['reps'], size)
+
+    def read(self, entry):
+        """ Correlation matrices `(reps, n, n)` of entry, empty if there are none
+        """
+        if entry['reps'] == 0:
+            return np.empty(0)
+        return unpack_tril(self.packed(entry), entry['dim'])
+
+    def extra(self, entry):
+        if entry['extra'] is None:
+            return None
+
+        start, length = entry['extra']
+        with open(self._path(EXTRA_FILE), 'rb') as fd:
+            fd.seek(start)
+            return pickle.loads(fd.read(length))
+
+    def values(self, field, **query):
+        """ Sorted distinct values of index field among matching entries
+        """
+        return sorted({e[field] for e in self.select(**query)})
+
+def write_distributions(store, entry, config, motif=0, driver=0):
+    """ Append result of `pipeline.simulate_systems`
+    """
+    enh_reps = entry.get('enh_reps', [None] * len(entry['enh_corr_mat_list']))
+
+    store.append(
+        entry['raw_corr_mats'], motif=motif, driver=driver, config=config,
+        extra=entry.get('raw_reps'))
+    for e, (mats, reps) in enumerate(zip(entry['enh_corr_mat_list'], enh_reps)):
+        store.append(
+            mats, motif=motif, driver=driver, config=config, embedding=e,
+            extra=reps)
+
+def read_distributions(store, motif=0, driver=0):
+    """ List of `pipeline.simulate_systems` results of all configs
+        (empty for failed drivers)
+    """
+    data = []
+    if store.failed(motif, driver):
+        return data
+
+    for c in store.values('config', motif=motif, driver=driver):
+        raw = store.get(motif, driver, c, RAW)
+        enh = [
+            store.get(motif, driver, c, e)
+                for e in store.values('embedding', motif=motif, driver=driver, config=c)
+                if e != RAW]
+
+        entry = {
+            'raw_corr_mats': store.read(raw),
+            'enh_corr_mat_list': [store.read(e) for e in enh]
+        }
+        if raw['extra'] is not None:
+            # number of simulated replicates
+            entry['raw_reps'] = store.extra(raw)
+            entry['enh_reps'] = [store.extra(e) for e in enh]
+        data.append(entry)
+    return data
+
+def write_matrix_row(store, row, config, motif=0, driver=0):
+    """ Append result of `nm_data_generator.handle_systems`, i.e. pairs of
+        `(system, correlation matrix, solution)` for raw and ODE-SDE difference
+    """
+    (raw_res, raw_res_diff), enh_row = row
+    for emb, pair in [(RAW, (raw_res, raw_res_diff))] + list(enumerate(enh_row)):
+        for kind, (syst, mat, sol) in zip(['sde', 'diff'], pair):
+            store.append(
+                [] if mat is None else [mat],
+                motif=motif, driver=driver, config=config,
+                embedding=emb, kind=kind, extra=(syst, sol))
+
+def read_matrix_rows(store, motif=0, driver=0):
+    """ List of `nm_data_generator.handle_systems` results of all configs
+        (empty for failed drivers)
+    """
+    def res(c, e, kind):
+        entry = store.get(motif, driver, c, e, kind)
+        syst, sol = store.extra(entry)
+        mat = store.read(entry)[0] if entry['reps'] > 0 else None
+        return syst, mat, sol
+
+    rows = []
+    if store.failed(motif, driver):
+        return rows
+
+    for c in store.values('config', motif=motif, driver=driver):
+        embs = store.values('embedding', motif=motif, driver=driver, config=c)
+        rows.append([
+            (res(c, RAW, 'sde'), res(c, RAW, 'diff')),
+            [(res(c, e, 'sde'), res(c, e, 'diff')) for e in embs if e != RAW]])
+    return rows
+
+def _read(store, motif=0, driver=0):
+    if store.meta.get('layout') == 'matrices':
+        return read_matrix_rows(store, motif, driver)
+    return read_distributions(store, motif, driver)
+
+def load_results(fname):
+    """ Load result file of the form `{'data': [...], 'motif': ...}`,
+        either from a pickle or a single-motif store
+    """
+    if not is_store(fname):
+        with open(fname, 'rb') as fd:
+            return pickle.load(fd)
+
+    store = ResultStore(fname)
+    inp = {
+        k: v for k, v in store.meta.items()
+            if k not in ('layout', 'motifs', 'failed')}
+    inp['data'] = _read(store)
+    return inp
+
+def load_motif_results(prefix):
+    """ Load results of all motifs as `{motif index: {'data': [...], 'motif': ...}}`,
+        either from a motif store or pickles named `<prefix>_<index>`
+    """
+    if is_store(prefix):
+        store = ResultStore(prefix)
+        return {
+            idx: {
+                'motif': motif,
+                'data': [
+                    _read(store, idx, d)
+                        for d in range(store.meta['drivers'])]
+            } for idx, motif in store.meta['motifs'].items()}
+
+    data = {}
+    pref_dir = os.path.dirname(prefix)
+    for fn in os.listdir(pref_dir):
+        if fn.startswith(os.path.basename(prefix)):
+            with open(os.path.join(pref_dir, fn), 'rb') as fd:
+                data[int(fn.split('_')[-1])] = pickle.load(fd)
+    return data
+
+def is_motif_store(fname):
+    return is_store(fname) and 'motifs' in ResultStore(fname).meta
@@ -1,3 +1,3 @@
 python setup.py "$@" && \
 python main.py "results/systems.npy" && \
-python processing.py "results/data_cache.npy"
+python processing.py "results/data_cache"
@@ -6,13 +6,18 @@ import numpy as np
 import numpy.random as npr
 
 
-def solve_system(system, tmax=100, dt=0.01, seed=None):
-    """ Solve stochastic differential equation (SDE)
+def solve_system(system, tmax=100, dt=0.01, seed=None, noise_dim=None):
+    """ Solve stochastic differential equation (SDE).
+        `noise_dim` (>= system size) noise terms are drawn per step and the
+        first ones are used, so that systems of different size simulated
+        with the same `seed` share the noise paths of their common nodes
     """
     J = system.jacobian
     D = system.fluctuation_vector
     E = system.external_influence
     dim = J.shape[0]
+    noise_dim = dim if noise_dim is None else noise_dim
+    assert noise_dim >= dim, 'Noise dimension smaller than system'
 
     state = system.initial_state
     evolution = []
@@ -27,7 +32,7 @@ def solve_system(system, tmax=100, dt=0.01, seed=None):
         evolution.append(state)
 
         delta = J.dot(state) + E
-        fluc = tdsq * dtsq * npr.normal(size=dim)
+        fluc = tdsq * dtsq * npr.normal(size=noise_dim)[:dim]
         state = state + dt * delta + fluc
 
         t += dt
@@ -0,0 +1,185 @@
+"""
+Columnar store for results of individually simulated systems (see `main.main`).
+System parameters and correlation matrices are kept as dense arrays (NaN-padded
+to the largest system, the actual size is kept in a `dim` column),
+trajectories row-wise in an optional memory-mapped sidecar
+"""
+
+import os
+import json
+
+import numpy as np
+
+from system import SDESystem
+
+
+COLUMNS = ['jacobian', 'fluctuation_vector', 'external_influence', 'initial_state']
+TRAJECTORY_FILE = 'trajectories.f64'
+META_FILE = 'meta.json'
+
+def save_system_results(fname, results, trajectories=True, sort=False):
+    """ Store iterable of `(system, corr_mat, solution)` in directory `fname`.
+        Trajectories are streamed to disk, `sort` orders entries by summed correlations.
+        Returns number of stored entries
+    """
+    if not os.path.isdir(fname):
+        os.makedirs(fname)
+
+    cols = {c: [] for c in COLUMNS}
+    mats = []
+    dims = []
+    traj_len = None
+    traj_shape = None
+    traj_fname = os.path.join(fname, TRAJECTORY_FILE)
+
+    with open(traj_fname, 'wb') as fd:
+        for syst, mat, sol in results:
+            for c in COLUMNS:
+                cols[c].append(getattr(syst, c))
+
+            dim = syst.jacobian.shape[0]
+            dims.append(dim)
+            mats.append(np.full((dim, dim), np.nan) if mat is None else mat)
+
+            if trajectories:
+                sol = np.asarray(sol, dtype=np.float64)
+                assert sol.shape[0] == dim and (
+                    traj_len is None or sol.shape[1] == traj_len), \
+                    'Inhomogeneous trajectories'
+                traj_len = sol.shape[1]
+                traj_shape = sol.shape if traj_shape in (None, sol.shape) else False
+                fd.write(sol.tobytes())
+
+    if not trajectories or traj_len is None:
+        os.remove(traj_fname)
+
+    num = len(mats)
+    dims = np.array(dims, dtype=int)
+    dim = dims.max() if num > 0 else 0
+    for c in COLUMNS:
+        np.save(
+            os.path.join(fname, c),
+            _pad(cols[c], (num,) + (dim,) * (2 if c == 'jacobian' else 1)))
+    np.save(os.path.join(fname, 'dim'), dims)
+
+    mats = _pad(mats, (num, dim, dim))
+    filtered = np.isnan(mats).all(axis=(1, 2))
+    np.save(os.path.join(fname, 'corr_mat'), mats)
+    np.save(os.path.join(fname, 'filtered'), filtered)
+
+    order = np.arange(num)
+    if sort:
+        order = np.argsort(np.nansum(mats, axis=(1, 2)), kind='stable')
+    np.save(os.path.join(fname, 'order'), order)
+
+    with open(os.path.join(fname, META_FILE), 'w') as fd:
+        json.dump({
+            'num': num,
+            'trajectory_length': traj_len if trajectories else None,
+            'trajectory_shape': traj_shape or None if trajectories else None
+        }, fd)
+
+    return num
+
+def _pad(arrays, shape):
+    """ Stack `arrays` of possibly smaller size into NaN-padded array of `shape`
+    """
+    res = np.full(shape, np.nan)
+    for i, arr in enumerate(arrays):
+        arr = np.asarray(arr, dtype=float)
+        res[(i,) + tuple(slice(0, s) for s in arr.shape)] = arr
+    return res
+
+class SystemResults(object):
+    """ Lazy, sliceable view of stored results.
+        Entries are `(system, corr_mat, solution)` tuples as returned by `main.analyze_system`,
+        `solution` is None if no trajectories were stored.
+        Columns are NaN-padded to the largest system (see `dim` column)
+    """
+    def __init__(self, directory, index=None):
+        self.directory = directory
+
+        with open(os.path.join(directory, META_FILE)) as fd:
+            self.meta = json.load(fd)
+
+        self.cols = {
+            c: np.load(os.path.join(directory, c + '.npy'), mmap_mode='r')
+                for c in COLUMNS + ['corr_mat', 'filtered']}
+
+        dim_fname = os.path.join(directory, 'dim.npy')
+        self.cols['dim'] = np.load(dim_fname) if os.path.exists(dim_fname) \
+            else np.full(self.meta['num'], self.cols['jacobian'].shape[-1])
+        self.offsets = np.concatenate(([0], np.cumsum(self.cols['dim'])))
+
+        if index is None:
+            index = np.load(os.path.join(directory, 'order.npy'))
+        self.index = np.asarray(index)
+
+        self._trajectories = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.entry(self.index[key])
+        return SystemResults(self.directory, self.index[key])
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.entry(i)
+
+    def column(self, name):
+        """ Dense column of selected entries, e.g. `jacobian` or `corr_mat`
+        """
+        return self.cols[name][self.index]
+
+    def _trajectory_rows(self):
+        """ Memory-mapped trajectories of all stored entries, one row per node
+        """
+        length = self.meta.get('trajectory_length')
+        if length is None:
+            shape = self.meta['trajectory_shape']
+            length = None if shape is None else shape[1]
+        if length is None:
+            return None
+
+        if self._trajectories is None:
+            self._trajectories = np.memmap(
+                os.path.join(self.directory, TRAJECTORY_FILE),
+                dtype=np.float64, mode='r',
+                shape=(self.offsets[-1], length))
+        return self._trajectories
+
+    @property
+    def trajectories(self):
+        """ Memory-mapped trajectories of all stored entries (in storage order),
+            None if none were stored or systems differ in size (see `entry`)
+        """
+        shape = self.meta['trajectory_shape']
+        rows = self._trajectory_rows()
+        if shape is None or rows is None:
+            return None
+        return rows.reshape((self.meta['num'],) + tuple(shape))
+
+    def entry(self, i):
+        """ Entry `i` in storage order
+        """
+        dim = self.cols['dim'][i]
+        syst = SDESystem(*[
+            np.array(self.cols[c][i][(slice(0, dim),) * self.cols[c][i].ndim])
+                for c in COLUMNS])
+        mat = None if self.cols['filtered'][i] \
+            else np.array(self.cols['corr_mat'][i][:dim, :dim])
+
+        rows = self._trajectory_rows()
+        sol = None if rows is None else rows[self.offsets[i]:self.offsets[i+1]]
+
+        return syst, mat, sol
+
+def load_system_results(fname):
+    """ Load results from system store or legacy `np.save`d object array
+    """
+    if os.path.isdir(fname):
+        return SystemResults(fname)
+    return np.load(fname, allow_pickle=True)
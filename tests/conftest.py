@@ -0,0 +1,14 @@
+import numpy as np
+
+
+def corr_factory(seed):
+    """ Return `corr(dim, reps=None)` which draws random symmetric matrices
+        with entries in [-1, 1], `(dim, dim)` or `(reps, dim, dim)`
+    """
+    rng = np.random.RandomState(seed)
+
+    def corr(dim, reps=None):
+        shape = (dim, dim) if reps is None else (reps, dim, dim)
+        mats = rng.uniform(-1, 1, size=shape)
+        return (mats + np.swapaxes(mats, -1, -2)) / 2
+    return corr
@@ -0,0 +1,228 @@
+from unittest import TestCase
+
+import io
+import pickle
+import itertools
+
+import numpy as np
+import numpy.testing as npt
+
+from compound_table import *
+from reaction_finder import read_compounds_file, read_reactions_file, iterate_once
+
+
+class TestProvenanceTable(TestCase):
+    def setUp(self):
+        compounds = io.StringIO("""Name,-H,-O,-N,M-H
+c1,1,2,3,1.2
+c2,2,1,3,2.3
+""")
+        reactions = io.StringIO("""Reaction,Requirement Matrix - Compound 1,,,Requirement Matrix - Compound 2,,,Result Matrix,,,Transformation,Mass Addendum
+  ,-H,-O,-N,-H,-O,-N,-H,-O,-N,,
+r1, 1, 2, 3, 2, 1, 3, 1, 1,-6,,1.1
+r2, 4, 4, 0, 1, 2, 0, 1, 0,-1,,-2.2
+r3, 4, 4, 0, X,  ,  , 0, 0, 1,,3.3
+""")
+        comps = read_compounds_file(compounds)
+        reacts = read_reactions_file(reactions)
+        self.level0, self.reacts = dict(comps), reacts
+
+        comps.update(iterate_once(comps, reacts))
+        comps.update(iterate_once(comps, reacts))
+        self.comps = comps
+
+    def test_origin_table(self):
+        table, ids = ProvenanceTable.from_compounds(self.comps)
+
+        self.assertEqual(len(table), len(self.comps))
+        self.assertEqual(sorted(table.basic_names), ['c1', 'c2'])
+        self.assertEqual(table.origins.shape, (len(self.comps), 4))
+
+        idx = ids['((c1) {r1} (c2)) {r3} (None)']
+        _, c1, rea, c2 = table.origins[idx]
+        self.assertEqual(c1, ids['(c1) {r1} (c2)'])
+        self.assertEqual(table.reactions[rea], 'r3')
+        self.assertEqual(c2, -1)
+        self.assertEqual(table.id_of('c2'), ids['c2'])
+
+        npt.assert_array_equal(
+            sorted(set(table.levels)), [0, 1, 2])
+
+    def test_name_rendering(self):
+        table, ids = ProvenanceTable.from_compounds(self.comps)
+
+        for name in self.comps:
+            self.assertEqual(table.name(ids[name]), name)
+        self.assertEqual(len(table._names), len(self.comps))
+
+        table = pickle.loads(pickle.dumps(table))
+        self.assertEqual(table._names, {})
+        for name in self.comps:
+            self.assertEqual(table.name(ids[name]), name)
+
+    def test_origin_sets(self):
+        table, ids = ProvenanceTable.from_compounds(self.comps)
+
+        for name in self.comps:
+            # rendered names contain all of their level-0 ancestors
+            self.assertEqual(
+                table.origin_set(ids[name]),
+                {c for c in ['c1', 'c2'] if name == c or '({})'.format(c) in name})
+
+        self.assertTrue(table.unrelated(ids['c1'], ids['c2']))
+        self.assertFalse(table.unrelated(
+            ids['c1'], ids['((c1) {r1} (c2)) {r3} (None)']))
+
+    def test_id_expansion(self):
+        table = ProvenanceTable()
+        comps = {
+            table.add_compound(name): data
+                for name, data in self.level0.items()}
+
+        comps.update(iterate_once(comps, self.reacts, table))
+        comps.update(iterate_once(comps, self.reacts, table))
+
+        self.assertTrue(all(isinstance(c, int) for c in comps))
+        self.assertEqual(len(table), len(self.comps))
+
+        named = table.to_names(comps)
+        self.assertEqual(sorted(named), sorted(self.comps))
+        for name, data in named.items():
+            self.assertEqual(data['origin'], self.comps[name]['origin'])
+            self.assertEqual(data['mass'], self.comps[name]['mass'])
+
+    def test_many_basic_compounds(self):
+        table = ProvenanceTable()
+        ids = [table.add_compound('c{}'.format(i)) for i in range(100)]
+        prod = table.add_product(ids[3], 'r', ids[70])
+        prod2 = table.add_product(prod, 'r', None)
+
+        self.assertEqual(table.add_product(ids[3], 'r', ids[70]), prod)
+        self.assertEqual(table.origin_bits().shape, (102, 2))
+        self.assertEqual(table.origin_set(prod2), {'c3', 'c70'})
+        self.assertTrue(table.unrelated(prod2, ids[4]))
+        self.assertFalse(table.unrelated(prod2, ids[70]))
+        self.assertEqual(table.name(prod2), '((c3) {r} (c70)) {r} (None)')
+
+class TestNameParser(TestCase):
+    def test_basic_name(self):
+        name = '(Caffeic acid) {C-C linkage} (Rhamnazin)'
+        c1, r, c2 = parse_compound_name(name)
+
+        self.assertEqual(c1, 'Caffeic acid')
+        self.assertEqual(r, 'C-C linkage')
+        self.assertEqual(c2, 'Rhamnazin')
+
+    def test_nested_name1(self):
+        name = '(Phloretin) {C-C linkage} ((Abscisic acid) {C-C linkage} (Aurantinidin))'
+        c1, r, c2 = parse_compound_name(name)
+
+        self.assertEqual(c1, 'Phloretin')
+        self.assertEqual(r, 'C-C linkage')
+        self.assertEqual(c2, '(Abscisic acid) {C-C linkage} (Aurantinidin)')
+
+    def test_nested_name2(self):
+        name = '((Abscisic acid) {C-C linkage} (Aurantinidin)) {Condensation - Ester Formation} (Eudesmic acid)'
+        c1, r, c2 = parse_compound_name(name)
+
+        self.assertEqual(c1, '(Abscisic acid) {C-C linkage} (Aurantinidin)')
+        self.assertEqual(r, 'Condensation - Ester Formation')
+        self.assertEqual(c2, 'Eudesmic acid')
+
+    def test_rwb_name(self):
+        name = '(Ononitol) {Oxidation - (O) Addition} (None)'
+        c1, r, c2 = parse_compound_name(name)
+
+        self.assertEqual(c1, 'Ononitol')
+        self.assertEqual(r, 'Oxidation - (O) Addition')
+        self.assertEqual(c2, 'None')
+
+class TestColumnarTables(TestCase):
+    def setUp(self):
+        self.cdata = read_compounds_file('./tests/data/compounds.csv')
+        self.rdata = read_reactions_file('./tests/data/reactions.csv')
+
+    def test_compound_columns(self):
+        cols = compound_columns(self.cdata)
+
+        self.assertEqual(cols.names, ['foo', 'bar', 'baz'])
+        self.assertEqual(cols.index['bar'], 1)
+        self.assertEqual(cols.group_names, ['-H', '-O'])
+        self.assertEqual(cols.atom_names, ['C', 'N'])
+        npt.assert_array_equal(cols.groups, [[1, 4], [5, 0], [3, 3]])
+        npt.assert_array_equal(cols.atoms[:, 0], [5, 3, 1])
+        npt.assert_array_equal(cols.atoms[:, 3], [0, 2, 1])
+        npt.assert_array_equal(cols.mass, [1.5, 1.7, 1.1])
+
+        self.assertEqual(compound_dicts(cols), self.cdata)
+
+    def test_missing_compound_fields(self):
+        cdata = {
+            'foo': {'groups': {'-H': 1}, 'atoms': {'C': 2}, 'mass': 1.5},
+            'bar': {'groups': {'-H': 2}, 'atoms': {'N': 1}}
+        }
+        res = compound_dicts(compound_columns(cdata))
+
+        self.assertEqual(res['foo'], {
+            'groups': {'-H': 1}, 'atoms': {'C': 2, 'N': 0}, 'mass': 1.5})
+        self.assertEqual(res['bar']['atoms'], {'C': 0, 'N': 1})
+        self.assertTrue(np.isnan(res['bar']['mass']))
+
+    def test_reaction_columns(self):
+        cols = reaction_columns(self.rdata, ['-H', '-O'])
+
+        npt.assert_array_equal(cols.needs_c2, [True, True, False])
+        npt.assert_array_equal(cols.uses_c2, [True, False, False])
+        npt.assert_array_equal(cols.c1_reqs, [[3, 2], [0, 1], [2, 3]])
+        npt.assert_array_equal(cols.group_trans, [[-1, 2], [1, 0], [-2, -1]])
+        npt.assert_array_equal(cols.mass_trans, [-1.1, 2.2, -3.3])
+
+        self.assertEqual(reaction_dicts(cols), self.rdata)
+
+    def test_match_matrix(self):
+        ccols = compound_columns(self.cdata)
+        rcols = reaction_columns(self.rdata, ccols.group_names)
+
+        npt.assert_array_equal(match_matrix(ccols, rcols, 'c1'), [
+            [False, True, False],
+            [False, False, False],
+            [True, True, True]])
+        npt.assert_array_equal(match_matrix(ccols, rcols, 'c2'), [
+            [False, True, False],
+            [True, False, False],
+            [False, True, False]])
+
+class TestUnrelatedSampling(TestCase):
+    def setUp(self):
+        self.table = ProvenanceTable()
+        basic = [self.table.add_compound('c{}'.format(i)) for i in range(10)]
+        for i in range(9):
+            self.table.add_product(basic[i], 'r', basic[i+1])
+
+    def test_unrelated_mask(self):
+        npt.assert_array_equal(
+            self.table.unrelated_mask([0, 10, 10], [1, 1, 2]),
+            [True, False, True])
+
+    def test_sample_unrelated(self):
+        trips = sample_unrelated(
+            self.table, 50, rng=np.random.RandomState(42))
+
+        self.assertEqual(len(trips), 50)
+        self.assertEqual(len(set(trips)), 50)
+        for trip in trips:
+            for i, j in itertools.combinations(trip, 2):
+                self.assertTrue(self.table.unrelated(i, j))
+
+    def test_mass_range(self):
+        cands = np.arange(len(self.table))
+        mass = cands * 10.
+
+        trips = sample_unrelated(
+            self.table, 20, candidates=cands, mass=mass, mass_range=(45, 1000),
+            rng=np.random.RandomState(0))
+        self.assertTrue(all(i > 4 for trip in trips for i in trip))
+
+    def test_impossible(self):
+        with self.assertRaises(RuntimeError):
+            sample_unrelated(self.table, 1, candidates=[10, 11], max_redraws=5)
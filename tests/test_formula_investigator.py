@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+import os
+import pickle
+import tempfile
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from formula_investigator import *
+
+
+def naive_merge(df_comb, df_roy, thres):
+    """ Reference implementation of row-wise MZ matching
+    """
+    rows = []
+    for row in df_comb.itertuples():
+        for r in df_roy[abs(row.MZ-df_roy['MZ']) < thres].itertuples():
+            rows.append((r.Name, row.Name, r.Formula, row.Formula, r.MZ, row.MZ))
+    return pd.DataFrame(
+        rows, columns=['aname', 'cname', 'aform', 'cform', 'amass', 'cmass'])
+
+class TestSourceMerging(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+
+        self.df_comb = pd.DataFrame({
+            'Name': ['c{}'.format(i) for i in range(200)],
+            'Formula': ['C{}H2'.format(i) for i in range(200)],
+            'MZ': rng.uniform(100, 110, size=200)
+        })
+        self.df_roy = pd.DataFrame({
+            'Name': ['a{}'.format(i) for i in range(100)],
+            'Formula': ['C{}O'.format(i) for i in range(100)],
+            'MZ': rng.uniform(100, 110, size=100)
+        })
+
+    def test_against_reference(self):
+        for thres in [.001, .01, .1]:
+            res = merge_sources(self.df_comb, self.df_roy, thres)
+            expected = naive_merge(self.df_comb, self.df_roy, thres)
+
+            pd.testing.assert_frame_equal(res, expected)
+
+    def test_no_match(self):
+        res = merge_sources(self.df_comb, self.df_roy.assign(MZ=500.), .01)
+
+        self.assertTrue(res.empty)
+        self.assertEqual(
+            list(res.columns),
+            ['aname', 'cname', 'aform', 'cform', 'amass', 'cmass'])
+
+class TestFormulaDistance(TestCase):
+    def test_form2dict(self):
+        self.assertEqual(form2dict('C12H2O'), {'C': 12, 'H': 2, 'O': 1})
+
+    def test_distance(self):
+        self.assertEqual(compute_formula_distance('C2H2', 'C2H2'), 0)
+        self.assertEqual(compute_formula_distance('C2', 'C1O1'), 2 / 4)
+
+class TestVectorizedDistances(TestCase):
+    def setUp(self):
+        self.forms = ['C2H2', 'C6H12O6', 'CO2', 'C2H2', 'N2', 'C12H22O11S']
+
+    def test_formula_matrix(self):
+        mat, atoms = formulas_to_matrix(self.forms)
+
+        self.assertEqual(atoms, ['C', 'H', 'N', 'O', 'S'])
+        np.testing.assert_array_equal(mat[1], [6, 12, 0, 6, 0])
+        np.testing.assert_array_equal(mat[0], mat[3])
+
+        mat, atoms = formulas_to_matrix(['CO2'], atoms=['O', 'C'])
+        np.testing.assert_array_equal(mat, [[2, 1]])
+
+    def test_pairwise_distances(self):
+        mat, _ = formulas_to_matrix(self.forms)
+        dists = pairwise_formula_distances(mat)
+
+        for (i, f1), (j, f2) in itertools.product(enumerate(self.forms), repeat=2):
+            self.assertAlmostEqual(dists[i, j], compute_formula_distance(f1, f2))
+
+    def test_histogram_mode(self):
+        mat, _ = formulas_to_matrix(self.forms)
+        bins = np.linspace(0, 1, 11)
+
+        hist = pairwise_formula_distances(mat, chunk_size=4, bins=bins)
+        expected, _ = np.histogram(pairwise_formula_distances(mat), bins=bins)
+
+        np.testing.assert_array_equal(hist.counts, expected)
+        self.assertEqual(hist.total, len(self.forms)**2)
+
+class TestComparisonFrame(TestCase):
+    def test_caching(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            comb_fname = os.path.join(tmpdir, 'comps.pkl')
+            with open(comb_fname, 'wb') as fd:
+                pickle.dump({
+                    'foo': {'atoms': {'C': 2, 'H': 1}, 'mass': 100.},
+                    'bar': {'atoms': {'C': 1}, 'mass': 200.}
+                }, fd)
+
+            act_fname = os.path.join(tmpdir, 'actual.csv')
+            with open(act_fname, 'w') as fd:
+                fd.write('Name,Formula,M_selected\nbaz,C2H2,100.005\n')
+
+            cache = result_cache.ResultCache(os.path.join(tmpdir, 'cache'))
+            df = get_rl_comparison_frame(comb_fname, act_fname, cache=cache)
+
+            self.assertEqual(df['cname'].tolist(), ['foo'])
+            self.assertEqual(df['dist'].tolist(), [1 / 7])
+            self.assertEqual(len(cache.entries()), 1)
+
+            df2 = get_rl_comparison_frame(comb_fname, act_fname, cache=cache)
+            pd.testing.assert_frame_equal(df, df2)
@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+import copy
+
 import numpy as np
 import numpy.testing as npt
 
@@ -73,10 +75,101 @@ class TestSimulationFilters(TestCase):
         self.assertIsNotNone(mat)
         self.assertIsNotNone(sol)
 
-class TestDataClustering(TestCase):
-    def test_simple_case(self):
-        test_data = [(None, [2]), (None, [1])]
-        res = cluster_data(test_data)
+class TestTrajectoryRetention(TestCase):
+    def setUp(self):
+        self.sol = np.random.RandomState(0).normal(size=(3, 1000))
+
+    def test_policies(self):
+        self.assertIs(retain_trajectory(self.sol, 'full'), self.sol)
+        self.assertIsNone(retain_trajectory(self.sol, 'none'))
+        npt.assert_array_equal(
+            retain_trajectory(self.sol, 'downsample', step=10), self.sol[:, ::10])
+
+        with self.assertRaises(RuntimeError):
+            retain_trajectory(self.sol, 'foo')
+
+    def test_envelope(self):
+        env = retain_trajectory(self.sol, 'envelope', bins=100)
+
+        self.assertEqual(env.shape, (3, 200))
+        npt.assert_array_equal(env[:, 0], self.sol[:, :10].min(axis=1))
+        npt.assert_array_equal(env[:, 1], self.sol[:, :10].max(axis=1))
+        npt.assert_array_equal(env.min(axis=1), self.sol.min(axis=1))
+        npt.assert_array_equal(env.max(axis=1), self.sol.max(axis=1))
 
-        self.assertEqual(res[0][1], [1])
-        self.assertEqual(res[1][1], [2])
+    def test_analyze_system(self):
+        syst = SDESystem(
+            np.array([[-1, 0], [0, -1]]), np.array([1, 1]),
+            np.array([1, 1]), np.array([1, 1]))
+
+        _, mat, sol = analyze_system(syst, repetition_num=2, trajectory='none')
+        self.assertIsNotNone(mat)
+        self.assertIsNone(sol)
+
+        _, _, sol = analyze_system(syst, repetition_num=2, trajectory='downsample')
+        self.assertEqual(sol.shape, (2, 100))
+
+class TestSystemPair(TestCase):
+    def setUp(self):
+        self.syst = SDESystem(
+            np.array([[-1, 0], [1, -1]]), np.array([1e-4, 1e-4]),
+            np.array([5, 5]), np.array([.1, .1]))
+
+    def test_shared_replicates(self):
+        sde_res, diff_res = analyze_system_pair(self.syst, repetition_num=5)
+        self.assertIs(sde_res[0], self.syst)
+        self.assertEqual(sde_res[1].shape, (2, 2))
+        self.assertEqual(diff_res[1].shape, (2, 2))
+
+        ode_syst = copy.copy(self.syst)
+        ode_syst.fluctuation_vector = np.zeros(2)
+        npt.assert_allclose(sde_res[2] + diff_res[2], solve_system(ode_syst))
+
+    def test_shared_filter(self):
+        self.syst.external_influence = np.array([0, 0])
+
+        sde_res, diff_res = analyze_system_pair(self.syst, repetition_num=5)
+        self.assertIsNone(sde_res[1])
+        self.assertIsNone(diff_res[1])
+
+        sde_res, diff_res = analyze_system_pair(
+            self.syst, repetition_num=5, trajectory='none', return_reps=True)
+        self.assertIsNone(sde_res[2])
+        self.assertIsNone(diff_res[2])
+        self.assertEqual(sde_res[3], 0)
+
+    def test_seeds(self):
+        seeds = [1, 2, 3]
+        res1 = analyze_system_pair(self.syst, repetition_num=3, seeds=seeds)
+        res2 = analyze_system_pair(self.syst, repetition_num=3, seeds=seeds)
+
+        npt.assert_array_equal(res1[0][1], res2[0][1])
+        npt.assert_array_equal(res1[1][1], res2[1][1])
+
+class TestAdaptiveReplicates(TestCase):
+    def setUp(self):
+        self.syst = SDESystem(
+            np.array([[-1, 0], [1, -1]]), np.array([.1, .1]),
+            np.array([5, 5]), np.array([.1, .1]))
+
+    def test_analyze_system(self):
+        _, mat, _, reps = analyze_system(
+            self.syst, repetition_num=6, target_se=1, batch_size=2,
+            return_reps=True)
+        self.assertEqual(reps, 2)
+        self.assertEqual(mat.shape, (2, 2))
+
+        res = analyze_system(
+            self.syst, repetition_num=4, target_se=0, batch_size=3,
+            return_reps=True)
+        self.assertEqual(res[3], 4)
+
+        res = analyze_system(self.syst, repetition_num=2)
+        self.assertEqual(len(res), 3)
+
+    def test_analyze_system_pair(self):
+        sde_res, diff_res = analyze_system_pair(
+            self.syst, repetition_num=6, target_se=1, batch_size=2,
+            return_reps=True)
+        self.assertEqual(sde_res[3], 2)
+        self.assertEqual(diff_res[3], 2)
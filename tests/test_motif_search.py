@@ -0,0 +1,181 @@
+from unittest import TestCase
+
+import itertools
+import collections
+
+import numpy as np
+import networkx as nx
+
+from motif_search import *
+
+
+def naive_ffl(graph):
+    """ Reference implementation of feedforward loop detection
+    """
+    edges = set(graph.edges())
+    for c1 in graph.nodes():
+        for c2, c3 in itertools.product(graph.successors(c1), repeat=2):
+            if len(set([c1,c2,c3])) != 3 or None in (c1, c2, c3):
+                continue
+            if (c2,c1) in edges or (c3,c1) in edges or (c3,c2) in edges:
+                continue
+            if (c2,c3) in edges:
+                yield (c1, c2, c3)
+
+class TestFFLDetection(TestCase):
+    def setUp(self):
+        self.graph = nx.gnp_random_graph(60, .1, directed=True, seed=42)
+        self.graph.add_edges_from([(0, 0), (1, 2), (2, 1)])
+
+    def test_simple_ffl(self):
+        graph = nx.DiGraph([('a', 'b'), ('a', 'c'), ('b', 'c'), ('c', 'd')])
+        adj, nodes = graph_to_csr(graph)
+
+        res = [tuple(nodes[i] for i in t) for chunk in find_ffl(adj) for t in chunk]
+        self.assertEqual(res, [('a', 'b', 'c')])
+        self.assertEqual(count_ffl(adj), 1)
+
+    def test_exclusion_rules(self):
+        base = [('a', 'b'), ('a', 'c'), ('b', 'c')]
+        for extra in [('b', 'a'), ('c', 'a'), ('c', 'b')]:
+            adj, _ = graph_to_csr(nx.DiGraph(base + [extra]))
+            self.assertEqual(sum(len(c) for c in find_ffl(adj)), 0)
+
+    def test_random_graph(self):
+        expected = sorted(naive_ffl(self.graph), key=str)
+
+        adj, nodes = graph_to_csr(self.graph)
+        for chunk_size in [1, 7, 1000]:
+            res = [tuple(nodes[i] for i in t)
+                for chunk in find_ffl(adj, chunk_size=chunk_size) for t in chunk]
+            self.assertEqual(sorted(res, key=str), expected)
+
+        self.assertEqual(count_ffl(adj), len(expected))
+
+    def test_parallel(self):
+        adj, _ = graph_to_csr(self.graph)
+
+        serial = np.concatenate(list(find_ffl(adj, chunk_size=10)))
+        parallel = np.concatenate(list(find_ffl(adj, chunk_size=10, processes=2)))
+        np.testing.assert_array_equal(serial, parallel)
+
+def naive_census(graph, size):
+    """ Reference census via isomorphism checks on all node subsets
+    """
+    und = graph.to_undirected()
+    counts = collections.Counter()
+    for nodes in itertools.combinations(graph.nodes(), size):
+        if nx.is_connected(und.subgraph(nodes)):
+            counts[motif_code(graph.subgraph(nodes))] += 1
+    return dict(counts)
+
+class TestMotifCensus(TestCase):
+    def setUp(self):
+        self.graph = nx.gnp_random_graph(25, .12, directed=True, seed=1)
+
+    def test_canonical_codes(self):
+        ffl1 = nx.DiGraph([(0, 1), (0, 2), (1, 2)])
+        ffl2 = nx.DiGraph([(2, 0), (2, 1), (0, 1)])
+        cycle = nx.DiGraph([(0, 1), (1, 2), (2, 0)])
+
+        self.assertEqual(motif_code(ffl1), motif_code(ffl2))
+        self.assertNotEqual(motif_code(ffl1), motif_code(cycle))
+        self.assertTrue(nx.is_isomorphic(
+            nx.DiGraph(code_to_adjacency(motif_code(ffl2), 3)), ffl1))
+
+    def test_against_reference(self):
+        adj, _ = graph_to_csr(self.graph)
+        census = motif_census(adj, sizes=(3, 4), chunk_size=7)
+
+        self.assertEqual(census.counts[3], naive_census(self.graph, 3))
+        self.assertEqual(census.counts[4], naive_census(self.graph, 4))
+        self.assertIsNone(census.members)
+
+    def test_ffl_consistency(self):
+        adj, _ = graph_to_csr(self.graph)
+        census = motif_census(adj, sizes=(3,), collect=True)
+
+        ffl = motif_code(nx.DiGraph([(0, 1), (0, 2), (1, 2)]))
+        self.assertEqual(census.counts[3][ffl], count_ffl(adj))
+        self.assertEqual(len(census.members[3][ffl]), count_ffl(adj))
+
+    def test_parallel(self):
+        adj, _ = graph_to_csr(self.graph)
+
+        serial = motif_census(adj, chunk_size=5)
+        parallel = motif_census(adj, chunk_size=5, processes=2)
+        self.assertEqual(serial.counts, parallel.counts)
+
+    def test_sampling(self):
+        adj, _ = graph_to_csr(self.graph)
+
+        full = motif_census(adj, sizes=(3,), probs=[1, 1, 1])
+        self.assertEqual(full.counts, motif_census(adj, sizes=(3,)).counts)
+
+        estimates = [
+            sum(motif_census(adj, sizes=(3,), probs=[1, .8, .5], seed=s).counts[3].values())
+            for s in range(30)]
+        total = sum(full.counts[3].values())
+        self.assertLess(abs(np.mean(estimates) - total) / total, .1)
+
+class TestSparseGraph(TestCase):
+    def setUp(self):
+        self.graph = SparseGraph.from_edges([
+            ('a', 'b'), ('a', 'c'), ('b', 'c'), ('c', 'd'), ('a', 'b'), (None, 'a')])
+
+    def test_construction(self):
+        self.assertEqual(self.graph.labels, ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(self.graph), 4)
+        self.assertEqual(self.graph.number_of_edges(), 4)
+        self.assertEqual(self.graph.index('c'), 2)
+
+    def test_neighbours(self):
+        c = self.graph.index('c')
+
+        self.assertEqual(sorted(self.graph.successors(0)), [1, 2])
+        self.assertEqual(sorted(self.graph.predecessors(c)), [0, 1])
+        np.testing.assert_array_equal(self.graph.out_degree(), [2, 1, 1, 0])
+        np.testing.assert_array_equal(self.graph.in_degree(), [0, 1, 2, 1])
+
+    def test_subgraph(self):
+        sub = self.graph.subgraph([3, 2, 1, 2])
+
+        self.assertEqual(sub.labels, ['b', 'c', 'd'])
+        self.assertEqual(sorted(sub.labeled_edges()), [('b', 'c'), ('c', 'd')])
+        self.assertEqual(sub.degree_stats()['edges'], 2)
+
+    def test_networkx_export(self):
+        nxg = self.graph.to_networkx()
+
+        self.assertEqual(sorted(nxg.nodes()), ['a', 'b', 'c', 'd'])
+        self.assertEqual(
+            sorted(nxg.edges()), [('a', 'b'), ('a', 'c'), ('b', 'c'), ('c', 'd')])
+
+        adj, _ = graph_to_csr(nxg)
+        self.assertEqual(count_ffl(adj), count_ffl(self.graph.adjacency))
+
+class TestFFLIndex(TestCase):
+    def test_incremental_growth(self):
+        graph = nx.gnp_random_graph(50, .1, directed=True, seed=3)
+        edges = list(graph.edges())
+        np.random.RandomState(0).shuffle(edges)
+
+        index = FFLIndex()
+        cur = nx.DiGraph()
+        for i in range(0, len(edges), 40):
+            new = index.add_edges(edges[i:i+40])
+            cur.add_edges_from(edges[i:i+40])
+
+            self.assertEqual(set(index), set(naive_ffl(cur)))
+            self.assertEqual(len(new), len(set(new)))
+
+    def test_reciprocal_edge_removes_motif(self):
+        index = FFLIndex()
+
+        self.assertEqual(index.add_edges([('a', 'b'), ('b', 'c'), ('a', 'c')]), [('a', 'b', 'c')])
+        self.assertEqual(index.add_edges([('a', 'b'), (None, 'a')]), [])
+        self.assertIn(('a', 'b', 'c'), index)
+
+        index.add_edges([('c', 'b')])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.removed, [('a', 'b', 'c')])
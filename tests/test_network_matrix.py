@@ -1,9 +1,13 @@
 from unittest import TestCase
 
+import os
+import tempfile
+
 import numpy as np
 import numpy.testing as npt
 
 from system import SDESystem
+from conftest import corr_factory
 from network_matrix import *
 from nm_data_generator import *
 
@@ -192,6 +196,123 @@ class TestValueFunctions(TestCase):
         vals2 = np.array([0.23,0.05,0.97])
         self.assertEqual(get_rank_changes(vals1, vals2), 2)
 
+    def test_explicit_threshold(self):
+        vals1 = np.array([1, -0.5, 0.1, -0.12, 0.5])
+        vals2 = np.array([0, 0.5, -0.6, 0.08, -0.3])
+
+        self.assertEqual(get_sign_changes(vals1.copy(), vals2.copy(), threshold=0.05), 4)
+        self.assertEqual(get_sign_changes(vals1.copy(), vals2.copy(), threshold=0.4), 1)
+        self.assertEqual(
+            get_rank_changes(vals1.copy(), vals2.copy(), threshold=0.2),
+            get_rank_changes(vals1.copy(), vals2.copy()))
+
+class TestThresholdScan(TestCase):
+    def setUp(self):
+        corr = corr_factory(0)
+        entry = lambda mat: (None, (None, mat, None))
+
+        self.data = []
+        for c in range(4):
+            raw = entry(corr(3) if c != 2 else None)
+            enh = [entry(corr(4) if e != 1 else None) for e in range(5)]
+            self.data.append((raw, enh))
+
+    def test_sig_entry_tensor(self):
+        raw_vals, enh_vals, valid = sig_entry_tensor(self.data)
+
+        self.assertEqual(raw_vals.shape, (4, 3))
+        self.assertEqual(enh_vals.shape, (4, 5, 3))
+        npt.assert_array_equal(valid.sum(axis=1), [4, 4, 0, 4])
+
+        mat = self.data[3][1][4][1][1]
+        npt.assert_array_equal(enh_vals[3, 4], [mat[1, 0], mat[2, 0], mat[2, 1]])
+
+    def test_against_reference(self):
+        raw_vals, enh_vals, valid = sig_entry_tensor(self.data)
+        thresholds = np.logspace(-3, 0, 20)
+        counts = sign_change_counts(raw_vals, enh_vals, thresholds)
+
+        for t, thres in enumerate(thresholds):
+            for c, (raw, enh_res) in enumerate(self.data):
+                for e, enh in enumerate(enh_res):
+                    res = handle_enh_entry(raw, enh, get_sign_changes, threshold=thres)
+                    if res < 0:
+                        self.assertFalse(valid[c, e])
+                    else:
+                        self.assertEqual(counts[t, c, e], res)
+
+class TestPlotFeatures(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        corr = corr_factory(1)
+        def syst(dim):
+            J = rng.choice([0, 0, 1], size=(dim, dim))
+            return SDESystem(J, np.zeros(dim), np.zeros(dim), np.ones(dim))
+        def entry(dim):
+            res = (syst(dim), corr(dim), None)
+            return (res, res)
+
+        self.data = [(entry(3), [entry(4) for e in range(6)]) for c in range(3)]
+
+    def test_against_reference(self):
+        features = compute_plot_features(self.data)
+        systs = [n[0][0] for n in self.data[0][1]]
+
+        for vname in VALUE_FUNCTIONS:
+            vfunc = globals()[vname]
+            ref_mat = np.array([
+                [handle_enh_entry(raw, enh, vfunc) for enh in enh_res]
+                    for raw, enh_res in self.data])
+
+            for sfuncs in [
+                [sort_by_network_density],
+                [sort_by_indeg, sort_by_outdeg],
+                [sort_by_cycle_num]
+            ]:
+                order = sorted(
+                    range(len(systs)),
+                    key=lambda i: [f(systs[i]) for f in sfuncs])
+                dat, xt, yt = preprocess_data(self.data, vfunc, sfuncs, features)
+
+                npt.assert_array_equal(dat, ref_mat[:, order])
+                npt.assert_array_equal(xt, [sfuncs[0](systs[i]) for i in order])
+                self.assertEqual(yt, [
+                    round(np.mean(abs(r[0][0].jacobian)), 2)
+                        for r, e in self.data])
+
+    def test_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'results.dat')
+            open(fname, 'w').close()
+
+            features = load_plot_features(fname, {'data': self.data})
+            self.assertTrue(os.path.isfile(fname + '.features.npz'))
+
+            cached = load_plot_features(fname, None)
+            self.assertEqual(sorted(cached), sorted(features))
+            for key in features:
+                npt.assert_array_equal(cached[key], features[key])
+
+    def test_cache_threshold(self):
+        import network_matrix
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'results.dat')
+            open(fname, 'w').close()
+
+            features = load_plot_features(fname, {'data': self.data})
+            threshold = network_matrix.THRESHOLD
+            try:
+                network_matrix.THRESHOLD = .9
+                updated = load_plot_features(fname, {'data': self.data})
+            finally:
+                network_matrix.THRESHOLD = threshold
+
+            self.assertEqual(updated['threshold'], .9)
+            self.assertGreaterEqual(
+                features['value__get_sign_changes'].sum(),
+                updated['value__get_sign_changes'].sum())
+
 class TestSorterFunctions(TestCase):
     def setUp(self):
         self.systs = [
@@ -0,0 +1,119 @@
+from unittest import TestCase
+
+import os
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+
+from system import SDESystem
+from conftest import corr_factory
+from pipeline import *
+
+
+class TestRobustnessEngine(TestCase):
+    def setUp(self):
+        corr = corr_factory(42)
+        corrs = lambda n, dim: corr(dim, reps=n)
+
+        self.data = [
+            {
+                'raw_corr_mats': corrs(20, 3),
+                'enh_corr_mat_list': [corrs(15, 4), corrs(25, 4), corrs(5, 4)]
+            }, {
+                'raw_corr_mats': corrs(7, 3),
+                'enh_corr_mat_list': [corrs(30, 4), np.empty(0), corrs(11, 4)]
+            }, {
+                'raw_corr_mats': np.empty(0),
+                'enh_corr_mat_list': [corrs(3, 4), corrs(3, 4), corrs(3, 4)]
+            }
+        ]
+        self.data[0]['raw_corr_mats'][3, 1, 0] = np.nan
+
+    def test_tail_fractions(self):
+        distrs = [np.array([-.5, .1, .6, np.nan]), np.array([]), np.array([-.9])]
+        below, above = tail_fractions(distrs, np.array([0, .2, .7]))
+
+        npt.assert_allclose(below[:, 0], [.25, .25, 0])
+        npt.assert_allclose(above[:, 0], [.5, .25, 0])
+        self.assertTrue(np.isnan(below[:, 1]).all())
+        npt.assert_allclose(below[:, 2], [1, 1, 1])
+        npt.assert_allclose(above[:, 2], [0, 0, 0])
+
+    def test_against_reference(self):
+        thresholds = np.logspace(-3, 0, 7)
+        rob = robustness_tensor(self.data, thresholds)
+
+        self.assertEqual(rob.shape, (7, 3, 3, 3))
+        for t, thres in enumerate(thresholds):
+            for c, entry in enumerate(self.data):
+                expected = handle_enh_entry(entry, thres)
+                res = rob[t, c][~np.isnan(rob[t, c])]
+                npt.assert_allclose(res, expected)
+
+        self.assertTrue(np.isnan(rob[:, 1, 1]).all())
+        self.assertTrue(np.isnan(rob[:, 2]).all())
+
+    def test_per_config_thresholds(self):
+        thresholds = np.array([[.1, .3, .5]])
+        rob = robustness_tensor(self.data, thresholds)
+
+        for c, entry in enumerate(self.data):
+            res = rob[0, c][~np.isnan(rob[0, c])]
+            npt.assert_allclose(res, handle_enh_entry(entry, thresholds[0, c]))
+
+    def test_fixed_threshold(self):
+        data = [self.data[1], self.data[2]]
+        robs, thresholds = fixed_threshold(data)
+
+        self.assertEqual(robs.shape, (1,))
+        self.assertAlmostEqual(
+            robs[0], np.mean(handle_enh_entry(data[0], thresholds[0])))
+
+class TestAdaptiveReplicates(TestCase):
+    def setUp(self):
+        J = np.array([[-1, 0], [1, -1]])
+        self.raw = SDESystem(J, [.1, .1], [5, 5], [.1, .1])
+        self.enh = add_node_to_system(self.raw)[:2]
+
+    def test_fixed(self):
+        res = simulate_systems(self.raw, self.enh, reps=4)
+        self.assertEqual(res['raw_reps'], 4)
+        self.assertEqual(res['raw_corr_mats'].shape, (4, 2, 2))
+
+        # first enhanced system is filtered before any replicate is simulated
+        self.assertEqual(res['enh_reps'], [0, 4])
+        self.assertEqual(len(res['enh_corr_mat_list'][0]), 0)
+
+    def test_adaptive(self):
+        res = simulate_systems(
+            self.raw, self.enh, reps=6, target_se=1, batch_size=2)
+        self.assertEqual(res['raw_reps'], 2)
+        self.assertEqual(res['enh_reps'], [0, 2])
+
+        res = simulate_systems(
+            self.raw, self.enh, reps=6, target_se=0, batch_size=4)
+        self.assertEqual(res['raw_reps'], 6)
+
+class TestMotifData(TestCase):
+    def test_failing_driver(self):
+        syst = SDESystem(np.eye(3), np.ones(3), np.zeros(3), np.ones(3))
+        def failing(**kwargs):
+            if len(kwargs) > 0:
+                raise FloatingPointError
+            return syst
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, 'store')
+            store = ResultStore(fname, mode='w')
+            store.set_meta(layout='distributions', drivers=1, motifs={0: syst})
+
+            write_distributions(store, {
+                'raw_corr_mats': np.ones((2, 3, 3)),
+                'enh_corr_mat_list': []
+            }, 0)
+            info = generate_system_data(0, [failing], store)
+
+            self.assertIs(info['motif'], syst)
+            self.assertTrue(store.failed(0, 0))
+            self.assertEqual(load_motif_results(fname)[0]['data'], [[]])
@@ -1,6 +1,7 @@
 from unittest import TestCase, skipIf
 
 import io
+import tempfile
 
 from reaction_finder import *
 
@@ -284,39 +285,6 @@ r3, 4, 4, 0, X,  ,  , 0, 0, 1,,3.3
         self.assertEqual(nres['(c1) {r1} (c2)']['mass'], 4.6)
         self.assertAlmostEqual(nres['((c1) {r1} (c2)) {r2} (c1)']['mass'], 3.6)
 
-class TestNameParser(TestCase):
-    def test_basic_name(self):
-        name = '(Caffeic acid) {C-C linkage} (Rhamnazin)'
-        c1, r, c2 = parse_compound_name(name)
-
-        self.assertEqual(c1, 'Caffeic acid')
-        self.assertEqual(r, 'C-C linkage')
-        self.assertEqual(c2, 'Rhamnazin')
-
-    def test_nested_name1(self):
-        name = '(Phloretin) {C-C linkage} ((Abscisic acid) {C-C linkage} (Aurantinidin))'
-        c1, r, c2 = parse_compound_name(name)
-
-        self.assertEqual(c1, 'Phloretin')
-        self.assertEqual(r, 'C-C linkage')
-        self.assertEqual(c2, '(Abscisic acid) {C-C linkage} (Aurantinidin)')
-
-    def test_nested_name2(self):
-        name = '((Abscisic acid) {C-C linkage} (Aurantinidin)) {Condensation - Ester Formation} (Eudesmic acid)'
-        c1, r, c2 = parse_compound_name(name)
-
-        self.assertEqual(c1, '(Abscisic acid) {C-C linkage} (Aurantinidin)')
-        self.assertEqual(r, 'Condensation - Ester Formation')
-        self.assertEqual(c2, 'Eudesmic acid')
-
-    def test_rwb_name(self):
-        name = '(Ononitol) {Oxidation - (O) Addition} (None)'
-        c1, r, c2 = parse_compound_name(name)
-
-        self.assertEqual(c1, 'Ononitol')
-        self.assertEqual(r, 'Oxidation - (O) Addition')
-        self.assertEqual(c2, 'None')
-
 class TestAtomTransformationParser(TestCase):
     def test_easy_case(self):
         inp = 'M1 + M2 - H2O'
@@ -340,6 +308,16 @@ class TestAtomTransformationParser(TestCase):
         })
 
 class TestAssignmentPrediction(TestCase):
+    def setUp(self):
+        # plots are saved relative to the working directory
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
     @skipIf('TRAVIS' in os.environ and os.environ['TRAVIS'] == 'true', 'Skip on Travis CI.')
     def test_simple_case(self):
         motifs = [
@@ -377,3 +355,201 @@ class TestAssignmentPrediction(TestCase):
         self.assertEqual(res['A']['intensities'], [[1,2,3]])
         self.assertEqual(res['B']['intensities'], [[6,7,8]])
         self.assertEqual(res['C']['intensities'], [[20,30,40]])
+
+class TestPeakIndex(TestCase):
+    def test_lookup(self):
+        pdata = {
+            100.1: [1., 2., 3.],
+            200.2: [4., 5., 6.],
+            300.3: [1., 2., 3.]
+        }
+        peaks = PeakIndex(pdata)
+
+        self.assertEqual(len(peaks), 3)
+        self.assertEqual(peaks.peak_id([4., 5., 6.]), 1)
+        self.assertEqual(peaks.lookup_mz((4., 5., 6.)), 200.2)
+        self.assertEqual(peaks.lookup_mz([1., 2., 3.]), 100.1)
+        self.assertEqual(peaks.peak_id([7., 8., 9.]), -1)
+        self.assertIsNone(peaks.lookup_mz([7., 8., 9.]))
+
+class TestNullModel(TestCase):
+    def setUp(self):
+        self.data = {
+            'A': {'intensities': [[1,2,3], [4,5,6]], 'atoms': {'C': 1}},
+            'B': {'intensities': [[1,2,3]], 'atoms': {'C': 2}},
+            'C': {'intensities': [[4,5,6], [7,8,9], [1,2,3]], 'atoms': {'C': 3}},
+            'D': {'intensities': [[1,2,3]], 'atoms': {'C': 4}}
+        }
+
+    def test_candidate_matrix(self):
+        cand, vectors = candidate_matrix(self.data, ['B', 'C'])
+
+        self.assertEqual(vectors, [[1,2,3], [4,5,6], [7,8,9]])
+        np.testing.assert_array_equal(cand, [[0, -1, -1], [1, 2, 0]])
+
+    def test_generator(self):
+        cand, vectors = candidate_matrix(self.data, ['A', 'B', 'C', 'D'])
+        assigned, order = generate_null_assignments(
+            cand, len(vectors), 500, np.random.RandomState(1))
+
+        self.assertEqual(assigned.shape, (500, 4))
+        np.testing.assert_array_equal(np.sort(order, axis=1), [[0, 1, 2, 3]] * 500)
+
+        for ass, ordr in zip(assigned, order):
+            used = ass[ass >= 0]
+            self.assertEqual(len(used), len(set(used)))
+            for c, v in enumerate(ass):
+                if v >= 0:
+                    self.assertIn(v, cand[c])
+
+            # first compound in order always gets some candidate
+            self.assertGreaterEqual(ass[ordr[0]], 0)
+
+        # B and D compete for the same vector
+        self.assertTrue(((assigned[:, 1] < 0) | (assigned[:, 3] < 0)).all())
+        self.assertGreater((assigned[:, 2] == 2).mean(), .2)
+
+    def test_dict_output(self):
+        all_ass, all_info = null_model_assignments(
+            self.data, 3, reps=20, rng=np.random.RandomState(0))
+
+        self.assertEqual(len(all_ass), 20)
+        for ass, info in zip(all_ass, all_info):
+            self.assertEqual(len(info['assignment_order']), 3)
+            for c, entry in ass.items():
+                self.assertIn(entry['intensities'][0], self.data[c]['intensities'])
+                self.assertEqual(entry['atoms'], self.data[c]['atoms'])
+
+class TestCorrelationPoolNullModel(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.pool = rng.uniform(size=(30, 6)).tolist()
+        self.pool.append(list(self.pool[0])) # duplicate vector
+
+    def test_against_reference(self):
+        res = correlation_pool_null_model(
+            self.pool, num=50, rng=np.random.RandomState(3), chunk_size=7)
+
+        rng = np.random.RandomState(3)
+        for start in range(0, 50, 7):
+            size = min(7, 50 - start)
+            idx_1 = rng.randint(len(self.pool), size=(size, 3))
+            idx_2 = rng.randint(len(self.pool), size=(size, 5))
+
+            overlap = (idx_1[:, :, None] == idx_2[:, None, :]).any(axis=(1, 2))
+            while overlap.any():
+                idx_2[overlap] = rng.randint(len(self.pool), size=(overlap.sum(), 5))
+                overlap = (idx_1[:, :, None] == idx_2[:, None, :]).any(axis=(1, 2))
+
+            for r in range(size):
+                ccs = [scis.pearsonr(self.pool[i], self.pool[j])[0]
+                    for i in idx_1[r] for j in idx_2[r]]
+                self.assertAlmostEqual(res[start+r], max(ccs, key=abs))
+
+    def test_many_samples(self):
+        res = correlation_pool_null_model(self.pool, num=10**5)
+
+        self.assertEqual(res.shape, (10**5,))
+        self.assertTrue((np.abs(res) <= 1 + 1e-12).all())
+
+    def test_small_pool(self):
+        with self.assertRaises(RuntimeError):
+            correlation_pool_null_model(self.pool[:4])
+
+class TestMotifGrowth(TestCase):
+    def setUp(self):
+        # cache keys depend on the reaction and peak files
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        os.makedirs('data')
+        for fname in [REACTION_FILE, PEAK_FILE]:
+            open(fname, 'w').close()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def motif(self, *cs):
+        return cs + (
+            {c: [[1,2,3]] for c in cs}, {c: {'groups': {}} for c in cs})
+
+    def test_reciprocal_link(self):
+        motifs = [
+            self.motif('a', 'b', 'c'),
+            self.motif('b', 'a', 'd'),
+            self.motif('e', 'f', 'g')
+        ]
+
+        # no reactions take place
+        cache = result_cache.ResultCache('cache')
+        all_cdata = {c: d for m in motifs for c, d in m[4].items()}
+        cache.put(expansion_key('post_motif_reactions', all_cdata), {})
+
+        more_motifs, index = find_more_motifs(motifs, [], {}, cache=cache)
+        self.assertEqual([m[:3] for m in more_motifs], [('e', 'f', 'g')])
+        self.assertEqual(list(index), [('e', 'f', 'g')])
+
+class TestAssignmentEnsemble(TestCase):
+    def setUp(self):
+        self.data = {
+            'A': {'intensities': [[1,2,3], [4,5,6]], 'atoms': {'C': 1}},
+            'B': {'intensities': [[7,8,9]], 'atoms': {'C': 2}},
+            'C': {'intensities': [[4,5,6], [1,2,3]], 'atoms': {'C': 3}}
+        }
+        entry = lambda c, i: {
+            'intensities': [self.data[c]['intensities'][i]],
+            'atoms': self.data[c]['atoms']}
+
+        self.all_ass = [
+            {'A': entry('A', 0), 'B': entry('B', 0), 'C': entry('C', 0)},
+            {'B': entry('B', 0), 'A': entry('A', 0), 'C': entry('C', 0)},
+            {'B': entry('B', 0), 'C': entry('C', 1)}
+        ]
+        self.all_info = [
+            {'assignment_order': ['A', 'B', 'C']},
+            {'assignment_order': ['B', 'A', 'C']},
+            {'assignment_order': ['B', 'C']}
+        ]
+
+    def test_matrices(self):
+        ens = AssignmentEnsemble.from_dicts(self.all_ass, self.all_info)
+
+        self.assertEqual(ens.compounds, ['A', 'B', 'C'])
+        self.assertEqual(ens.vectors, [[1,2,3], [7,8,9], [4,5,6]])
+        np.testing.assert_array_equal(
+            ens.assigned, [[0, 1, 2], [0, 1, 2], [-1, 1, 0]])
+        np.testing.assert_array_equal(
+            ens.positions, [[0, 1, 2], [1, 0, 2], [-1, 0, 1]])
+
+    def test_statistics(self):
+        ens = AssignmentEnsemble.from_dicts(self.all_ass, self.all_info)
+
+        np.testing.assert_array_equal(ens.candidate_counts(self.data), [2, 1, 2])
+        np.testing.assert_array_equal(ens.always_assigned(), [False, True, True])
+        np.testing.assert_array_equal(ens.vectors_per_compound(), [1, 1, 2])
+        np.testing.assert_array_equal(ens.compounds_per_vector(), [2, 1, 1])
+        np.testing.assert_array_equal(
+            ens.compounds_per_vector(ens.always_assigned()), [1, 1, 1])
+        np.testing.assert_array_equal(ens.sole_compound(), [-1, 1, 2])
+        np.testing.assert_allclose(ens.consensus_rate(), [2/3, 1, 2/3])
+
+        mean, std = ens.position_stats()
+        np.testing.assert_allclose(mean, [.5, 1/3, 5/3])
+        np.testing.assert_allclose(std, [np.std([0, 1], ddof=1), np.std([1, 0, 0], ddof=1), np.std([2, 2, 1], ddof=1)])
+
+    def test_roundtrip(self):
+        ens = AssignmentEnsemble.from_dicts(self.all_ass, self.all_info)
+        all_ass, all_info = ens.to_dicts(self.data)
+
+        self.assertEqual(all_ass, self.all_ass)
+        self.assertEqual(all_info, self.all_info)
+        for ass, orig in zip(all_ass, self.all_ass):
+            self.assertEqual(list(ass), list(orig))
+
+    def test_from_matrix(self):
+        ens = AssignmentEnsemble.from_matrix(
+            ['A', 'B'], [[1], [2]], [[0, 1], [1, -1]], [[1, 0], [0, 1]])
+
+        np.testing.assert_array_equal(ens.positions, [[1, 0], [0, 1]])
+        np.testing.assert_array_equal(ens.vectors_per_compound(), [2, 1])
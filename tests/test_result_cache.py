@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+import os
+import tempfile
+
+from result_cache import *
+
+
+class TestKeys(TestCase):
+    def test_key_dependencies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, 'input.csv')
+            with open(fname, 'w') as fd:
+                fd.write('foo,bar\n')
+
+            key = make_key('expansion', files=[fname], tolerance=1e-2)
+            self.assertTrue(key.startswith('expansion_'))
+            self.assertEqual(key, make_key('expansion', files=[fname], tolerance=1e-2))
+            self.assertNotEqual(key, make_key('expansion', files=[fname], tolerance=1e-3))
+
+            with open(fname, 'w') as fd:
+                fd.write('foo,baz\n')
+            self.assertNotEqual(key, make_key('expansion', files=[fname], tolerance=1e-2))
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fetch(self):
+        cache = ResultCache(self.tmp_dir.name)
+
+        calls = []
+        def func(x):
+            calls.append(x)
+            return {'res': x * 2}
+
+        self.assertEqual(cache.fetch('foo', func, 2), {'res': 4})
+        self.assertEqual(cache.fetch('foo', func, 2), {'res': 4})
+        self.assertEqual(calls, [2])
+
+        # index persists
+        cache = ResultCache(self.tmp_dir.name)
+        self.assertIn('foo', cache)
+        self.assertEqual(cache.get('foo'), {'res': 4})
+
+    def test_lru_eviction(self):
+        cache = ResultCache(self.tmp_dir.name)
+        cache.put('a', list(range(100)))
+        cache.put('b', list(range(100)))
+        cache.put('c', list(range(100)))
+        cache.index['a']['atime'] += 10 # 'a' was used most recently
+
+        cache.max_size = 2 * cache.index['a']['size']
+        cache.put('d', list(range(100)))
+
+        self.assertEqual(sorted(k for k, _ in cache.entries()), ['a', 'd'])
+        self.assertNotIn('b', cache)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'b.pkl')))
+
+    def test_clear(self):
+        cache = ResultCache(self.tmp_dir.name)
+        cache.put('prediction_foo', 1)
+        cache.put('prediction_bar', 2)
+        cache.put('expansion', 3)
+
+        cache.clear('prediction_')
+        self.assertEqual([k for k, _ in cache.entries()], ['expansion'])
+
+        cache.clear()
+        self.assertEqual(cache.entries(), [])
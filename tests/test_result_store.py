@@ -0,0 +1,152 @@
+from unittest import TestCase
+
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+
+from system import SDESystem
+from conftest import corr_factory
+from result_store import *
+
+
+class TestPacking(TestCase):
+    def test_roundtrip(self):
+        mats = corr_factory(0)(4, reps=5)
+        packed = pack_tril(mats)
+
+        self.assertEqual(packed.shape, (5, 10))
+        self.assertEqual(packed.dtype, np.float32)
+        npt.assert_allclose(unpack_tril(packed, 4), mats, rtol=1e-6)
+
+class TestResultStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp_dir.name, 'store')
+        self.corr = corr_factory(42)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_and_read(self):
+        store = ResultStore(self.fname, mode='w')
+        mats1 = self.corr(3, reps=3)
+        mats2 = self.corr(4, reps=7)
+
+        store.append(mats1, config=0)
+        store.append(mats2, config=0, embedding=2, extra={'foo': 42})
+        store.append([], config=1)
+
+        store = ResultStore(self.fname)
+        self.assertEqual(len(store), 3)
+        npt.assert_allclose(store.read(store.get(config=0)), mats1, rtol=1e-6)
+
+        entry = store.get(config=0, embedding=2)
+        self.assertIsInstance(store.packed(entry), np.memmap)
+        npt.assert_allclose(store.read(entry), mats2, rtol=1e-6)
+        self.assertEqual(store.extra(entry), {'foo': 42})
+
+        self.assertEqual(store.read(store.get(config=1)).size, 0)
+        self.assertEqual(store.values('config'), [0, 1])
+        self.assertEqual(len(store.select(embedding=RAW)), 2)
+
+    def test_append_mode(self):
+        store = ResultStore(self.fname, mode='a')
+        store.append(self.corr(3, reps=2), config=0)
+
+        store = ResultStore(self.fname, mode='a')
+        store.append(self.corr(3, reps=2), config=1)
+        self.assertEqual(ResultStore(self.fname).values('config'), [0, 1])
+
+    def test_distributions(self):
+        data = [{
+            'raw_corr_mats': self.corr(3, reps=10),
+            'enh_corr_mat_list': [
+                self.corr(4, reps=10), np.asarray([]), self.corr(4, reps=4)],
+            'raw_reps': 10,
+            'enh_reps': [10, 12, 4]
+        } for _ in range(3)]
+
+        store = ResultStore(self.fname, mode='w')
+        store.set_meta(layout='distributions', motif='ffl')
+        for c, entry in enumerate(data):
+            write_distributions(store, entry, c)
+
+        inp = load_results(self.fname)
+        self.assertEqual(inp['motif'], 'ffl')
+        self.assertEqual(len(inp['data']), 3)
+        for res, ref in zip(inp['data'], data):
+            self.assertEqual(res['raw_reps'], 10)
+            self.assertEqual(res['enh_reps'], [10, 12, 4])
+            npt.assert_allclose(res['raw_corr_mats'], ref['raw_corr_mats'], rtol=1e-6)
+            for enh, ref_enh in zip(res['enh_corr_mat_list'], ref['enh_corr_mat_list']):
+                self.assertEqual(enh.shape, ref_enh.shape)
+                npt.assert_allclose(enh, ref_enh, rtol=1e-6)
+
+    def test_matrix_rows(self):
+        def res(dim, mat=True):
+            syst = SDESystem(np.eye(dim), np.ones(dim), np.zeros(dim), np.ones(dim))
+            return (syst, self.corr(dim) if mat else None, None)
+
+        rows = [
+            [(res(3), res(3)), [(res(4), res(4)), (res(4, False), res(4))]]
+            for _ in range(2)]
+
+        store = ResultStore(self.fname, mode='w')
+        store.set_meta(layout='matrices')
+        for c, row in enumerate(rows):
+            write_matrix_row(store, row, c)
+
+        data = load_results(self.fname)['data']
+        self.assertEqual(len(data), 2)
+        (raw, raw_diff), enh_row = data[1]
+        npt.assert_array_equal(raw[0].jacobian, np.eye(3))
+        npt.assert_allclose(raw_diff[1], rows[1][0][1][1], rtol=1e-6)
+        self.assertEqual(len(enh_row), 2)
+        self.assertIsNone(enh_row[1][0][1])
+        npt.assert_allclose(enh_row[1][1][1], rows[1][1][1][1][1], rtol=1e-6)
+
+    def test_motif_store(self):
+        store = ResultStore(self.fname, mode='w')
+        store.set_meta(layout='distributions', drivers=2, motifs={0: 'a', 3: 'b'})
+        write_distributions(store, {
+            'raw_corr_mats': self.corr(3, reps=5),
+            'enh_corr_mat_list': [self.corr(4, reps=5)]
+        }, 0, motif=3, driver=1)
+
+        self.assertTrue(is_motif_store(self.fname))
+        res = load_motif_results(self.fname)
+        self.assertEqual(sorted(res), [0, 3])
+        self.assertEqual(res[3]['motif'], 'b')
+        self.assertEqual([len(d) for d in res[3]['data']], [0, 1])
+
+    def test_failed_driver(self):
+        store = ResultStore(self.fname, mode='w')
+        store.set_meta(layout='distributions', drivers=2, motifs={0: 'a'})
+        for d in range(2):
+            write_distributions(store, {
+                'raw_corr_mats': self.corr(3, reps=5),
+                'enh_corr_mat_list': [self.corr(4, reps=5)]
+            }, 0, driver=d)
+        store.mark_failed(driver=1)
+
+        store = ResultStore(self.fname)
+        self.assertTrue(store.failed(driver=1))
+        self.assertFalse(store.failed(driver=0))
+        self.assertEqual(
+            [len(d) for d in load_motif_results(self.fname)[0]['data']], [1, 0])
+
+    def test_legacy_pickle(self):
+        fname = os.path.join(self.tmp_dir.name, 'data.dat')
+        with open(fname, 'wb') as fd:
+            pickle.dump({'data': [1, 2]}, fd)
+
+        self.assertFalse(is_store(fname))
+        self.assertEqual(load_results(fname), {'data': [1, 2]})
+
+        for mode in ['w', 'a']:
+            with self.assertRaises(RuntimeError):
+                ResultStore(fname, mode=mode)
+        self.assertEqual(load_results(fname), {'data': [1, 2]})
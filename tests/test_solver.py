@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+import numpy as np
+import numpy.testing as npt
+
+from system import SDESystem
+from solver import *
+
+
+class TestCommonNoise(TestCase):
+    def setUp(self):
+        J = np.array([[-2, 0, 0], [1, -2, 0], [1, 1, -2]])
+        self.raw = SDESystem(J, [1, 1, 1], [1, 1, 1], [1, 1, 1])
+
+        # fourth node is driven by, but does not influence, the others
+        J_enh = np.zeros((4, 4))
+        J_enh[:3, :3] = J
+        J_enh[3] = [1, 0, 1, -1]
+        self.enh = SDESystem(J_enh, [1, 1, 1, 0], [1, 1, 1, 0], [1, 1, 1, 1])
+
+    def test_shared_noise_paths(self):
+        sol_raw = solve_system(self.raw, tmax=1, seed=42, noise_dim=4)
+        sol_enh = solve_system(self.enh, tmax=1, seed=42, noise_dim=4)
+
+        self.assertEqual(sol_enh.shape[0], 4)
+        npt.assert_allclose(sol_raw, sol_enh[:3])
+
+    def test_default_noise(self):
+        sol1 = solve_system(self.raw, tmax=1, seed=42)
+        sol2 = solve_system(self.raw, tmax=1, seed=42, noise_dim=3)
+        sol3 = solve_system(self.raw, tmax=1, seed=42, noise_dim=4)
+
+        npt.assert_array_equal(sol1, sol2)
+        self.assertFalse(np.allclose(sol1, sol3))
+
+    def test_invalid_noise_dim(self):
+        with self.assertRaises(AssertionError):
+            solve_system(self.enh, tmax=1, noise_dim=3)
@@ -0,0 +1,103 @@
+from unittest import TestCase
+
+import os
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+
+from system import SDESystem
+from system_store import *
+
+
+class TestSystemStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp_dir.name, 'data_cache')
+
+        rng = np.random.RandomState(0)
+        self.results = []
+        for i in range(10):
+            syst = SDESystem(
+                rng.normal(size=(3, 3)), rng.uniform(size=3),
+                rng.uniform(size=3), np.ones(3))
+            mat = None if i == 4 else rng.uniform(-1, 1, size=(3, 3))
+            sol = rng.normal(size=(3, 50))
+            self.results.append((syst, mat, sol))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertEntryEqual(self, entry, ref):
+        syst, mat, sol = entry
+        ref_syst, ref_mat, ref_sol = ref
+
+        npt.assert_array_equal(syst.jacobian, ref_syst.jacobian)
+        npt.assert_array_equal(syst.external_influence, ref_syst.external_influence)
+        if ref_mat is None:
+            self.assertIsNone(mat)
+        else:
+            npt.assert_array_equal(mat, ref_mat)
+        npt.assert_array_equal(sol, ref_sol)
+
+    def test_roundtrip(self):
+        num = save_system_results(self.fname, iter(self.results))
+        self.assertEqual(num, 10)
+
+        data = load_system_results(self.fname)
+        self.assertEqual(len(data), 10)
+        for entry, ref in zip(data, self.results):
+            self.assertEntryEqual(entry, ref)
+
+    def test_slicing(self):
+        save_system_results(self.fname, self.results)
+        data = load_system_results(self.fname)[::3]
+
+        self.assertEqual(len(data), 4)
+        self.assertEntryEqual(data[1], self.results[3])
+        self.assertEntryEqual(data[-1], self.results[9])
+        npt.assert_array_equal(
+            data.column('jacobian')[2], self.results[6][0].jacobian)
+        self.assertIsInstance(data.trajectories, np.memmap)
+
+    def test_without_trajectories(self):
+        save_system_results(self.fname, self.results, trajectories=False)
+        data = load_system_results(self.fname)
+
+        self.assertFalse(os.path.exists(os.path.join(self.fname, TRAJECTORY_FILE)))
+        self.assertIsNone(data[0][2])
+
+    def test_sorting(self):
+        save_system_results(self.fname, self.results, sort=True)
+        data = load_system_results(self.fname)
+
+        sums = [np.sum(mat) if mat is not None else 0 for _, mat, _ in data]
+        self.assertEqual(sums, sorted(sums))
+
+    def test_legacy_file(self):
+        fname = os.path.join(self.tmp_dir.name, 'data_cache.npy')
+        np.save(fname, np.array(self.results, dtype=object))
+
+        data = load_system_results(fname)[::2]
+        self.assertEqual(len(data), 5)
+        self.assertEntryEqual(data[1], self.results[2])
+
+    def test_mixed_sizes(self):
+        rng = np.random.RandomState(1)
+        for dim in [2, 4]:
+            syst = SDESystem(
+                rng.normal(size=(dim, dim)), rng.uniform(size=dim),
+                rng.uniform(size=dim), np.ones(dim))
+            self.results.append((syst, rng.uniform(-1, 1, size=(dim, dim)),
+                rng.normal(size=(dim, 50))))
+
+        save_system_results(self.fname, self.results, sort=True)
+        data = load_system_results(self.fname)
+
+        self.assertEqual(len(data), 12)
+        self.assertIsNone(data.trajectories)
+        self.assertEqual(data.column('jacobian').shape, (12, 4, 4))
+        for entry in data:
+            ref = next(r for r in self.results if r[0].jacobian[0, 0] == entry[0].jacobian[0, 0])
+            self.assertEntryEqual(entry, ref)
+            self.assertEqual(entry[0].fluctuation_vector.shape, (len(entry[0].jacobian),))
@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+import os
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+import networkx as nx
+
+from system import SDESystem
+from topology import *
+
+
+def reference_spl(jacobian):
+    graph = nx.Graph(jacobian)
+    return np.mean([
+        nx.average_shortest_path_length(graph.subgraph(comp))
+            for comp in nx.connected_components(graph)])
+
+class TestTopologyFeatures(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.jacs = rng.choice(
+            [0, 0, 0, 1, -2], size=(50, 4, 4)).astype(float)
+
+    def test_against_networkx(self):
+        feats = topology_features(self.jacs)
+
+        for i, jac in enumerate(self.jacs):
+            digraph = nx.DiGraph(jac)
+            graph = nx.Graph(jac)
+
+            self.assertEqual(feats['edges'][i], np.count_nonzero(jac))
+            npt.assert_array_equal(
+                feats['degree'][i], [digraph.degree(n) for n in range(4)])
+            self.assertAlmostEqual(
+                feats['clustering'][i], nx.average_clustering(graph))
+            self.assertAlmostEqual(
+                feats['shortest_path'][i], reference_spl(jac))
+            self.assertEqual(
+                feats['cycles'][i], len(list(nx.simple_cycles(digraph))))
+
+    def test_count_cycles(self):
+        jac = np.array([[1, 1, 0], [0, 0, 1], [1, 0, 0]])
+        self.assertEqual(count_cycles(jac), 2)
+        self.assertEqual(count_cycles(-jac), 2)
+
+    def test_shortest_paths(self):
+        adj = np.array([[[0, 1, 0], [0, 0, 1], [0, 0, 0]]], dtype=bool)
+        dist = shortest_paths(adj)
+
+        npt.assert_array_equal(dist[0], [
+            [0, 1, 2],
+            [np.inf, 0, 1],
+            [np.inf, np.inf, 0]])
+
+class TestTopologyTable(TestCase):
+    def setUp(self):
+        def syst(J):
+            dim = len(J)
+            return SDESystem(np.array(J), np.ones(dim), np.zeros(dim), np.ones(dim))
+
+        self.systems = [
+            syst([[0, 1], [1, 0]]),
+            syst([[1, 0, 0], [1, 0, 1], [0, 1, 0]]),
+            syst([[0, 1], [1, 0]])
+        ]
+
+    def test_lookup(self):
+        table = TopologyTable()
+        npt.assert_array_equal(
+            table.column(self.systems, 'edges'), [2, 4, 2])
+        npt.assert_array_equal(
+            table.column(self.systems, 'cycles'), [1, 2, 1])
+        self.assertEqual(len(table), 2)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, 'topo', 'table.pkl')
+
+            table = load_table(self.systems, fname)
+            self.assertTrue(os.path.isfile(fname))
+
+            table = TopologyTable(fname)
+            self.assertEqual(len(table), 2)
+            self.assertIn(self.systems[1], table)
+            self.assertEqual(table[self.systems[1]]['nodes'], 3)
@@ -62,3 +62,76 @@ class TestFunctions(TestCase):
 
         res = list_diff(l1, l2)
         npt.assert_array_equal(res, [1,3,5])
+
+class TestHistogramAccumulator(TestCase):
+    def test_chunked_filling(self):
+        data = np.random.RandomState(0).normal(size=1000)
+        bins = np.linspace(-3, 3, 21)
+
+        hist = HistogramAccumulator(bins)
+        for chunk in np.array_split(data, 7):
+            hist.add(chunk)
+        hist.add([np.nan, np.inf])
+
+        expected, _ = np.histogram(data, bins=bins)
+        npt.assert_array_equal(hist.counts, expected)
+        self.assertEqual(hist.total, expected.sum())
+        self.assertAlmostEqual((hist.density() * np.diff(bins)).sum(), 1)
+        npt.assert_allclose(hist.centers[:2], [-2.85, -2.55])
+
+class TestCrossCorrelation(TestCase):
+    def test_against_pearson(self):
+        rng = np.random.RandomState(1)
+        xs, ys = rng.normal(size=(4, 10)), rng.normal(size=(3, 10))
+
+        res = cross_correlation(xs, ys)
+        self.assertEqual(res.shape, (4, 3))
+        for i in range(4):
+            for j in range(3):
+                self.assertAlmostEqual(res[i, j], get_correlation(xs[i], ys[j]))
+
+    def test_constant_rows(self):
+        res = cross_correlation([1, 2, 3], [[2, 2, 2], [3, 2, 1]])
+
+        self.assertTrue(np.isnan(res[0, 0]))
+        self.assertAlmostEqual(res[0, 1], -1)
+
+class TestCorrelationStandardError(TestCase):
+    def test_standard_error(self):
+        mats = np.array([np.eye(3)] * 4)
+        mats[:, 1, 0] = mats[:, 0, 1] = [.1, .2, .3, .4]
+        mats[:, 2, 1] = mats[:, 1, 2] = [.5, .5, .5, .5]
+
+        self.assertAlmostEqual(
+            correlation_standard_error(mats),
+            np.std([.1, .2, .3, .4], ddof=1) / 2)
+
+    def test_few_replicates(self):
+        self.assertEqual(correlation_standard_error([np.eye(3)]), np.inf)
+        self.assertEqual(correlation_standard_error(np.ones((5, 1, 1))), 0)
+
+    def test_undefined_correlations(self):
+        mats = np.array([np.eye(3)] * 4)
+        mats[:, 1, 0] = [.1, .2, .3, .4]
+        mats[:, 2, 0] = np.nan
+        mats[:, 2, 1] = [.5, np.nan, .5, .5]
+
+        self.assertAlmostEqual(
+            correlation_standard_error(mats),
+            np.std([.1, .2, .3, .4], ddof=1) / 2)
+
+class TestReplicateBatches(TestCase):
+    def test_single_batch(self):
+        self.assertEqual(list(replicate_batches(range(5), [[]])), [range(5)])
+
+    def test_early_stop(self):
+        mats = []
+        batches = []
+        for batch in replicate_batches(list(range(7)), [mats], 1, 3):
+            batches.append(batch)
+            mats.extend([np.eye(2)] * len(batch))
+        self.assertEqual(batches, [[0, 1, 2]])
+
+        mats = []
+        batches = list(replicate_batches(list(range(7)), [[np.eye(2)], mats], 0, 3))
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
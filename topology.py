@@ -0,0 +1,167 @@
+"""
+Topological features of simulated systems, computed in bulk on stacks of Jacobians
+"""
+
+import os
+import pickle
+import hashlib
+import functools
+
+import numpy as np
+import networkx as nx
+
+
+TABLE_FILE = 'cache/topology.pkl'
+
+def system_hash(syst):
+    """ Hash of system topology (i.e. its Jacobian)
+    """
+    jacobian = np.ascontiguousarray(syst.jacobian, dtype=float)
+
+    sha = hashlib.sha1()
+    sha.update(str(jacobian.shape).encode())
+    sha.update(jacobian.tobytes())
+    return sha.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def _count_cycles(dim, bits):
+    adj = np.unpackbits(
+        np.frombuffer(bits, dtype=np.uint8))[:dim*dim].reshape(dim, dim)
+    return len(list(nx.simple_cycles(nx.DiGraph(adj))))
+
+def count_cycles(jacobian):
+    """ Number of simple directed cycles (including self-loops),
+        memoized by adjacency pattern
+    """
+    adj = np.asarray(jacobian) != 0
+    return _count_cycles(adj.shape[0], np.packbits(adj).tobytes())
+
+def shortest_paths(adj):
+    """ Unweighted all-pairs shortest path lengths of stack of
+        adjacency matrices `(systems, n, n)` (Floyd-Warshall)
+    """
+    num, dim, _ = adj.shape
+    dist = np.where(adj, 1., np.inf)
+    dist[:, np.arange(dim), np.arange(dim)] = 0
+
+    for k in range(dim):
+        np.minimum(dist, dist[:, :, k, None] + dist[:, None, k, :], out=dist)
+    return dist
+
+def topology_features(jacobians):
+    """ Compute features of stack of Jacobians `(systems, n, n)`.
+        Clustering coefficients and shortest paths refer to the
+        undirected graph, degrees and cycles to the directed one
+    """
+    adj = np.asarray(jacobians) != 0
+    num, dim, _ = adj.shape
+    diag = np.arange(dim)
+
+    in_degree = adj.sum(axis=1)
+    out_degree = adj.sum(axis=2)
+
+    # undirected graph without self-loops
+    und = adj | adj.transpose(0, 2, 1)
+    und[:, diag, diag] = False
+    und_int = und.astype(int)
+
+    # local clustering: closed walks of length 3 over possible triangles
+    closed = np.einsum('kij,kjl,kli->ki', und_int, und_int, und_int)
+    deg = und_int.sum(axis=2)
+    pairs = deg * (deg - 1)
+    clustering = np.divide(
+        closed, pairs, out=np.zeros(pairs.shape), where=pairs > 0)
+
+    # average shortest path length, averaged over connected components
+    dist = shortest_paths(und)
+    reach = np.isfinite(dist)
+    comp_size = reach.sum(axis=2)
+    comp_num = (1 / comp_size).sum(axis=1)
+
+    norm = comp_size * (comp_size - 1)
+    path_sum = np.where(reach, dist, 0).sum(axis=2)
+    spl = np.divide(
+        path_sum, norm, out=np.zeros(norm.shape), where=norm > 0).sum(axis=1)
+    spl /= comp_num
+
+    # cycles are enumerated once per adjacency pattern
+    patterns, inverse = np.unique(
+        np.packbits(adj.reshape(num, -1), axis=1), axis=0, return_inverse=True)
+    cycles = np.array(
+        [_count_cycles(dim, p.tobytes()) for p in patterns])[inverse.ravel()]
+
+    return {
+        'nodes': np.full(num, dim),
+        'edges': adj.sum(axis=(1, 2)),
+        'in_degree': in_degree,
+        'out_degree': out_degree,
+        'degree': in_degree + out_degree,
+        'clustering': clustering.mean(axis=1),
+        'shortest_path': spl,
+        'cycles': cycles
+    }
+
+class TopologyTable(object):
+    """ Topological features of systems keyed by `system_hash`.
+        The table is stored in `fname` (if given) to be reused across scripts
+    """
+    def __init__(self, fname=None):
+        self.fname = fname
+
+        if fname is not None and os.path.isfile(fname):
+            with open(fname, 'rb') as fd:
+                self.records = pickle.load(fd)
+        else:
+            self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, syst):
+        return system_hash(syst) in self.records
+
+    def __getitem__(self, syst):
+        return self.records[system_hash(syst)]
+
+    def update(self, systems):
+        """ Compute features of all unknown systems, grouped by dimension
+        """
+        groups = {}
+        for syst in systems:
+            key = system_hash(syst)
+            if key not in self.records:
+                groups.setdefault(syst.jacobian.shape, {})[key] = syst.jacobian
+
+        for jacs in groups.values():
+            feats = topology_features(np.array(list(jacs.values())))
+            for i, key in enumerate(jacs):
+                self.records[key] = {k: v[i] for k, v in feats.items()}
+
+        return len(groups) > 0
+
+    def column(self, systems, name):
+        """ Return feature `name` of all given systems
+        """
+        self.update(systems)
+        return np.array([self[syst][name] for syst in systems])
+
+    def save(self):
+        if self.fname is None:
+            return
+
+        dname = os.path.dirname(self.fname)
+        if dname and not os.path.isdir(dname):
+            os.makedirs(dname)
+
+        tmp_fname = self.fname + '.tmp'
+        with open(tmp_fname, 'wb') as fd:
+            pickle.dump(self.records, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fname, self.fname)
+
+def load_table(systems, fname=TABLE_FILE):
+    """ Load shared table and make sure it contains all `systems`
+    """
+    table = TopologyTable(fname)
+    if table.update(systems):
+        table.save()
+    return table
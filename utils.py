@@ -27,8 +27,8 @@ def extract(i, j, data):
     """
     return data[:,i], data[:,j]
 
-def compute_correlation_matrix(data, plot_hist=False, save_stdev=None):
-    """ Compute correlation matrix of given data points
+def replicate_correlation_matrices(data):
+    """ Compute correlation matrix of each replicate in `data` `(reps, steps, dim)`
     """
     dim = data.shape[2]
 
@@ -41,7 +41,50 @@ def compute_correlation_matrix(data, plot_hist=False, save_stdev=None):
                 cc = get_correlation(xs, ys)
                 mat[i, j] = cc
         mats.append(mat)
-    mats = np.array(mats)
+    return np.array(mats)
+
+def correlation_standard_error(mats):
+    """ Largest standard error of the mean of off-diagonal entries
+        over replicate correlation matrices `(reps, dim, dim)`.
+        Undefined (NaN) correlations are ignored
+    """
+    mats = np.asarray(mats)
+    if len(mats) < 2:
+        return np.inf
+
+    rows, cols = np.tril_indices(mats.shape[-1], k=-1)
+    vals = mats[:, rows, cols]
+
+    num = (~np.isnan(vals)).sum(axis=0)
+    used = num > 0
+    if not used.any():
+        return 0
+    if (num[used] < 2).any():
+        return np.inf
+
+    vals = vals[:, used]
+    return np.max(np.nanstd(vals, axis=0, ddof=1) / np.sqrt(num[used]))
+
+def replicate_batches(items, mat_lists, target_se=None, batch_size=10):
+    """ Split replicates `items` (e.g. seeds) into batches of `batch_size`
+        (a single batch without `target_se`). Stops early once every list of
+        correlation matrices in `mat_lists`, which the caller extends after each
+        batch, has a standard error of at most `target_se` or is still empty
+        (i.e. nothing passed the filters)
+    """
+    size = len(items) if target_se is None else batch_size
+    for start in range(0, len(items), max(size, 1)):
+        if start > 0 and all(
+            len(mats) == 0 or correlation_standard_error(mats) <= target_se
+                for mats in mat_lists
+        ):
+            return
+        yield items[start:start+size]
+
+def summarize_correlation_matrices(mats, plot_hist=False, save_stdev=None):
+    """ Average replicate correlation matrices
+    """
+    dim = mats.shape[-1]
 
     if plot_hist:
         plt.figure(figsize=(6, 14))
@@ -70,6 +113,12 @@ def compute_correlation_matrix(data, plot_hist=False, save_stdev=None):
     res_mat = np.mean(mats, axis=0)
     return res_mat
 
+def compute_correlation_matrix(data, plot_hist=False, save_stdev=None):
+    """ Compute correlation matrix of given data points
+    """
+    return summarize_correlation_matrices(
+        replicate_correlation_matrices(data), plot_hist, save_stdev)
+
 def cache_data(data, fname='results/data_cache'):
     """ Save data for later processing steps
     """
@@ -100,3 +149,45 @@ def list_diff(l1, l2):
     """ Return set difference while maintaining order
     """
     return [x for x in l1 if x not in l2]
+
+class HistogramAccumulator(object):
+    """ Histogram over fixed bins which is filled chunk by chunk
+    """
+    def __init__(self, bins):
+        self.edges = np.asarray(bins, dtype=float)
+        self.counts = np.zeros(self.edges.size - 1, dtype=np.int64)
+
+    def add(self, values):
+        """ Count (finite) values, those outside of the bin range are dropped
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        cur, _ = np.histogram(values[np.isfinite(values)], bins=self.edges)
+        self.counts += cur
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    @property
+    def centers(self):
+        return (self.edges[1:] + self.edges[:-1]) / 2
+
+    def density(self):
+        """ Normalize counts to unit area
+        """
+        widths = np.diff(self.edges)
+        return self.counts / (self.counts.sum() * widths)
+
+def cross_correlation(xs, ys):
+    """ Pearson correlations between all rows of `xs` and all rows of `ys`
+        (NaN for constant rows)
+    """
+    xs = np.atleast_2d(np.asarray(xs, dtype=float))
+    ys = np.atleast_2d(np.asarray(ys, dtype=float))
+
+    xs = xs - xs.mean(axis=1, keepdims=True)
+    ys = ys - ys.mean(axis=1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = np.outer(np.linalg.norm(xs, axis=1), np.linalg.norm(ys, axis=1))
+        return np.clip((xs @ ys.T) / norm, -1, 1)